@@ -0,0 +1,346 @@
+# Aleksander Nowicki and Samuel Young
+# Dartmouth CS60 25F Final Project
+# 11/21/2025
+# Async Runtime Module
+#
+# Runs a match on a single asyncio event loop instead of blocking sockets and threads. Receiving,
+# the fixed rate simulation ticks and drawing/reading the keyboard are each a coroutine, and the
+# sockets set up by the transport handshake are switched to non-blocking asyncio streams (TCP) or
+# datagram endpoints (UDP). Nothing ever blocks waiting on the remote player, and nothing spins on
+# a partly received message: the receiver just waits for more bytes.
+#
+# The game itself is the same as with threads. Rollback uses rollback_netcode's simulation_tick and
+# message queue (the receiver coroutine takes the listening thread's place), and delay uses
+# delay_netcode's DelayMatch.
+#
+# If the remote sends nothing for DISCONNECT_TIMEOUT seconds (no inputs, resends or checksums), or
+# closes the connection, the match ends.
+#
+# The rollback netcode keeps its match in module globals, so this still runs one match per process.
+#
+# Every coroutine shares one thread, so traced spans (see tracing) only cover work between awaits:
+# time spent waiting shows up as gaps in the trace rather than as spans.
+
+import asyncio
+import json
+import threading
+import time
+import fast_logic
+import wire_protocol
+import transport
+import network_emulator
+import render_loop
+import rollback_netcode
+import delay_netcode
+import replay
+import time_sync
+import tracing
+
+# Seconds without any message from the remote before it counts as disconnected
+DISCONNECT_TIMEOUT = 5
+
+# Seconds to wait for the remote's start message (rollback) before giving up
+START_TIMEOUT = 30
+
+# Most bytes read from a TCP stream at once
+RECEIVE_SIZE = 4096
+
+# TCP transport over an asyncio stream, sends are buffered by the event loop and never block
+class AsyncTcpTransport:
+    def __init__(self, stream_reader, stream_writer, loop):
+        self.kind = transport.TCP
+        self.stream_reader = stream_reader
+        self.stream_writer = stream_writer
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+
+    # Safe to call from any thread (the network emulator delivers from its own)
+    def send(self, data):
+        if threading.get_ident() == self.loop_thread:
+            self.stream_writer.write(data)
+        else:
+            self.loop.call_soon_threadsafe(self.stream_writer.write, data)
+
+    # Bytes received, b"" if the connection closed, None if nothing arrived within timeout seconds
+    async def receive(self, timeout=None):
+        try:
+            return await asyncio.wait_for(self.stream_reader.read(RECEIVE_SIZE), timeout)
+        except asyncio.TimeoutError:
+            return None
+        except OSError:
+            return b""
+
+    # Also safe from any thread, after any sends already made from it
+    def close(self):
+        if threading.get_ident() == self.loop_thread:
+            self.stream_writer.close()
+        else:
+            self.loop.call_soon_threadsafe(self.stream_writer.close)
+
+# Queues datagrams as they arrive for AsyncUdpTransport
+class DatagramQueue(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.queue = asyncio.Queue()
+
+    def datagram_received(self, data, address):
+        self.queue.put_nowait(data)
+
+    def error_received(self, error):
+        self.queue.put_nowait(b"") # Remote socket has closed (connection refused)
+
+    def connection_lost(self, error):
+        self.queue.put_nowait(b"")
+
+# UDP transport over an asyncio datagram endpoint
+class AsyncUdpTransport:
+    def __init__(self, datagram_transport, protocol, loop):
+        self.kind = transport.UDP
+        self.datagram_transport = datagram_transport
+        self.protocol = protocol
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+
+    # Safe to call from any thread (the network emulator delivers from its own)
+    def send(self, data):
+        if threading.get_ident() == self.loop_thread:
+            self.datagram_transport.sendto(data)
+        else:
+            self.loop.call_soon_threadsafe(self.datagram_transport.sendto, data)
+
+    # Bytes received, b"" if the connection closed, None if nothing arrived within timeout seconds
+    async def receive(self, timeout=None):
+        try:
+            return await asyncio.wait_for(self.protocol.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    # Also safe from any thread, after any sends already made from it
+    def close(self):
+        if threading.get_ident() == self.loop_thread:
+            self.datagram_transport.close()
+        else:
+            self.loop.call_soon_threadsafe(self.datagram_transport.close)
+
+# Switch a transport from the handshake (see transport) to asyncio, must be called on the event loop
+async def open_async_transport(game_transport):
+    loop = asyncio.get_running_loop()
+    game_transport.socket.setblocking(False)
+
+    if game_transport.kind == transport.UDP:
+        datagram_transport, protocol = await loop.create_datagram_endpoint(DatagramQueue, sock=game_transport.socket)
+        return AsyncUdpTransport(datagram_transport, protocol, loop)
+
+    stream_reader, stream_writer = await asyncio.open_connection(sock=game_transport.socket)
+    return AsyncTcpTransport(stream_reader, stream_writer, loop)
+
+# Hand every message in the reader's buffer and then every message received to handle_message, until
+# the connection closes, goes quiet for DISCONNECT_TIMEOUT or sends something invalid
+async def receive_loop(async_transport, reader, handle_message):
+    while True:
+        try:
+            with tracing.span("decode"):
+                message = reader.next_message()
+                while message is not None:
+                    handle_message(message)
+                    message = reader.next_message()
+        except ValueError as e:
+            print(f"Exception when receiving message: {e}")
+            return
+
+        data = await async_transport.receive(DISCONNECT_TIMEOUT)
+        if data is None:
+            print(f"Nothing received from remote player for {DISCONNECT_TIMEOUT}s, connection lost")
+            return
+        if not data:
+            print("Connection to remote player lost")
+            return
+        reader.feed(data)
+
+# Sleep until the tick after next_tick at frame_rate, returns the time of the tick slept until
+# A frame rate of 0 doesn't wait, just lets the other coroutines run. Ticks missed by more than a whole
+# tick are dropped rather than run back to back to catch up
+async def wait_for_tick(next_tick, frame_rate):
+    now = time.perf_counter()
+    if not frame_rate:
+        await asyncio.sleep(0)
+        return now
+
+    next_tick = max(next_tick + 1 / frame_rate, now - 1 / frame_rate)
+    await asyncio.sleep(max(0.0, next_tick - now))
+    return next_tick
+
+# Read the keyboard and draw until stop is set, in place of render_loop.run_render_loop
+async def render_task(window, local_input, snapshots, stop, frame_rate=render_loop.RENDER_FRAME_RATE):
+    next_tick = time.perf_counter()
+    while not stop.is_set():
+        with tracing.span("render"):
+            render_loop.render_step(window, local_input, snapshots, stop)
+        next_tick = await wait_for_tick(next_tick, frame_rate)
+
+# Rollback match, see rollback_netcode.run_game
+async def play_rollback(player_number, async_transport, send_transport, local_input, snapshots, stop,
+                        replay_path, max_frames, tick_rate, stats_path, input_delay_frames, max_input_delay_frames,
+                        snapshot_interval, predictor_name):
+    rollback_netcode.start_match(player_number, send_transport, replay_path, tick_rate, input_delay_frames, max_input_delay_frames,
+                                 snapshot_interval, predictor_name)
+
+    # Wait for the remote player's start message, resending ours until answered (see rollback_netcode.run_game)
+    reader = wire_protocol.MessageReader()
+    start_message = wire_protocol.encode_start(player_number)
+    deadline = time.perf_counter() + START_TIMEOUT
+    message = None
+    while message is None or message[0] not in (wire_protocol.MSG_START, wire_protocol.MSG_INPUTS):
+        message = reader.next_message()
+        if message is not None:
+            continue
+        if time.perf_counter() > deadline:
+            print("Remote player never started the game")
+            return 1
+        send_transport.send(start_message)
+        data = await async_transport.receive(rollback_netcode.START_RESEND_INTERVAL)
+        if data == b"":
+            print("Connection to remote player lost before the game started")
+            return 1
+        if data:
+            reader.feed(data)
+    print("Remote player ready, starting game")
+
+    rollback_netcode.frame_number += 1
+
+    # Takes the listening thread's place, messages go to the same queue
+    def queue_message(message):
+        if message[0] in (wire_protocol.MSG_INPUTS, wire_protocol.MSG_CHECKSUM):
+            rollback_netcode.received_messages.append((time.perf_counter(), message))
+
+    receiver = asyncio.create_task(receive_loop(async_transport, reader, queue_message))
+    start_time = time.perf_counter()
+
+    next_tick = time.perf_counter()
+    while not stop.is_set() and not rollback_netcode.reached_frame_limit(max_frames) and not receiver.done() \
+            and not rollback_netcode.connection_lost.is_set():
+        with tracing.span("tick", rollback_netcode.frame_number):
+            frame_rate = rollback_netcode.simulation_tick(local_input, snapshots, tick_rate)
+        next_tick = await wait_for_tick(next_tick, frame_rate)
+
+    seconds = time.perf_counter() - start_time
+
+    if rollback_netcode.reached_frame_limit(max_frames):
+        # Same as rollback_netcode.finish_match
+        deadline = time.perf_counter() + rollback_netcode.FINISH_TIMEOUT
+        finished = False
+        while not finished and not receiver.done() and not rollback_netcode.connection_lost.is_set() \
+                and time.perf_counter() < deadline:
+            finished = rollback_netcode.finish_step(max_frames)
+            if not finished:
+                await asyncio.sleep(rollback_netcode.START_RESEND_INTERVAL)
+        if not finished and rollback_netcode.history.first_unconfirmed_frame <= max_frames:
+            print(f"Remote inputs not confirmed up to frame {max_frames}")
+
+    receiver.cancel()
+    rollback_netcode.end_match(seconds, stats_path)
+    return 0
+
+# Delay match, see delay_netcode.run_game
+async def play_delay(player_number, async_transport, send_transport, local_input, snapshots, stop,
+                     replay_path, max_frames, tick_rate, stats_path, input_delay):
+    recorder = replay.ReplayWriter(replay_path) if replay_path else None
+    match = delay_netcode.DelayMatch(player_number, recorder, input_delay)
+
+    # Set once the remote's controls for the current frame have arrived
+    ready = asyncio.Event()
+
+    def handle_message(message):
+        match.handle_message(message)
+        if match.ready():
+            ready.set()
+
+    receiver = asyncio.create_task(receive_loop(async_transport, wire_protocol.MessageReader(), handle_message))
+    snapshots.publish(fast_logic.pack_state(match.game_state), time.perf_counter())
+
+    next_tick = time.perf_counter()
+    while not stop.is_set() and (max_frames is None or match.frame_number < max_frames):
+        with tracing.span("read input", match.frame_number):
+            local_control_state = fast_logic.unpack_controls(local_input.next_bits(match.frame_number))
+        with tracing.span("send", match.frame_number):
+            send_transport.send(match.outgoing_message(local_control_state))
+
+        # Wait for the remote player's inputs for this frame if they aren't here yet, or for the receiver to give up
+        wait_start = time.perf_counter()
+        if not match.ready():
+            ready.clear()
+            remote_control = asyncio.ensure_future(ready.wait())
+            await asyncio.wait({remote_control, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if not match.ready():
+                remote_control.cancel()
+                break
+
+        with tracing.span("simulate", match.frame_number):
+            game_state = match.advance(time.perf_counter() - wait_start)
+        snapshots.publish(game_state, time.perf_counter())
+
+        next_tick = await wait_for_tick(next_tick, tick_rate)
+
+    receiver.cancel()
+    print(match)
+
+    if recorder is not None:
+        recorder.close()
+    if stats_path is not None:
+        with open(stats_path, "w") as stats_file:
+            json.dump(match.stats(), stats_file, indent=2)
+    return 0
+
+async def play(mode, player_number, game_transport, impairment, replay_path, input_source, headless,
+               max_frames, tick_rate, stats_path, input_delay_frames, max_input_delay_frames, snapshot_interval, predictor_name):
+    async_transport = await open_async_transport(game_transport)
+    send_transport = async_transport
+    if impairment is not None:
+        send_transport = network_emulator.ImpairedTransport(async_transport, impairment)
+
+    # Shared between the simulation and render coroutines
+    local_input = input_source if input_source is not None else render_loop.InputLatch() # Game starts with no controls pressed
+    snapshots = render_loop.SnapshotBuffer()
+    stop = threading.Event()
+
+    renderer = None
+    if not headless:
+        window = render_loop.open_window()
+        renderer = asyncio.create_task(render_task(window, local_input, snapshots, stop))
+
+    if mode == "Rollback":
+        result = await play_rollback(player_number, async_transport, send_transport, local_input, snapshots, stop,
+                                     replay_path, max_frames, tick_rate, stats_path, input_delay_frames, max_input_delay_frames,
+                                     snapshot_interval, predictor_name)
+    else:
+        # Delay mode can't choose a delay within a range, see delay_netcode.run_game
+        input_delay = delay_netcode.choose_input_delay(input_delay_frames, max_input_delay_frames)
+        result = await play_delay(player_number, async_transport, send_transport, local_input, snapshots, stop,
+                                  replay_path, max_frames, tick_rate, stats_path, input_delay)
+
+    # Let the render coroutine know the game is over
+    stop.set()
+    if renderer is not None:
+        await renderer
+
+    if impairment is not None:
+        print(send_transport)
+        # Closing waits for what is still in emulated flight, which the loop has to keep running to send
+        await asyncio.get_running_loop().run_in_executor(None, send_transport.close)
+    else:
+        send_transport.close()
+    return result
+
+# Play a match in the given mode ("Delay" or "Rollback") on an asyncio event loop
+# game_transport comes from the transport handshake, impairment is network_emulator settings to apply to
+# what we send (None for none), and the rest are the same as the netcodes' run_game (snapshot_interval and
+# predictor_name are rollback only)
+def run_game(mode, player_number, game_transport, impairment=None, replay_path=None, input_source=None,
+             headless=False, max_frames=None, tick_rate=time_sync.FRAME_RATE, stats_path=None,
+             input_delay_frames=None, max_input_delay_frames=None, snapshot_interval=None, predictor_name="repeat"):
+    result = asyncio.run(play(mode, player_number, game_transport, impairment, replay_path, input_source,
+                              headless, max_frames, tick_rate, stats_path, input_delay_frames, max_input_delay_frames,
+                              snapshot_interval, predictor_name))
+
+    if not headless:
+        render_loop.close_window()
+    return result
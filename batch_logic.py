@@ -0,0 +1,93 @@
+# Aleksander Nowicki and Samuel Young
+# Dartmouth CS60 25F Final Project
+# 11/21/2025
+# Batch Game Logic Module
+#
+# Third simulation engine, stepping many independent games at once with NumPy (for bots and bulk
+# replay checking, the relay's referees step their single game with fast_logic). A batch of N games
+# is an (N, 6) integer array of states, rows in the same order as fast_logic's packed tuples, and
+# its controls are either an (N, 2) array of fast_logic control bitfields (player 1, player 2) or an
+# (N, 2, 3) boolean array of ControlState.make_list() values. Every rule in game_logic.update_state
+# is applied to the whole batch with array masks in place of branches, so each game gets exactly the
+# state update_state would give it. The benchmark checks this against fast_logic.step from random
+# states and controls every run.
+#
+# Requires numpy (pip install numpy), nothing else in the game does.
+
+import zlib
+import numpy as np
+import fast_logic
+from fast_logic import MIN_X, MAX_X, HIT_DISTANCE, ATK_BIT
+from game_logic import ATTACK_FRAMES, ATTACK_DAMAGE
+
+# Movement for every control bitfield, indexed by bitfield
+MOVE_DELTA = np.array(fast_logic.MOVE_DELTA, dtype=np.int64)
+
+# Bit each ControlState.make_list() entry sets, in list order (mv_l, mv_r, atk)
+CONTROL_LIST_BITS = np.array([fast_logic.MV_L_BIT, fast_logic.MV_R_BIT, fast_logic.ATK_BIT], dtype=np.uint8)
+
+# Array of n games at the starting state
+def initial_states(n) -> np.ndarray:
+    return np.tile(np.array(fast_logic.INITIAL_STATE, dtype=np.int64), (n, 1))
+
+# Array of the given packed states (fast_logic tuples)
+def pack_states(states) -> np.ndarray:
+    return np.array(states, dtype=np.int64).reshape(-1, 6)
+
+# List of packed states (fast_logic tuples) from an array of states
+def unpack_states(states) -> list:
+    return [tuple(row) for row in states.tolist()]
+
+# (N, 2) control bitfields from an (N, 2, 3) array of ControlState.make_list() values
+def pack_control_lists(control_lists) -> np.ndarray:
+    return (np.asarray(control_lists, dtype=bool) * CONTROL_LIST_BITS).sum(axis=-1, dtype=np.uint8)
+
+# Move a column of player positions by each game's controls, walls only checked in the direction of movement
+def move(x, bits):
+    delta = MOVE_DELTA[bits]
+    x = x + delta
+    return np.where(delta < 0, np.maximum(x, MIN_X), np.where(delta > 0, np.minimum(x, MAX_X), x))
+
+# Advance a column of attack frames, returns the new attack frames and the target's hp after any hits
+# player_distance is p2_x - p1_x at the moment the attack lands
+def attack(atk_frame, bits, player_distance, target_hp):
+    finishing = atk_frame == ATTACK_FRAMES
+    starting = (atk_frame == 0) & ((bits & ATK_BIT) != 0)
+    in_progress = (atk_frame != 0) & (atk_frame < ATTACK_FRAMES)
+
+    hit = finishing & (player_distance >= 0) & (player_distance <= HIT_DISTANCE)
+    target_hp = target_hp - hit * ATTACK_DAMAGE
+    atk_frame = np.where(finishing, 0, atk_frame + (starting | in_progress))
+    return atk_frame, target_hp
+
+# Takes an (N, 6) array of states and each game's controls, either (N, 2) bitfields or (N, 2, 3)
+# ControlState lists, and returns the (N, 6) array of next frame states
+# Same rules, in the same order, as game_logic.update_state
+def step(states, controls) -> np.ndarray:
+    controls = np.asarray(controls)
+    if controls.ndim == 3:
+        controls = pack_control_lists(controls)
+    p1_bits = controls[:, 0]
+    p2_bits = controls[:, 1]
+    p1_x, p1_hp, p1_atk_frame, p2_x, p2_hp, p2_atk_frame = states.T
+
+    # Player 1 moves and attacks first (p2 has not moved yet this frame)
+    p1_x = move(p1_x, p1_bits)
+    p1_atk_frame, p2_hp = attack(p1_atk_frame, p1_bits, p2_x - p1_x, p2_hp)
+
+    p2_x = move(p2_x, p2_bits)
+    p2_atk_frame, p1_hp = attack(p2_atk_frame, p2_bits, p2_x - p1_x, p1_hp)
+
+    return np.stack((p1_x, p1_hp, p1_atk_frame, p2_x, p2_hp, p2_atk_frame), axis=1)
+
+# Run every game through a sequence of controls, controls[i] is every game's controls for frame i
+# ((F, N, 2) bitfields or (F, N, 2, 3) ControlState lists), returns the final states
+def simulate(states, controls) -> np.ndarray:
+    for frame_controls in controls:
+        states = step(states, frame_controls)
+    return states
+
+# fast_logic.state_checksum of every game's state, as a list
+def state_checksums(states) -> list:
+    rows = states.astype(">i4") # Same bytes as fast_logic.STATE_STRUCT
+    return [zlib.crc32(row.tobytes()) for row in rows]
@@ -0,0 +1,262 @@
+# Aleksander Nowicki and Samuel Young
+# Dartmouth CS60 25F Final Project
+# 11/21/2025
+# Benchmark Program
+#
+# Headless benchmarks for the parts of a frame that have to fit in the 33ms frame budget:
+#   - simulation steps/s through game_logic.update_state and fast_logic.step, and batch_logic.step over many games
+#     (after checking batch_logic.step gives the same states and checksums as fast_logic.step)
+#   - rollback resimulation time for depths 1-60, through rollback_netcode.resimulate
+#   - encode/decode throughput of the delay (control) and rollback (inputs) wire messages
+#   - render_frame time, drawn to an offscreen window (SDL dummy video driver)
+#
+# Results are printed and written as JSON. Given a baseline JSON from an earlier run, each result is
+# compared against it and the program exits with status 1 if anything got slower than the tolerance,
+# or if the batch simulator no longer matches fast_logic.
+#
+# Usage: python3 benchmark.py [--output <results.json>] [--baseline <results.json>] [--tolerance <fraction>]
+
+import os
+import random
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy") # No window needed, must be set before pygame starts
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import sys
+import json
+import time
+import pygame
+import game_logic
+import fast_logic
+import rollback_history
+import rollback_netcode
+import delay_netcode
+import wire_protocol
+import numpy as np
+import batch_logic
+
+# Each measurement runs for at least this many seconds, best of REPEATS runs is kept
+MIN_TIME = 0.2
+REPEATS = 3
+
+# Rollback depths measured
+RESIM_DEPTHS = [1, 2, 4, 8, 15, 30, 60]
+
+# Snapshot interval of the sparse history also measured at the deepest rollback (see rollback_history)
+SPARSE_SNAPSHOT_INTERVAL = 8
+
+# Games stepped together by batch_logic
+BATCH_GAMES = 4096
+
+# Games and frames in the batch_logic check against fast_logic (600k steps), and its random seed
+BATCH_CHECK_GAMES = 2000
+BATCH_CHECK_FRAMES = 300
+BATCH_CHECK_SEED = 60
+
+# Messages decoded together, as when several arrive in one recv
+DECODE_BATCH = 8
+
+# Frame budget at 30fps in milliseconds
+FRAME_BUDGET_MS = 1000 / 30
+
+# Default allowed slowdown against a baseline before it counts as a regression
+DEFAULT_TOLERANCE = 0.2
+
+# Step random games through batch_logic.step and fast_logic.step with the same random controls,
+# results["batch_logic_matches"] is True if every state and the final checksums are identical
+def check_batch_logic(results, games=BATCH_CHECK_GAMES, frames=BATCH_CHECK_FRAMES, seed=BATCH_CHECK_SEED):
+    generator = random.Random(seed)
+
+    # Random positions, health and points in an attack, not only states reachable from the start
+    def random_state():
+        return (generator.randint(fast_logic.MIN_X, fast_logic.MAX_X), generator.randint(0, 100), generator.randint(0, game_logic.ATTACK_FRAMES),
+                generator.randint(fast_logic.MIN_X, fast_logic.MAX_X), generator.randint(0, 100), generator.randint(0, game_logic.ATTACK_FRAMES))
+
+    states = [random_state() for _ in range(games)]
+    batch_states = batch_logic.pack_states(states)
+    matches = True
+    for _ in range(frames):
+        controls = [(generator.randrange(8), generator.randrange(8)) for _ in range(games)]
+        states = [fast_logic.step(state, p1_bits, p2_bits) for state, (p1_bits, p2_bits) in zip(states, controls)]
+        batch_states = batch_logic.step(batch_states, np.array(controls, dtype=np.uint8))
+        if batch_logic.unpack_states(batch_states) != states:
+            matches = False
+            break
+
+    if matches:
+        matches = batch_logic.state_checksums(batch_states) == [fast_logic.state_checksum(state) for state in states]
+    results["batch_logic_matches"] = matches
+
+# Seconds per call of function, best of REPEATS runs of at least MIN_TIME each
+def time_per_call(function):
+    best = None
+    for _ in range(REPEATS):
+        calls = 0
+        start_time = time.perf_counter()
+        elapsed = 0
+        while elapsed < MIN_TIME:
+            function()
+            calls += 1
+            elapsed = time.perf_counter() - start_time
+        if best is None or elapsed / calls < best:
+            best = elapsed / calls
+    return best
+
+# Input pattern that walks both players around and attacks, 64 frames long
+def input_pattern():
+    return [((frame // 8) % 4, ((frame // 5) % 3) | (fast_logic.ATK_BIT if frame % 16 == 0 else 0)) for frame in range(64)]
+
+def benchmark_simulation(results):
+    pattern = input_pattern()
+    control_pattern = [(fast_logic.unpack_controls(p1_bits), fast_logic.unpack_controls(p2_bits)) for p1_bits, p2_bits in pattern]
+
+    def run_update_state():
+        game_state = game_logic.GameState()
+        for p1_control_state, p2_control_state in control_pattern:
+            game_state = game_logic.update_state(game_state, p1_control_state, p2_control_state)
+
+    def run_fast_step():
+        state = fast_logic.INITIAL_STATE
+        step = fast_logic.step
+        for p1_bits, p2_bits in pattern:
+            state = step(state, p1_bits, p2_bits)
+
+    # Every game plays the pattern from a different point in it
+    batch_controls = np.array([[pattern[(frame + game) % len(pattern)] for game in range(BATCH_GAMES)]
+                                           for frame in range(len(pattern))], dtype=np.uint8)
+
+    def run_batch_step():
+        batch_logic.simulate(batch_logic.initial_states(BATCH_GAMES), batch_controls)
+
+    results["update_state_steps_per_sec"] = len(pattern) / time_per_call(run_update_state)
+    results["fast_step_steps_per_sec"] = len(pattern) / time_per_call(run_fast_step)
+    results["batch_step_steps_per_sec"] = len(pattern) * BATCH_GAMES / time_per_call(run_batch_step)
+
+# Time rollbacks of each depth, with a history keeping a state every snapshot_interval frames
+def benchmark_resimulation(results, snapshot_interval=1, depths=RESIM_DEPTHS):
+    # Set up the rollback module as player 1 with a history holding enough frames
+    rollback_netcode.player_num = 1
+    history = rollback_history.RollbackHistory(snapshot_interval=snapshot_interval, step=rollback_netcode.step_frame)
+    rollback_netcode.history = history
+
+    history.append(fast_logic.NO_CONTROLS, fast_logic.NO_CONTROLS, fast_logic.INITIAL_STATE)
+    history.confirm_remote_input(0, fast_logic.NO_CONTROLS)
+    for frame in range(1, max(depths) + 2):
+        history.append(fast_logic.NO_CONTROLS, fast_logic.NO_CONTROLS, fast_logic.INITIAL_STATE)
+
+    for depth in depths:
+        # Flip the remote input of frame 1 between left and right each run, so every later state
+        # changes and the resimulation can never end early
+        corrected_bits = [fast_logic.MV_L_BIT]
+
+        def run_resimulation():
+            corrected_bits[0] ^= fast_logic.MV_L_BIT | fast_logic.MV_R_BIT
+            history.set_remote_input(1, corrected_bits[0])
+            rollback_netcode.resimulate(1, depth + 1)
+
+        name = f"resim_depth_{depth}" if snapshot_interval == 1 else f"resim_depth_{depth}_snapshot_{snapshot_interval}"
+        results[name + "_ms"] = time_per_call(run_resimulation) * 1000
+
+def benchmark_codecs(results):
+    control_state = game_logic.ControlState(mv_l=True, atk=True)
+    control_messages = b"".join(delay_netcode.encode_control_message(1000 + i, control_state) for i in range(DECODE_BATCH))
+
+    inputs = [fast_logic.MV_L_BIT] * 5 + [fast_logic.MV_L_BIT | fast_logic.ATK_BIT] * 3
+    inputs_messages = b"".join(wire_protocol.encode_inputs(1000 + i, 990 + i, 0, inputs) for i in range(DECODE_BATCH))
+
+    def decode_all(data):
+        reader = wire_protocol.MessageReader()
+        reader.feed(data)
+        while reader.next_message() is not None:
+            pass
+
+    results["delay_encode_msgs_per_sec"] = 1 / time_per_call(lambda: delay_netcode.encode_control_message(1000, control_state))
+    results["delay_decode_msgs_per_sec"] = DECODE_BATCH / time_per_call(lambda: decode_all(control_messages))
+    results["rollback_encode_msgs_per_sec"] = 1 / time_per_call(lambda: wire_protocol.encode_inputs(1000, 990, 0, inputs))
+    results["rollback_decode_msgs_per_sec"] = DECODE_BATCH / time_per_call(lambda: decode_all(inputs_messages))
+
+def benchmark_render(results):
+    pygame.init()
+    window = pygame.display.set_mode((game_logic.WINDOW_WIDTH, game_logic.WINDOW_HEIGHT))
+
+    # Render a different state every call, as in a game where something is always moving
+    states = []
+    state = fast_logic.INITIAL_STATE
+    for p1_bits, p2_bits in input_pattern():
+        state = fast_logic.step(state, p1_bits, p2_bits)
+        states.append(fast_logic.unpack_state(state))
+    next_state = [0]
+
+    def run_render():
+        game_logic.render_frame(states[next_state[0] % len(states)], window)
+        next_state[0] += 1
+
+    results["render_frame_ms"] = time_per_call(run_render) * 1000
+    pygame.quit()
+
+# Per second results are better higher, everything else (times) lower
+def higher_is_better(name):
+    return name.endswith("_per_sec")
+
+# Print how results compare to a baseline, returns the names of results that regressed
+def compare_to_baseline(results, baseline, tolerance):
+    regressions = []
+    for name, value in results.items():
+        if name not in baseline or not isinstance(value, (int, float)) or isinstance(value, bool):
+            continue
+        old_value = baseline[name]
+        if higher_is_better(name):
+            change = value / old_value - 1
+            regressed = value < old_value * (1 - tolerance)
+        else:
+            change = old_value / value - 1
+            regressed = value > old_value * (1 + tolerance)
+
+        marker = "REGRESSION" if regressed else ""
+        print(f"  {name:32} {old_value:14.4f} -> {value:14.4f} ({change:+.1%} speed) {marker}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    options = {"--output": None, "--baseline": None, "--tolerance": str(DEFAULT_TOLERANCE)}
+    arguments = sys.argv[1:]
+    while arguments:
+        if arguments[0] not in options or len(arguments) < 2:
+            print("Usage: python3 benchmark.py [--output <results.json>] [--baseline <results.json>] [--tolerance <fraction>]")
+            sys.exit(1)
+        options[arguments[0]] = arguments[1]
+        arguments = arguments[2:]
+
+    results = {}
+    check_batch_logic(results)
+    benchmark_simulation(results)
+    benchmark_resimulation(results)
+    benchmark_resimulation(results, SPARSE_SNAPSHOT_INTERVAL, [max(RESIM_DEPTHS)])
+    benchmark_codecs(results)
+    benchmark_render(results)
+
+    # Worst frame in the budget: a full depth rollback plus drawing
+    worst_frame_ms = results[f"resim_depth_{max(RESIM_DEPTHS)}_ms"] + results["render_frame_ms"]
+    results["worst_frame_ms"] = worst_frame_ms
+    results["fits_frame_budget"] = worst_frame_ms < FRAME_BUDGET_MS
+
+    for name, value in results.items():
+        print(f"{name:34} {value}")
+
+    output = json.dumps(results, indent=2)
+    if options["--output"]:
+        with open(options["--output"], "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+
+    failed = not results["fits_frame_budget"] or not results["batch_logic_matches"]
+    if options["--baseline"]:
+        with open(options["--baseline"]) as baseline_file:
+            baseline = json.load(baseline_file)
+        print("Compared to baseline:")
+        if compare_to_baseline(results, baseline, float(options["--tolerance"])):
+            failed = True
+
+    sys.exit(1 if failed else 0)
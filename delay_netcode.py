@@ -5,124 +5,272 @@
 #
 # Functions to run game from game_logic with a delay based netcode
 # The game will wait to receive inputs from the remote player before advancing the frame
+#
+# Inputs are pipelined: the controls read on a frame are sent for the frame input_delay frames later,
+# and received controls are kept by frame number until their frame comes up. With input_delay frames
+# in flight the remote's inputs usually arrive before they are needed, so a frame only waits when
+# they haven't (a round trip longer than input_delay frames, or a late packet) rather than every
+# frame waiting a whole round trip. With no input delay every frame waits, as in plain lockstep, so
+# matches use DEFAULT_INPUT_DELAY unless given another.
 
 import game_logic
-import socket
+import fast_logic
+import wire_protocol
+import replay
+import desync_detector
 import time
-import random
-import pygame
+import threading
+import render_loop
+import time_sync
 import json
+from telemetry import metrics
+import tracing
+
+# Normal game speed
+TICK_RATE = 30
+
+# Frames ahead inputs are sent unless told otherwise, covers a round trip of up to ~66ms at 30fps without waiting
+DEFAULT_INPUT_DELAY = 2
 
-# Constant - indicates whether player 2's connection is bad (simulated)
-BAD_CONNECTION = False
+# Frames that waited longer than this many seconds for the remote's inputs count as stalled
+STALL_THRESHOLD = 0.005
 
-# Returns byte message in format FS|frame_number|control_state|\n
+# Returns byte message with the frame number and control state in the wire_protocol control format
 def encode_control_message(frame_number, control_state):
-    try:
-        message = "FS" + "|" + str(frame_number) + "|" + json.dumps(control_state.make_list()) + "|\n"
-        return message.encode()
-    except Exception as e:
-        print(f"The following error occured trying to encode the message: {e}")
-        raise Exception("Message Encoding Error")
-
-# Decode the first message in the buffer, returning frame_number and control_state from that message + rest of buffer
-def decode_buffer_first_message(buffer):
-    try:
-        message = buffer.decode()
-        #print(message)
-        split_message = message.split("|") # Can't be typical , because json
-        frame_number = int(split_message[1])
-        control_state_list = json.loads(split_message[2])
-        control_state = game_logic.ControlState(control_state_list=control_state_list)
-
-        remaining_buffer = (message.partition("|\n")[2]).encode()
-
-        return frame_number, control_state, remaining_buffer
-    except Exception as e:
-        print(f"The following error occured trying to decode the received message: {e}")
-        raise Exception("Message Decoding Error")
+    return wire_protocol.encode_control(frame_number, fast_logic.pack_controls(control_state))
 
+# Input delay to play with for run_game's input_delay_frames and max_input_delay_frames. Delay mode can't
+# measure the round trip time to choose one, so given a range it uses the most, and given neither the default
+def choose_input_delay(input_delay_frames=None, max_input_delay_frames=None):
+    if max_input_delay_frames is not None:
+        return max_input_delay_frames
+    if input_delay_frames is not None:
+        return input_delay_frames
+    return DEFAULT_INPUT_DELAY
 
-# Main game setup / loop
-def run_game(player_number, remote_socket):
-    # First time only setup code
-    pygame.init()
+# Hand messages from the reader's buffer to the match until it has the remote's controls for its current frame
+# Blocks receiving from the transport when the buffer runs dry, returns False if the connection closed
+def receive_until_ready(match, remote_transport, reader):
+    while not match.ready():
+        message = reader.next_message()
+        if message is not None:
+            match.handle_message(message)
+            continue
 
-    window = pygame.display.set_mode((game_logic.WINDOW_WIDTH, game_logic.WINDOW_HEIGHT))
+        data = remote_transport.recv()
+        if not data:
+            return False
+        reader.feed(data)
+    return True
 
-    pygame.display.set_caption(game_logic.GAME_NAME)
 
-    clock = pygame.time.Clock()
+# One delay based match, everything about it except how messages are sent, received and waited for
+# Shared by the threaded simulation loop below and the asyncio runtime (see async_runtime)
+class DelayMatch:
+    def __init__(self, player_number, recorder=None, input_delay=0):
+        self.player_number = player_number
+        self.recorder = recorder # Replay file writer (None if not recording)
+        self.input_delay = input_delay # Frames between reading the local controls and playing them
+        metrics.set("input_delay_frames", input_delay)
 
-    game_state = game_logic.GameState(p1_x=100, p2_x=700)
+        self.game_state = game_logic.GameState(p1_x=100, p2_x=700)
+        self.frame_number = 0 # Next frame to play
 
-    local_control_state = game_logic.ControlState() # Game starts with no controls pressed
-    remote_control_state = game_logic.ControlState() # Game starts with no controls pressed
+        # Controls for frames not played yet, frame: ControlState
+        self.local_controls = {}
+        self.remote_controls = {}
+        self.next_send_frame = 0 # Next frame to send our controls for
 
-    # Game Loop
-    frame_number = 0
-    running = True
-    while running:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT: # Check if player closed game window
-                running = False
-
-            # Get local input
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_a: # a moves player left
-                    local_control_state.mv_l = True
-                elif event.key == pygame.K_d: # d moves player right
-                    local_control_state.mv_r = True
-                elif event.key == pygame.K_s: # s is player's attack
-                    local_control_state.atk = True
-
-            if event.type == pygame.KEYUP:
-                if event.key == pygame.K_a: # a moves player left
-                    local_control_state.mv_l = False
-                elif event.key == pygame.K_d: # d moves player right
-                    local_control_state.mv_r = False
-                elif event.key == pygame.K_s: # s is players's attack
-                    local_control_state.atk = False
-
-        
-        
-        # Introduce random delay to simulate bad network connection if that mode is enabled
-        if player_number == 2 and BAD_CONNECTION:
-            time.sleep(0.1*random.random())
-
-        # Transmit our control state, then wait for other player's controls, may block here indefinetely
-        remote_socket.send(encode_control_message(frame_number, local_control_state))
-
-        # Buffer for received messages
-        buffer = b""
-
-        # Keep trying to receive inputs until it gets valid inputs
-        while True:
-            try:
-                #remote_frame_number, remote_control_state = decode_control_message(remote_socket.recv(1024))
-                buffer += remote_socket.recv(1024)
-                remote_frame_number, remote_control_state, buffer = decode_buffer_first_message(buffer)
-
-                break
-            except Exception as e:
-                print(f"Exception when receiving packet: {e}")
-                continue
-
-        game_logic.render_frame(game_state, window)
+        # Compares our state checksums against the remote's, its counters show whether we've desynced
+        self.detector = desync_detector.DesyncDetector()
+
+        # Match counters, printed when the game ends
+        self.stalled_frames = 0 # Frames that had to wait for the remote's inputs
+        self.stall_seconds = 0.0 # Total time spent waiting
+        self.start_time = time.perf_counter()
+
+    # Readable string summary of the match counters
+    def __str__(self):
+        return ("frames: " + str(self.frame_number) + "\n"
+              + "stalled frames: " + str(self.stalled_frames) + "\n"
+              + f"stall time: {self.stall_seconds:.3f}s" + "\n"
+              + "input delay: " + str(self.input_delay) + " frames" + "\n"
+              + str(self.detector))
+
+    # Message with the controls just read for the frame input_delay frames from now, and any checksums the
+    # remote still needs (see desync_detector). The first message also covers the frames before that with
+    # no controls pressed
+    def outgoing_message(self, local_control_state):
+        msg_bytes = bytearray()
+        for frame in range(self.next_send_frame, self.frame_number + self.input_delay + 1):
+            control_state = local_control_state if frame >= self.input_delay else game_logic.ControlState()
+            self.local_controls[frame] = control_state
+            msg_bytes += encode_control_message(frame, control_state)
+        self.next_send_frame = self.frame_number + self.input_delay + 1
+
+        for checksum_frame, checksum in self.detector.outgoing_checksums():
+            msg_bytes += wire_protocol.encode_checksum(checksum_frame, checksum)
+        return bytes(msg_bytes)
+
+    # Handle a decoded message, keeping the remote's controls until their frame is played
+    def handle_message(self, message):
+        if message[0] == wire_protocol.MSG_CONTROL:
+            msg_type, frame_number, control_bits = message
+            if frame_number >= self.frame_number:
+                self.remote_controls[frame_number] = fast_logic.unpack_controls(control_bits)
+        elif message[0] == wire_protocol.MSG_CHECKSUM:
+            msg_type, checksum_frame, checksum = message
+            self.detector.add_remote(checksum_frame, checksum)
+        # Nothing else to do with other messages in delay mode
+
+    # True once the remote's controls for the current frame have arrived
+    def ready(self):
+        return self.frame_number in self.remote_controls
+
+    # Play the current frame with both players' controls, once ready, wait_time is how long we waited for the remote's
+    # Returns the new game state packed (see fast_logic)
+    def advance(self, wait_time):
+        local_control_state = self.local_controls.pop(self.frame_number)
+        remote_control_state = self.remote_controls.pop(self.frame_number)
+
+        metrics.increment("frames")
+        metrics.observe("remote_wait_seconds", wait_time)
+        if wait_time > STALL_THRESHOLD:
+            self.stalled_frames += 1
+            self.stall_seconds += wait_time
+            metrics.increment("stalled_frames")
 
         # Player 1 is left, player 2 right
-        if player_number == 1:
-            game_state = game_logic.update_state(game_state, local_control_state, remote_control_state)
-        elif player_number == 2:
-            game_state = game_logic.update_state(game_state, remote_control_state, local_control_state)
+        if self.player_number == 1:
+            p1_control_state, p2_control_state = local_control_state, remote_control_state
+        else:
+            p1_control_state, p2_control_state = remote_control_state, local_control_state
+        self.game_state = game_logic.update_state(self.game_state, p1_control_state, p2_control_state)
+        packed_state = fast_logic.pack_state(self.game_state)
+
+        # Every frame is final as soon as it is simulated in delay mode
+        if self.recorder is not None:
+            self.recorder.record_frame(fast_logic.pack_controls(p1_control_state), fast_logic.pack_controls(p2_control_state), packed_state)
+
+        # Every frame is confirmed in delay mode, so check them against the remote straight away
+        if self.detector.is_checksum_frame(self.frame_number + 1):
+            checksum = fast_logic.state_checksum(packed_state)
+            self.detector.add_local(self.frame_number + 1, checksum)
+
+        self.frame_number += 1
+        return packed_state
+
+    # Match counters and the final state as a dictionary, written out by --stats-out
+    def stats(self):
+        seconds = time.perf_counter() - self.start_time
+        return {
+            "mode": "Delay",
+            "player": self.player_number,
+            "frames": self.frame_number,
+            "seconds": seconds,
+            "frames_per_sec": self.frame_number / seconds if seconds > 0 else 0,
+            "stalled_frames": self.stalled_frames,
+            "stall_seconds": self.stall_seconds,
+            "input_delay": self.input_delay,
+            "checks": self.detector.checks,
+            "mismatches": self.detector.mismatches,
+            "first_desync_frame": self.detector.first_desync_frame,
+            "final_frame": self.frame_number,
+            "final_checksum": fast_logic.state_checksum(fast_logic.pack_state(self.game_state)),
+        }
+
+# Runs the game simulation at tick_rate (30fps, 0 for as fast as possible) until stop is set, max_frames
+# frames have been played or the connection is lost
+# Reads local controls from local_input (see input_source) and publishes each new state to snapshots (see render_loop)
+def simulation_loop(match, remote_transport, local_input, snapshots, stop, max_frames=None, tick_rate=TICK_RATE):
+    clock = time_sync.FrameClock()
+
+    # Buffer for received messages, kept between frames so no received bytes are dropped
+    reader = wire_protocol.MessageReader()
 
-        frame_number += 1
+    snapshots.publish(fast_logic.pack_state(match.game_state), time.perf_counter())
 
-        clock.tick(30) # Lock the game at 30fps, all timings are based on framerate, so this controls run speed
-    
-    # Quit Pygame
-    pygame.quit()
+    # Game Loop
+    while not stop.is_set() and (max_frames is None or match.frame_number < max_frames):
+        # Get local input
+        with tracing.span("read input", match.frame_number):
+            local_control_state = fast_logic.unpack_controls(local_input.next_bits(match.frame_number))
+
+        # Transmit our control state, then wait for other player's controls if they aren't here yet, may block here indefinetely
+        # The remote may have finished and closed the connection, so sending can fail as well as receiving
+        wait_start = time.perf_counter()
+        try:
+            with tracing.span("send", match.frame_number):
+                remote_transport.send(match.outgoing_message(local_control_state))
+
+            # Wait for the remote player's inputs for this frame
+            wait_start = time.perf_counter()
+            with tracing.span("wait for remote", match.frame_number):
+                received = receive_until_ready(match, remote_transport, reader)
+        except (OSError, ValueError) as e:
+            print(f"Exception when sending or receiving packet: {e}")
+            received = False
+
+        if not received:
+            print("Connection to remote player lost")
+            break
+
+        with tracing.span("simulate", match.frame_number):
+            game_state = match.advance(time.perf_counter() - wait_start)
+        snapshots.publish(game_state, time.perf_counter())
+
+        with tracing.span("sleep"):
+            clock.tick(tick_rate) # Lock the game at 30fps, all timings are based on framerate, so this controls run speed
+
+    print(match)
+
+    # Let the render loop know the game is over
+    stop.set()
+
+# Main game setup / loop
+# If replay_path is given, every frame's inputs are recorded to that file (see replay module)
+# input_source is where the local controls come from (see input_source), the keyboard if None
+# headless runs without a window, max_frames ends the match after that many frames, tick_rate is the
+# frames per second to run at (0 for as fast as possible) and stats_path is a file to write the match counters to
+# input_delay_frames is how many frames ahead inputs are sent (DEFAULT_INPUT_DELAY if None), given a range
+# (max_input_delay_frames) the most is used, see choose_input_delay
+def run_game(player_number, remote_transport, replay_path=None, input_source=None, headless=False,
+             max_frames=None, tick_rate=TICK_RATE, stats_path=None, input_delay_frames=None, max_input_delay_frames=None):
+    # First time only setup code
+    recorder = replay.ReplayWriter(replay_path) if replay_path else None
+
+    # Shared between the simulation thread and the render loop on this thread
+    local_input = input_source if input_source is not None else render_loop.InputLatch() # Game starts with no controls pressed
+    snapshots = render_loop.SnapshotBuffer()
+    stop = threading.Event()
+    match = DelayMatch(player_number, recorder, choose_input_delay(input_delay_frames, max_input_delay_frames))
+
+    if headless:
+        # Nothing to draw, just simulate here
+        simulation_loop(match, remote_transport, local_input, snapshots, stop, max_frames, tick_rate)
+        finished = True
+    else:
+        window = render_loop.open_window()
+
+        simulation = threading.Thread(target=simulation_loop, args=(match, remote_transport, local_input, snapshots, stop, max_frames, tick_rate), name="simulation", daemon=True)
+        simulation.start()
+
+        # Draw and read the keyboard until the window closes or the simulation ends
+        render_loop.run_render_loop(window, local_input, snapshots, stop)
+
+        # Simulation may be waiting on the remote, only wait for it briefly
+        simulation.join(1)
+        finished = not simulation.is_alive()
+
+    if recorder is not None and finished:
+        recorder.close()
+
+    if stats_path is not None and finished:
+        with open(stats_path, "w") as stats_file:
+            json.dump(match.stats(), stats_file, indent=2)
+
+    if not headless:
+        render_loop.close_window()
 
     # Finished successfully
     return 0
-
@@ -0,0 +1,105 @@
+# Aleksander Nowicki and Samuel Young
+# Dartmouth CS60 25F Final Project
+# 11/21/2025
+# Desync Detector Module
+#
+# Compares checksums of confirmed game states between the two players. Every CHECKSUM_INTERVAL
+# frames each player hashes its final (confirmed) state with fast_logic.state_checksum and sends
+# the hash along with its control messages. Whichever of the local and remote checksum for a
+# frame turns up second triggers the comparison, so a desync is caught within about
+# CHECKSUM_INTERVAL frames plus the time it takes the remote's inputs to be confirmed.
+#
+# Messages can be lost (UDP), so a checksum is sent with every control message (outgoing_checksums)
+# until the remote's checksum for the same frame arrives. A remote checksum for a frame already
+# compared means the remote is still waiting for ours, so ours is sent once more in answer.
+
+# Frames between checksums
+CHECKSUM_INTERVAL = 10
+
+# Most checksums kept waiting for the other side's, older ones are dropped (their message was lost)
+MAX_PENDING = 32
+
+class DesyncDetector:
+    def __init__(self, interval=CHECKSUM_INTERVAL):
+        self.interval = interval
+
+        # Checksums waiting for the other player's for the same frame, frame: checksum
+        self.local_checksums = {}
+        self.remote_checksums = {}
+
+        # Our checksums to send with every message until the remote's for the same frame arrives, frame: checksum
+        self.unanswered_checksums = {}
+        # Our recent checksums, to answer a remote still resending its own, frame: checksum
+        self.sent_checksums = {}
+        # Our checksums to send once with the next message, frame: checksum
+        self.answers = {}
+
+        # Counters
+        self.checks = 0 # Frames compared
+        self.mismatches = 0 # Frames whose checksums differed
+
+        self.last_matching_frame = 0 # Newest frame compared equal before the first desync
+        self.first_desync_frame = None # First frame compared unequal, None while in sync
+
+    # Readable string summary of the counters
+    def __str__(self):
+        return ("checks: " + str(self.checks) + "\n"
+              + "mismatches: " + str(self.mismatches) + "\n"
+              + "first desync frame: " + str(self.first_desync_frame))
+
+    # True if a checksum should be taken of the given frame
+    def is_checksum_frame(self, frame):
+        return frame % self.interval == 0
+
+    # True once any compared frame has differed
+    def is_desynced(self):
+        return self.first_desync_frame is not None
+
+    # Record the checksum of our own final state for a frame, returns False if it shows a desync
+    def add_local(self, frame, checksum):
+        self.store(self.sent_checksums, frame, checksum)
+        if frame in self.remote_checksums:
+            self.store(self.answers, frame, checksum) # The remote still needs ours
+            return self.compare(frame, checksum, self.remote_checksums.pop(frame))
+        self.store(self.local_checksums, frame, checksum)
+        self.store(self.unanswered_checksums, frame, checksum)
+        return True
+
+    # Record a checksum received from the remote player, returns False if it shows a desync
+    def add_remote(self, frame, checksum):
+        self.unanswered_checksums.pop(frame, None)
+        if frame in self.local_checksums:
+            return self.compare(frame, self.local_checksums.pop(frame), checksum)
+        if frame in self.sent_checksums:
+            # Already compared, the remote is resending because ours hasn't reached it
+            self.store(self.answers, frame, self.sent_checksums[frame])
+            return True
+        self.store(self.remote_checksums, frame, checksum)
+        return True
+
+    # Our checksums to send with the next message as (frame, checksum) pairs, oldest first
+    def outgoing_checksums(self):
+        if self.answers:
+            outgoing = dict(self.unanswered_checksums)
+            outgoing.update(self.answers)
+            self.answers = {}
+            return sorted(outgoing.items())
+        return list(self.unanswered_checksums.items())
+
+    def store(self, pending, frame, checksum):
+        pending[frame] = checksum
+        if len(pending) > MAX_PENDING:
+            del pending[min(pending)]
+
+    def compare(self, frame, local_checksum, remote_checksum):
+        self.checks += 1
+        if local_checksum == remote_checksum:
+            if self.first_desync_frame is None and frame > self.last_matching_frame:
+                self.last_matching_frame = frame
+            return True
+
+        self.mismatches += 1
+        if self.first_desync_frame is None or frame < self.first_desync_frame:
+            self.first_desync_frame = frame
+            print(f"Desync detected: states differ at frame {frame}, last matched at frame {self.last_matching_frame}")
+        return False
@@ -6,13 +6,105 @@
 # Main driver program for our netocode project
 # Takes command line args / user input for game options
 # Calls other modules to run the game
+#
+# Only what is needed to connect is imported up front. The netcode modules (and pygame, with a
+# window) are loaded on another thread while waiting for the remote player, so the match starts as
+# soon as the connection is made. Headless players never load pygame at all.
 
+import telemetry # First, its import time is the start time for time to first frame
 import sys
 import socket
-import delay_netcode
-import rollback_netcode
+import threading
+import time
+import importlib
+import transport
+import network_emulator
+import input_source
+import input_prediction
+import game_logic
+import time_sync
+import tracing
+
+COMMAND_USAGE_INSTRUCTIONS = ("Usage: (Server) python3 driver.py <Port> [options] OR (Client) python3 driver.py <IP> <Port> [options]\n"
+    + "Options: --record <replay file>, --impair <settings> (e.g. delay=50,jitter=10,loss=0.02, see network_emulator),\n"
+    + "  --mode <delay|rollback>, --transport <tcp|udp> (server only, skip the prompts), --input <keyboard|random[:seed]|script:<script>>,\n"
+    + "  --headless, --frames <frames to play>, --tick-rate <frames per second, 0 for uncapped>, --stats-out <json file>,\n"
+    + "  --runtime <threads|asyncio>, --input-delay <frames|auto|min-max>, --metrics-out <jsonl file>, --metrics-port <port>,\n"
+    + "  --trace-out <json file>, --predict <repeat|movement|none>, --snapshot-interval <frames>")
+
+# Options that can be given anywhere on the command line as "--option value", and their defaults
+OPTION_DEFAULTS = {
+    "--record": None, # Replay file to record the match to
+    "--impair": None, # Network impairment to emulate on everything we send, see network_emulator
+    "--mode": None, # Netcode mode for the server, asked for if not given
+    "--transport": None, # Transport for the server, asked for if not given
+    "--input": "keyboard", # Where local controls come from, see input_source
+    "--frames": None, # Frames to play before the game ends by itself
+    "--tick-rate": "30", # Frames per second, 0 for as fast as possible
+    "--stats-out": None, # File to write match counters to as JSON
+    "--runtime": "threads", # Blocking sockets and threads, or a single asyncio event loop (see async_runtime)
+    "--input-delay": None, # Local input delay frames, fixed or chosen automatically in a range (delay mode uses the most), each netcode's default if not given
+    "--predict": "repeat", # How to guess the remote's inputs until they arrive, see input_prediction (rollback only)
+    "--snapshot-interval": None, # Frames between game states the rollback history keeps, see rollback_history (rollback only)
+    "--metrics-out": None, # File to append netcode metrics to as JSON lines while the game runs, see telemetry
+    "--metrics-port": None, # Port to serve netcode metrics on in the Prometheus text format, see telemetry
+    "--trace-out": None, # File to write a Chrome trace of every frame's phases to, see tracing
+}
+
+# Options that take no value, True if given
+FLAG_OPTIONS = {
+    "--headless", # No window, for bots
+}
+
+# Returns command arguments with any options taken out, and a dictionary of option values
+def parse_options(command_arguments):
+    options = dict(OPTION_DEFAULTS)
+    for flag in FLAG_OPTIONS:
+        options[flag] = False
+    remaining_arguments = []
+
+    i = 0
+    while i < len(command_arguments):
+        if command_arguments[i] in FLAG_OPTIONS:
+            options[command_arguments[i]] = True
+            i += 1
+        elif command_arguments[i] in options:
+            if i + 1 >= len(command_arguments):
+                print(f"{command_arguments[i]} needs a value!")
+                print(COMMAND_USAGE_INSTRUCTIONS)
+                sys.exit(1)
+            options[command_arguments[i]] = command_arguments[i + 1]
+            i += 2
+        else:
+            remaining_arguments.append(command_arguments[i])
+            i += 1
 
-COMMAND_USAGE_INSTRUCTIONS = "Usage: (Server) python3 driver.py <Port> OR (Client) python3 driver.py <IP> <Port>"
+    return remaining_arguments, options
+
+# Returns the least and most local input delay frames for an --input-delay value, "2" for a fixed delay,
+# "auto" or "1-3" for a delay chosen from the measured round trip time, (None, None) for the netcode's default
+# Raises ValueError if invalid
+def parse_input_delay(description):
+    if description is None:
+        return None, None
+    if description == "auto":
+        return 0, time_sync.MAX_INPUT_DELAY
+    low, separator, high = description.partition("-")
+    if not low.isdigit() or (separator and not high.isdigit()):
+        raise ValueError("--input-delay must be a number of frames, auto or <min>-<max>")
+    high = high if separator else low
+    if int(high) < int(low):
+        raise ValueError("--input-delay maximum is below its minimum")
+    return int(low), int(high)
+
+# Returns the frames between kept rollback states for a --snapshot-interval value, None for the netcode's default
+# Raises ValueError if invalid
+def parse_snapshot_interval(description):
+    if description is None:
+        return None
+    if not description.isdigit() or int(description) < 1:
+        raise ValueError("--snapshot-interval must be a number of frames, at least 1")
+    return int(description)
 
 # Returns mode, ip, port
 def parse_args(command_arguments):
@@ -67,36 +159,174 @@ def parse_args(command_arguments):
         print(COMMAND_USAGE_INSTRUCTIONS)
         sys.exit(1)
 
-# Get the mode to run the game in for server
-def get_mode():
+# Import everything the game needs for the runtime, and with a window get pygame and the renderer
+# ready (see game_logic.Renderer.warm_up). Run on another thread while waiting for the remote player
+def warm_up(runtime, headless):
+    if runtime == "asyncio":
+        importlib.import_module("async_runtime")
+    else:
+        importlib.import_module("delay_netcode")
+        importlib.import_module("rollback_netcode")
+    if not headless:
+        game_logic.default_renderer.warm_up()
+
+# Play the match in mode once connected, as player_number over game_transport, and close the transport
+# runtime is "threads" or "asyncio", impairment is network_emulator settings to apply to what we send
+# (None for none), game_options is everything else run_game takes and rollback_options what only rollback's takes
+def play_match(mode, player_number, game_transport, runtime, impairment, game_options, rollback_options):
+    if runtime == "asyncio":
+        import async_runtime
+        # Impairs what it sends itself, and closes the transport when done
+        async_runtime.run_game(mode, player_number, game_transport, impairment, **game_options, **rollback_options)
+        return
+
+    import delay_netcode
+    import rollback_netcode
+    if impairment is not None:
+        game_transport = network_emulator.ImpairedTransport(game_transport, impairment)
+
+    # Run based on mode
+    if mode == "Delay":
+        delay_netcode.run_game(player_number, game_transport, **game_options)
+    elif mode == "Rollback":
+        rollback_netcode.run_game(player_number, game_transport, **game_options, **rollback_options)
+
+    if impairment is not None:
+        print(game_transport)
+    game_transport.close()
+
+# Get the mode to run the game in for server, from the --mode option if given
+def get_mode(mode_option=None):
+    if mode_option is not None:
+        if mode_option.lower() == "delay":
+            return "Delay"
+        elif mode_option.lower() == "rollback":
+            return "Rollback"
+        print("--mode must be delay or rollback!")
+        sys.exit(1)
+
     # Choose netcode type
-        mode = None
-        while mode == None:
-            print("Enter the number corresponding to the mode you want to run in:\n(1) Delay\n(2) Rollback")
-            mode = input()
-            try:
-                mode = int(mode)
-                if mode == 1:
-                    mode = "Delay"
-                elif mode == 2:
-                    mode = "Rollback"
-                else:
-                    print("Please select a valid mode!")
-                    mode = None
-            except:
-                print("Please enter a valid integer!")
+    mode = None
+    while mode == None:
+        print("Enter the number corresponding to the mode you want to run in:\n(1) Delay\n(2) Rollback")
+        mode = input()
+        try:
+            mode = int(mode)
+            if mode == 1:
+                mode = "Delay"
+            elif mode == 2:
+                mode = "Rollback"
+            else:
+                print("Please select a valid mode!")
                 mode = None
-        return mode
+        except:
+            print("Please enter a valid integer!")
+            mode = None
+    return mode
+
+# Get the transport to play over for server, only rollback can cope with UDP dropping messages
+# Uses the --transport option if given
+def get_transport_kind(mode, transport_option=None):
+    if mode != "Rollback":
+        return transport.TCP
+
+    if transport_option is not None:
+        if transport_option.upper() in (transport.TCP, transport.UDP):
+            return transport_option.upper()
+        print("--transport must be tcp or udp!")
+        sys.exit(1)
+
+    kind = None
+    while kind == None:
+        print("Enter the number corresponding to the transport you want to use:\n(1) TCP\n(2) UDP")
+        kind = input()
+        try:
+            kind = int(kind)
+            if kind == 1:
+                kind = transport.TCP
+            elif kind == 2:
+                kind = transport.UDP
+            else:
+                print("Please select a valid transport!")
+                kind = None
+        except:
+            print("Please enter a valid integer!")
+            kind = None
+    return kind
 
 
 
 if __name__ == "__main__":
-    role, ip_address, port = parse_args(sys.argv)
+    command_arguments, options = parse_options(sys.argv)
+    role, ip_address, port = parse_args(command_arguments)
+    replay_path = options["--record"]
+
+    impairment = None
+    if options["--impair"] is not None:
+        try:
+            impairment = network_emulator.parse_impairment(options["--impair"])
+        except ValueError as e:
+            print(f"Invalid --impair settings: {e}")
+            print(COMMAND_USAGE_INSTRUCTIONS)
+            sys.exit(1)
+
+    try:
+        local_input = input_source.make_input_source(options["--input"])
+        max_frames = int(options["--frames"]) if options["--frames"] is not None else None
+        tick_rate = int(options["--tick-rate"])
+        input_delay_frames, max_input_delay_frames = parse_input_delay(options["--input-delay"])
+        input_prediction.make_predictor(options["--predict"]) # Only to check the name, each match makes its own
+        snapshot_interval = parse_snapshot_interval(options["--snapshot-interval"])
+        metrics_port = int(options["--metrics-port"]) if options["--metrics-port"] is not None else None
+    except ValueError as e:
+        print(f"Invalid option: {e}")
+        print(COMMAND_USAGE_INSTRUCTIONS)
+        sys.exit(1)
+
+    runtime = options["--runtime"].lower()
+    if runtime not in ("threads", "asyncio"):
+        print("--runtime must be threads or asyncio!")
+        print(COMMAND_USAGE_INSTRUCTIONS)
+        sys.exit(1)
+
+    # Get the game ready while waiting for the remote player
+    warm_up_thread = threading.Thread(target=warm_up, args=(runtime, options["--headless"]), name="warm up", daemon=True)
+    warm_up_thread.start()
+
+    # Export metrics for the whole run, including the wait for the remote player
+    exporters = []
+    if options["--metrics-out"] is not None:
+        exporters.append(telemetry.JsonLinesExporter(options["--metrics-out"]))
+    if metrics_port is not None:
+        exporters.append(telemetry.PrometheusExporter(metrics_port))
+        print(f"Serving metrics at http://localhost:{metrics_port}/metrics")
+
+    if options["--trace-out"] is not None:
+        tracing.start_tracing()
+
+    # Everything run_game needs besides the player number and transport
+    game_options = {
+        "replay_path": replay_path,
+        "input_source": local_input,
+        "headless": options["--headless"],
+        "max_frames": max_frames,
+        "tick_rate": tick_rate,
+        "stats_path": options["--stats-out"],
+        "input_delay_frames": input_delay_frames,
+        "max_input_delay_frames": max_input_delay_frames,
+    }
+
+    # Only rollback's run_game takes these
+    rollback_options = {
+        "predictor_name": options["--predict"],
+        "snapshot_interval": snapshot_interval,
+    }
     #print(role, ip_address, port)
 
     if role == "Server":
-        mode = get_mode() # Possibilities are "Delay" and 'Rollback
+        mode = get_mode(options["--mode"]) # Possibilities are "Delay" and 'Rollback
         #print(mode)
+        transport_kind = get_transport_kind(mode, options["--transport"]) # Possibilities are "TCP" and "UDP"
 
         # Open socket and wait for client to connect on given port
         listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM) #IPv4, TCP
@@ -112,14 +342,12 @@ if __name__ == "__main__":
 
         listen_socket.close() # Program only handles one connection, so no longer need to listen
 
-        client_socket.send(mode.encode()) # Send the current mode to the client
-
-        # Run based on current mode
-        if mode == "Delay":
-            delay_netcode.run_game(1, client_socket)
-        elif mode == "Rollback":
-            rollback_netcode.run_game(1, client_socket)
+        # Send the current mode and transport to the client
+        game_transport = transport.server_handshake(client_socket, mode, transport_kind, port)
+        print(f"Connected {telemetry.record_connected(time.perf_counter()):.3f}s after starting")
 
+        warm_up_thread.join()
+        play_match(mode, 1, game_transport, runtime, impairment, game_options, rollback_options)
         client_socket.close()
 
     elif role == "Client":
@@ -129,17 +357,25 @@ if __name__ == "__main__":
         server_socket.connect((ip_address, port))
         print("Connected to server")
 
-        # Get mode from server
-        mode = server_socket.recv(1024).decode() # Valid options are Test, Delay and Rollback
+        # Get mode and transport from server
+        # A relay server can make us player 1 (see relay_server)
+        mode, player_number, game_transport = transport.client_handshake(server_socket, ip_address, port) # Valid modes are Delay and Rollback
+        print(f"Connected {telemetry.record_connected(time.perf_counter()):.3f}s after starting")
 
-        # Run based on received mode
-        if mode == "Delay":
-            delay_netcode.run_game(2, server_socket)
-        elif mode == "Rollback":
-            rollback_netcode.run_game(2, server_socket)
-        else: # Invalid mode received
+        if mode not in ("Delay", "Rollback"): # Invalid mode received
             print("Invalid Mode Received!")
-
+            game_transport.close()
+        else:
+            warm_up_thread.join()
+            play_match(mode, player_number, game_transport, runtime, impairment, game_options, rollback_options)
         server_socket.close()
     else:
         print("Invalid Role!")
+
+    if telemetry.metrics.values["first_frame_seconds"]:
+        print(f"Time to first frame: {telemetry.metrics.values['first_frame_seconds']:.3f}s after starting")
+
+    for exporter in exporters:
+        exporter.close()
+    if options["--trace-out"] is not None:
+        tracing.stop_tracing(options["--trace-out"])
@@ -0,0 +1,133 @@
+# Aleksander Nowicki and Samuel Young
+# Dartmouth CS60 25F Final Project
+# 11/21/2025
+# Fast Game Logic Module
+#
+# Second simulation engine for the game in game_logic, built for rollback resimulation.
+# Game states are packed into plain 6-tuples (same order as GameState.make_list()) and
+# each player's controls are packed into a 3-bit integer, so stepping a frame is a
+# handful of integer operations with no deepcopy and no per-frame object creation.
+# Results match game_logic.update_state exactly, frame for frame.
+
+import struct
+import zlib
+import game_logic
+from game_logic import PLAYER_SIZE, PLAYER_SPEED, WINDOW_WIDTH, ATTACK_FRAMES, ATTACK_RANGE, ATTACK_DAMAGE
+
+# Bits used to pack one player's ControlState into a single integer
+MV_L_BIT = 1
+MV_R_BIT = 2
+ATK_BIT = 4
+
+# No controls pressed
+NO_CONTROLS = 0
+
+# Starting state of every game, matches GameState(p1_x=100, p2_x=700)
+INITIAL_STATE = (100, 100, 0, 700, 100, 0)
+
+# Wall positions and hit distance, precomputed from the game_logic constants
+MIN_X = PLAYER_SIZE // 2
+MAX_X = WINDOW_WIDTH - (PLAYER_SIZE // 2)
+HIT_DISTANCE = ATTACK_RANGE + (PLAYER_SIZE // 2)
+
+# Movement for every possible control bitfield (will not move if both move controls pressed!)
+MOVE_DELTA = tuple(
+    -PLAYER_SPEED if (bits & MV_L_BIT) and not (bits & MV_R_BIT)
+    else PLAYER_SPEED if (bits & MV_R_BIT) and not (bits & MV_L_BIT)
+    else 0
+    for bits in range(8)
+)
+
+# Layout used to turn a packed state into bytes for checksums and files, 6 signed 32 bit integers
+STATE_STRUCT = struct.Struct("!6i")
+
+# Pack a GameState into a tuple
+def pack_state(game_state) -> tuple:
+    return (game_state.p1_x, game_state.p1_hp, game_state.p1_atk_frame,
+            game_state.p2_x, game_state.p2_hp, game_state.p2_atk_frame)
+
+# Build a GameState back out of a packed tuple
+def unpack_state(state) -> game_logic.GameState:
+    return game_logic.GameState(game_state_list=state)
+
+# Pack a control list in the format output by ControlState.make_list() into a bitfield
+def pack_control_list(control_state_list) -> int:
+    bits = 0
+    if control_state_list[0]:
+        bits |= MV_L_BIT
+    if control_state_list[1]:
+        bits |= MV_R_BIT
+    if control_state_list[2]:
+        bits |= ATK_BIT
+    return bits
+
+# Pack a ControlState into a bitfield
+def pack_controls(control_state) -> int:
+    return pack_control_list((control_state.mv_l, control_state.mv_r, control_state.atk))
+
+# Build a ControlState back out of a bitfield
+def unpack_controls(bits) -> game_logic.ControlState:
+    return game_logic.ControlState(mv_l=bool(bits & MV_L_BIT), mv_r=bool(bits & MV_R_BIT), atk=bool(bits & ATK_BIT))
+
+# Takes a packed state and both players' control bitfields and returns the packed state of the next frame
+# Same rules, in the same order, as game_logic.update_state
+def step(state, p1_bits, p2_bits) -> tuple:
+    p1_x, p1_hp, p1_atk_frame, p2_x, p2_hp, p2_atk_frame = state
+
+    # Move Player 1, walls only checked in the direction of movement
+    delta = MOVE_DELTA[p1_bits]
+    if delta < 0:
+        p1_x += delta
+        if p1_x < MIN_X:
+            p1_x = MIN_X
+    elif delta > 0:
+        p1_x += delta
+        if p1_x > MAX_X:
+            p1_x = MAX_X
+
+    # Process Player 1's attack (p2 has not moved yet this frame)
+    if p1_atk_frame == 0:
+        if p1_bits & ATK_BIT:
+            p1_atk_frame = 1
+    elif p1_atk_frame < ATTACK_FRAMES:
+        p1_atk_frame += 1
+    elif p1_atk_frame == ATTACK_FRAMES:
+        player_distance = p2_x - p1_x
+        if 0 <= player_distance <= HIT_DISTANCE:
+            p2_hp -= ATTACK_DAMAGE
+        p1_atk_frame = 0
+
+    # Move Player 2
+    delta = MOVE_DELTA[p2_bits]
+    if delta < 0:
+        p2_x += delta
+        if p2_x < MIN_X:
+            p2_x = MIN_X
+    elif delta > 0:
+        p2_x += delta
+        if p2_x > MAX_X:
+            p2_x = MAX_X
+
+    # Process Player 2's attack
+    if p2_atk_frame == 0:
+        if p2_bits & ATK_BIT:
+            p2_atk_frame = 1
+    elif p2_atk_frame < ATTACK_FRAMES:
+        p2_atk_frame += 1
+    elif p2_atk_frame == ATTACK_FRAMES:
+        player_distance = p2_x - p1_x
+        if 0 <= player_distance <= HIT_DISTANCE:
+            p1_hp -= ATTACK_DAMAGE
+        p2_atk_frame = 0
+
+    return (p1_x, p1_hp, p1_atk_frame, p2_x, p2_hp, p2_atk_frame)
+
+# Cheap 32 bit hash of a packed state, two machines in sync always get the same value
+def state_checksum(state) -> int:
+    return zlib.crc32(STATE_STRUCT.pack(*state))
+
+# Run a whole sequence of (p1_bits, p2_bits) input pairs from the given state, returns the final state
+def simulate(state, input_pairs) -> tuple:
+    for p1_bits, p2_bits in input_pairs:
+        state = step(state, p1_bits, p2_bits)
+    return state
@@ -8,8 +8,9 @@
 # control inputs. 
 # Functions to update game state based on controls and to render the game.
 # Game rendering is independent of the simulation, ideal for netcode experiments.
+# pygame (simple library to handle keyboard input and 2D graphics) is only imported once something
+# is drawn, so headless players and the relay server never load it.
 
-import pygame # Simple library to handle keyboard input and 2D graphics
 import copy
 from math import sin, cos, radians
 
@@ -31,10 +32,12 @@ ATTACK_DAMAGE = 5
 
 # Visual Constants
 SWORD_THICKNESS = 5
-BACKGROUND_COLOR = pygame.Color("white")
-P1_COLOR = pygame.Color("blue")
-P2_COLOR = pygame.Color("green")
-SWORD_COLOR = pygame.Color("black")
+BACKGROUND_COLOR = (255, 255, 255) # white
+P1_COLOR = (0, 0, 255) # blue
+P2_COLOR = (0, 255, 0) # green
+SWORD_COLOR = (0, 0, 0) # black
+STATS_FONT = "freesansbold.ttf" # Default font shipped with pygame
+STATS_FONT_SIZE = 20
 
 # Captures the state of game at any given frame
 # Maintains record of both players' locations, health points and current frame in attack (0 for none ongoing)
@@ -108,66 +111,126 @@ class ControlState:
         self.control_state_list = None
 
 
+# Sword tip offset from the player's center for each attack frame, in regular coordinates (screen y is flipped when drawn)
+# Sword starts out pointing 45 degrees backwards out of player and moves to straight forward over length of attack
+def sword_tip_offset(angle):
+    return (cos(radians(angle)) * ATTACK_RANGE, sin(radians(angle)) * ATTACK_RANGE)
+
+P1_SWORD_TIPS = [sword_tip_offset((135 / ATTACK_FRAMES) * (ATTACK_FRAMES - atk_frame)) for atk_frame in range(ATTACK_FRAMES + 1)]
+P2_SWORD_TIPS = [sword_tip_offset(45 + ((135 / ATTACK_FRAMES) * atk_frame)) for atk_frame in range(ATTACK_FRAMES + 1)]
+
+# Draws game states into a window, keeping everything that doesn't need redoing each frame:
+# the font is loaded once, each line of stats text is rendered once per distinct value, sword angles
+# come from the tables above, and only the parts of the window that changed are cleared and updated
+class Renderer:
+    def __init__(self):
+        self.font = None # Loaded on first draw (or by warm_up), pygame's font module must be initialised first
+        self.text_cache = {} # Line of stats text: rendered surface
+        self.window = None # Window drawn to last
+        self.last_state = None # make_list() of the state drawn last, and where the players were drawn
+        self.dirty_rects = [] # Areas drawn last frame, cleared before the next
+
+    # Load the font and render the stats text for the starting state ahead of the first draw
+    # Needs no window, so it can run on another thread while waiting for the remote player
+    def warm_up(self):
+        import pygame
+        pygame.font.init()
+        if self.font is None:
+            self.font = pygame.font.Font(STATS_FONT, STATS_FONT_SIZE)
+        game_state = GameState()
+        for lines in self.stats_lines(game_state):
+            for line in lines:
+                self.text_surface(line)
+
+    # Lines of stats text shown for each player
+    def stats_lines(self, game_state):
+        return ([f"Player 1 HP: {game_state.p1_hp}", f"Player 1 X: {game_state.p1_x}", f"P1 Attack Frame: {game_state.p1_atk_frame}"],
+                [f"Player 2 HP: {game_state.p2_hp}", f"Player 2 X: {game_state.p2_x}", f"P2 Attack Frame: {game_state.p2_atk_frame}"])
+
+    # Rendered surface for a line of text, rendering it only the first time it is seen
+    def text_surface(self, text):
+        surface = self.text_cache.get(text)
+        if surface is None:
+            surface = self.font.render(text, True, (0, 0, 0))
+            self.text_cache[text] = surface
+        return surface
+
+    # Blit lines of text as one left aligned block centered on the given point, returns the rects drawn
+    def draw_text_block(self, window, lines, center):
+        surfaces = [self.text_surface(line) for line in lines]
+        block_width = max(surface.get_width() for surface in surfaces)
+        block_height = sum(surface.get_height() for surface in surfaces)
+
+        x = center[0] - block_width // 2
+        y = center[1] - block_height // 2
+        rects = []
+        for surface in surfaces:
+            rects.append(window.blit(surface, (x, y)))
+            y += surface.get_height()
+        return rects
+
+    # Draw one player's square and sword (if an attack is active), returns the rects drawn
+    def draw_player(self, window, x, atk_frame, color, sword_tips):
+        import pygame
+        # location is center of square
+        rects = [pygame.draw.rect(window, color, [x - (PLAYER_SIZE / 2), WINDOW_HEIGHT - PLAYER_SIZE, PLAYER_SIZE, PLAYER_SIZE], 0)]
+
+        if atk_frame != 0:
+            center = (x, WINDOW_HEIGHT - (PLAYER_SIZE / 2))
+            if 0 < atk_frame <= ATTACK_FRAMES:
+                tip_offset = sword_tips[atk_frame]
+            else:
+                tip_offset = (0, 0) # Not a valid attack frame, no angle for it
+            rects.append(pygame.draw.line(window, SWORD_COLOR, center, (center[0] + tip_offset[0], center[1] - tip_offset[1]), SWORD_THICKNESS))
+        return rects
+
+    # Draw the game state, updating only the parts of the display that changed
+    # positions is the x to draw each player's square at (p1, p2), the state's own if None (e.g. interpolated
+    # between states, see render_loop), the stats text always shows the state
+    def draw(self, game_state: GameState, window, positions=None):
+        if positions is None:
+            positions = (game_state.p1_x, game_state.p2_x)
+        state_list = (game_state.make_list(), positions)
+        if state_list == self.last_state and window is self.window:
+            return # Nothing has changed since the last draw
+
+        import pygame
+        if self.font is None:
+            self.font = pygame.font.Font(STATS_FONT, STATS_FONT_SIZE)
+
+        if window is not self.window:
+            # New window, clear and show all of it this time
+            window.fill(BACKGROUND_COLOR)
+            self.dirty_rects = [window.get_rect()]
+            self.window = window
+
+        # Clear what was drawn last frame
+        for rect in self.dirty_rects:
+            window.fill(BACKGROUND_COLOR, rect)
+
+        rects = []
+        rects += self.draw_player(window, positions[0], game_state.p1_atk_frame, P1_COLOR, P1_SWORD_TIPS)
+        rects += self.draw_player(window, positions[1], game_state.p2_atk_frame, P2_COLOR, P2_SWORD_TIPS)
+
+        # Display text of all game state information (usefull for debugging)
+        p1_lines, p2_lines = self.stats_lines(game_state)
+        rects += self.draw_text_block(window, p1_lines, (100, 50))
+        rects += self.draw_text_block(window, p2_lines, (WINDOW_WIDTH - 100, 50))
+
+        # Update both where things were and where they are now
+        pygame.display.update(self.dirty_rects + rects)
+
+        self.dirty_rects = rects
+        self.last_state = state_list
+
+# Renderer used by render_frame
+default_renderer = Renderer()
+
 # Display the given game state in given pygame window. Also displays values
 # of all GameState variables to allow for convenient debugging and to confirm that
-# remote instances of the game are in sync.
-
-def render_frame(game_state: GameState, window):
-    # Clear Background
-    window.fill(pygame.Color("white"))
-
-    # Draw Player 1 (location is center of square)
-    pygame.draw.rect(window, P1_COLOR, [game_state.p1_x - (PLAYER_SIZE / 2), WINDOW_HEIGHT - PLAYER_SIZE, PLAYER_SIZE, PLAYER_SIZE], 0)
-
-    # Draw player 1 sword (if an attack is active)
-    # Sword starts out pointing 45 degrees backwards out of player and moves to straigt forward over length of attack
-    if game_state.p1_atk_frame != 0:
-        
-        p1_center = [game_state.p1_x, WINDOW_HEIGHT - (PLAYER_SIZE / 2)]
-
-        angle = (135 / ATTACK_FRAMES) * (ATTACK_FRAMES - game_state.p1_atk_frame)
-
-        sword_tip_offset = [cos(radians(angle)) * ATTACK_RANGE, sin(radians(angle)) * ATTACK_RANGE] # Think in regular coordinates, we fix later for screen coords
-
-        pygame.draw.line(window, SWORD_COLOR, p1_center, [p1_center[0] + sword_tip_offset[0], p1_center[1] - sword_tip_offset[1]], SWORD_THICKNESS)
-
-    # Draw Player 2 (location is center of square)
-    pygame.draw.rect(window, P2_COLOR, [game_state.p2_x - (PLAYER_SIZE / 2), WINDOW_HEIGHT - PLAYER_SIZE, PLAYER_SIZE, PLAYER_SIZE], 0)
-
-    # Draw player 2 sword (if an attack is active)
-    # Sword starts out pointing 45 degrees backwards out of player and moves to straigt forward over length of attack
-    if game_state.p2_atk_frame != 0:
-        
-        p2_center = [game_state.p2_x, WINDOW_HEIGHT - (PLAYER_SIZE / 2)]
-
-        angle = 45 + ((135 / ATTACK_FRAMES) * game_state.p2_atk_frame)
-
-        sword_tip_offset = [cos(radians(angle)) * ATTACK_RANGE, sin(radians(angle)) * ATTACK_RANGE] # Think in regular coordinates, we fix later for screen coords
-
-        pygame.draw.line(window, SWORD_COLOR, p2_center, [p2_center[0] + sword_tip_offset[0], p2_center[1] - sword_tip_offset[1]], SWORD_THICKNESS)
-
-    # Display text of all game state information (usefull for debugging)
-    default_font = pygame.font.Font("freesansbold.ttf", 20) # Load default font shipped with pygame
-
-    # Player 1 stats in formatted string
-    p1_stats = f"Player 1 HP: {game_state.p1_hp}\nPlayer 1 X: {game_state.p1_x}\nP1 Attack Frame: {game_state.p1_atk_frame}"
-
-    # Player 2 stats in formatted string
-    p2_stats = f"Player 2 HP: {game_state.p2_hp}\nPlayer 2 X: {game_state.p2_x}\nP2 Attack Frame: {game_state.p2_atk_frame}"
-
-    p1_text = default_font.render(p1_stats, True, (0, 0, 0))
-    p2_text = default_font.render(p2_stats, True, (0, 0, 0))
-
-    p1_textRect = p1_text.get_rect()
-    p1_textRect.center = (100, 50)
-
-    p2_textRect = p2_text.get_rect()
-    p2_textRect.center = (WINDOW_WIDTH - 100, 50)
-
-    window.blit(p1_text, p1_textRect)
-    window.blit(p2_text, p2_textRect)
-
-    pygame.display.update()
+# remote instances of the game are in sync. positions is where to draw the players, see Renderer.draw
+def render_frame(game_state: GameState, window, positions=None):
+    default_renderer.draw(game_state, window, positions)
 
 # Takes a game state and input state and returns a NEW game state which is next frame based on those inputs
 def update_state(current_game_state: GameState, p1_control_state: ControlState, p2_control_state: ControlState) -> GameState:
@@ -0,0 +1,43 @@
+# Aleksander Nowicki and Samuel Young
+# Dartmouth CS60 25F Final Project
+# 11/21/2025
+# Input Prediction Module
+#
+# How rollback guesses the remote player's controls for frames whose inputs haven't arrived yet.
+# A predictor is asked with predict(last_bits, frames_ahead): the newest remote control bitfield
+# actually received (see fast_logic) and how many frames after it the guessed frame is. Every guess
+# is redone from the newest received input whenever a late one arrives, and a wrong guess is
+# corrected by rolling back (see rollback_netcode). Predictors:
+#   repeat    - RepeatLastInput, the remote keeps holding what it held (default)
+#   movement  - RepeatMovement, keeps moving the same way but doesn't start another attack
+#   none      - NoInput, the remote lets go of everything
+
+import fast_logic
+
+# Guesses the remote is still holding the same keys
+class RepeatLastInput:
+    def predict(self, last_bits, frames_ahead):
+        return last_bits
+
+# Guesses the remote is still moving the same way, but not attacking: a held attack key would start a
+# new attack the moment the last one ends, which players rarely do
+class RepeatMovement:
+    def predict(self, last_bits, frames_ahead):
+        return last_bits & (fast_logic.MV_L_BIT | fast_logic.MV_R_BIT)
+
+# Guesses the remote isn't pressing anything
+class NoInput:
+    def predict(self, last_bits, frames_ahead):
+        return fast_logic.NO_CONTROLS
+
+PREDICTORS = {
+    "repeat": RepeatLastInput,
+    "movement": RepeatMovement,
+    "none": NoInput,
+}
+
+# Returns the predictor for a name in PREDICTORS, raises ValueError if there is no such predictor
+def make_predictor(name):
+    if name not in PREDICTORS:
+        raise ValueError(f"Unknown predictor '{name}', use " + ", ".join(PREDICTORS))
+    return PREDICTORS[name]()
@@ -0,0 +1,88 @@
+# Aleksander Nowicki and Samuel Young
+# Dartmouth CS60 25F Final Project
+# 11/21/2025
+# Input Source Module
+#
+# Where a player's controls come from. The simulation asks its input source for the control
+# bitfield (see fast_logic) once per frame with next_bits(frame_number), and the render loop hands
+# it every pygame event with handle_event(event). Sources:
+#   keyboard         - render_loop.InputLatch, the a/d/s keys (default)
+#   random[:seed]    - RandomBot, holds random controls for a random number of frames
+#   script:<script>  - ScriptedBot, plays a fixed sequence of controls on a loop
+#
+# Bots choose their controls from the frame number alone, so a bot plays the same way in every
+# run and doesn't need a window or keyboard at all.
+
+import random
+import fast_logic
+import render_loop
+
+# Longest a random bot holds the same controls, in frames
+MAX_HOLD_FRAMES = 15
+
+# Script key for each control bit, "-" means nothing pressed
+SCRIPT_KEYS = {
+    "a": fast_logic.MV_L_BIT,
+    "d": fast_logic.MV_R_BIT,
+    "s": fast_logic.ATK_BIT,
+    "-": fast_logic.NO_CONTROLS,
+}
+
+# Presses random controls, holding each choice for 1 to max_hold_frames frames
+class RandomBot:
+    def __init__(self, seed=0, max_hold_frames=MAX_HOLD_FRAMES):
+        self.random = random.Random(seed)
+        self.max_hold_frames = max_hold_frames
+        self.bits = fast_logic.NO_CONTROLS
+        self.frame = None # Frame bits was chosen for
+        self.hold_frames = 0 # Frames left until the next choice
+
+    def next_bits(self, frame_number):
+        if frame_number != self.frame:
+            self.frame = frame_number
+            if self.hold_frames == 0:
+                self.bits = self.random.randrange(8)
+                self.hold_frames = self.random.randint(1, self.max_hold_frames)
+            self.hold_frames -= 1
+        return self.bits
+
+    def handle_event(self, event):
+        pass # Bots ignore the keyboard
+
+# Plays a script of controls on a loop. A script is a comma separated list of <keys>:<frames>,
+# e.g. "d:20,ds:3,-:5,a:20" walks right, attacks while walking, stops, then walks back left
+class ScriptedBot:
+    def __init__(self, script):
+        self.steps = [] # Control bitfield of every frame in one loop of the script
+        for item in script.split(","):
+            keys, separator, frames = item.partition(":")
+            if not separator or not keys or not frames.isdigit() or int(frames) == 0:
+                raise ValueError(f"Script step '{item}' should be <keys>:<frames>")
+            bits = fast_logic.NO_CONTROLS
+            for key in keys:
+                if key not in SCRIPT_KEYS:
+                    raise ValueError(f"Unknown key '{key}' in script, use a, d, s or -")
+                bits |= SCRIPT_KEYS[key]
+            self.steps += [bits] * int(frames)
+
+    def next_bits(self, frame_number):
+        return self.steps[frame_number % len(self.steps)]
+
+    def handle_event(self, event):
+        pass # Bots ignore the keyboard
+
+# Returns the input source for a description like "keyboard", "random:3" or "script:d:20,a:20"
+# Raises ValueError if the description is invalid
+def make_input_source(description):
+    kind, separator, argument = description.partition(":")
+    if kind == "keyboard":
+        return render_loop.InputLatch()
+    elif kind == "random":
+        if not argument:
+            return RandomBot()
+        if not argument.lstrip("-").isdigit():
+            raise ValueError("Random bot seed must be an integer")
+        return RandomBot(int(argument))
+    elif kind == "script":
+        return ScriptedBot(argument)
+    raise ValueError(f"Unknown input source '{description}', use keyboard, random[:seed] or script:<script>")
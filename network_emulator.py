@@ -0,0 +1,232 @@
+# Aleksander Nowicki and Samuel Young
+# Dartmouth CS60 25F Final Project
+# 11/21/2025
+# Network Emulator Module
+#
+# Makes a loopback match behave like one over a real network. ImpairedTransport wraps any transport
+# from the transport module and holds back everything sent through it, handing it to the real
+# transport on a delivery thread once its emulated trip is over. The game loop never blocks on it.
+#
+# Each message sent can be:
+#   delayed     - a fixed one way delay plus jitter from a uniform, normal or pareto (long tail) distribution
+#   dropped     - with the loss probability
+#   duplicated  - with the duplicate probability (a second copy follows shortly after)
+#   reordered   - with the reorder probability, held back so later messages overtake it
+#   queued      - behind earlier messages when a bandwidth cap is set
+#
+# TCP can't lose, duplicate or reorder what it delivers, so over TCP a loss becomes a retransmission
+# delay and nothing is allowed to overtake an earlier message (head of line blocking).
+#
+# Every random choice comes from a generator seeded with the given seed, so a run with the same
+# settings and the same sends makes the same choices. Both players need their own impairment to
+# affect both directions, usually the same settings on each.
+#
+# Settings are given as a comma separated list, e.g. "delay=50,jitter=10,loss=0.02,seed=7"
+#   delay      one way delay in ms                               (default 0)
+#   jitter     jitter in ms, spread of the jitter distribution   (default 0)
+#   dist       jitter distribution: uniform, normal or pareto    (default uniform)
+#   loss       probability a message is lost                     (default 0)
+#   duplicate  probability a message is delivered twice         (default 0)
+#   reorder    probability a message is held back               (default 0)
+#   bandwidth  link speed in kilobits per second, 0 for no cap   (default 0)
+#   seed       random seed                                       (default 0)
+
+import heapq
+import random
+import threading
+import time
+import transport
+
+# Jitter distributions
+UNIFORM = "uniform"
+NORMAL = "normal"
+PARETO = "pareto"
+JITTER_DISTRIBUTIONS = (UNIFORM, NORMAL, PARETO)
+
+# Shape of the pareto jitter distribution, lower has a longer tail
+PARETO_ALPHA = 3
+
+# Extra seconds a reordered message is held back
+REORDER_HOLD = 0.05
+
+# Seconds after the original that a duplicate arrives
+DUPLICATE_GAP = 0.005
+
+# Seconds a lost TCP segment takes to be retransmitted, at least (TCP's minimum retransmission timeout)
+MIN_RETRANSMIT_DELAY = 0.2
+
+# Seconds close waits for the delivery thread past the last message's delivery time
+CLOSE_TIMEOUT = 1
+
+# Bytes of header overhead per message on the wire, counted against the bandwidth cap (IPv4 + UDP)
+HEADER_OVERHEAD = 28
+
+class ImpairmentSettings:
+    def __init__(self, delay=0.0, jitter=0.0, dist=UNIFORM, loss=0.0, duplicate=0.0, reorder=0.0, bandwidth=0.0, seed=0):
+        self.delay = delay # ms
+        self.jitter = jitter # ms
+        self.dist = dist
+        self.loss = loss
+        self.duplicate = duplicate
+        self.reorder = reorder
+        self.bandwidth = bandwidth # kbit/s, 0 for no cap
+        self.seed = seed
+
+    # Readable string of the settings, in the same format parse_impairment reads
+    def __str__(self):
+        return (f"delay={self.delay:g},jitter={self.jitter:g},dist={self.dist},loss={self.loss:g},"
+                f"duplicate={self.duplicate:g},reorder={self.reorder:g},bandwidth={self.bandwidth:g},seed={self.seed}")
+
+# Parse settings like "delay=50,jitter=10,loss=0.02", raises ValueError if they're invalid
+def parse_impairment(text):
+    settings = ImpairmentSettings()
+    for item in text.split(","):
+        if not item.strip():
+            continue
+        name, separator, value = item.partition("=")
+        name = name.strip()
+        value = value.strip()
+        if not separator or not hasattr(settings, name):
+            raise ValueError(f"Unknown impairment setting '{item}'")
+
+        if name == "dist":
+            if value not in JITTER_DISTRIBUTIONS:
+                raise ValueError(f"Jitter distribution must be one of {', '.join(JITTER_DISTRIBUTIONS)}")
+            settings.dist = value
+        elif name == "seed":
+            settings.seed = int(value)
+        else:
+            number = float(value)
+            if number < 0:
+                raise ValueError(f"Impairment setting {name} can't be negative")
+            if name in ("loss", "duplicate", "reorder") and number > 1:
+                raise ValueError(f"Impairment setting {name} is a probability, it must be between 0 and 1")
+            setattr(settings, name, number)
+    return settings
+
+# Transport that passes sends on to another transport after emulating the network in between
+# Receiving is untouched, the remote's impairment handles the other direction
+class ImpairedTransport:
+    def __init__(self, inner, settings):
+        self.inner = inner
+        self.kind = inner.kind
+        self.settings = settings
+        self.random = random.Random(settings.seed)
+
+        # Messages waiting to be delivered, heap of (delivery time, send order, data)
+        self.pending = []
+        self.sent_count = 0
+        self.link_free_time = 0.0 # When the bandwidth capped link finishes sending what's queued
+        self.last_delivery_time = 0.0 # Latest delivery time scheduled, TCP can't deliver anything before it
+
+        # Counters
+        self.messages = 0 # Messages sent through the transport
+        self.lost = 0
+        self.duplicated = 0
+        self.reordered = 0
+        self.retransmitted = 0 # TCP losses turned into retransmission delays
+
+        self.condition = threading.Condition()
+        self.closed = False
+        self.delivery_thread = threading.Thread(target=self.deliver, daemon=True)
+        self.delivery_thread.start()
+
+    # Readable string summary of the counters
+    def __str__(self):
+        return ("impairment: " + str(self.settings) + "\n"
+              + "messages: " + str(self.messages) + "\n"
+              + "lost: " + str(self.lost) + "\n"
+              + "duplicated: " + str(self.duplicated) + "\n"
+              + "reordered: " + str(self.reordered) + "\n"
+              + "retransmitted: " + str(self.retransmitted))
+
+    # Seconds of jitter for one message, never enough to make the total delay negative
+    def jitter(self):
+        jitter = self.settings.jitter / 1000
+        if jitter == 0:
+            return 0.0
+        if self.settings.dist == NORMAL:
+            sample = self.random.gauss(0, jitter)
+        elif self.settings.dist == PARETO:
+            sample = jitter * (self.random.paretovariate(PARETO_ALPHA) - 1)
+        else:
+            sample = self.random.uniform(-jitter, jitter)
+        return max(sample, -self.settings.delay / 1000)
+
+    def schedule(self, delivery_time, data):
+        heapq.heappush(self.pending, (delivery_time, self.sent_count, data))
+        self.sent_count += 1
+
+    def send(self, data):
+        settings = self.settings
+        now = time.perf_counter()
+
+        with self.condition:
+            if self.closed:
+                return
+            self.messages += 1
+
+            # Wait for the link to finish with earlier messages, then for our own bytes to go out
+            departure_time = now
+            if settings.bandwidth > 0:
+                self.link_free_time = max(now, self.link_free_time) + (len(data) + HEADER_OVERHEAD) * 8 / (settings.bandwidth * 1000)
+                departure_time = self.link_free_time
+
+            delivery_time = departure_time + settings.delay / 1000 + self.jitter()
+
+            if self.kind == transport.TCP:
+                # Lost segments are sent again after a timeout, and everything waits behind them
+                if self.random.random() < settings.loss:
+                    self.retransmitted += 1
+                    delivery_time += max(MIN_RETRANSMIT_DELAY, 2 * settings.delay / 1000)
+                delivery_time = max(delivery_time, self.last_delivery_time)
+                self.last_delivery_time = delivery_time
+                self.schedule(delivery_time, data)
+            else:
+                if self.random.random() < settings.loss:
+                    self.lost += 1
+                    return
+                if self.random.random() < settings.reorder:
+                    self.reordered += 1
+                    delivery_time += REORDER_HOLD
+                self.schedule(delivery_time, data)
+                if self.random.random() < settings.duplicate:
+                    self.duplicated += 1
+                    self.schedule(delivery_time + DUPLICATE_GAP, data)
+
+            self.condition.notify()
+
+    # Delivery thread, hands each message to the real transport once its delivery time comes
+    # After close it keeps going until everything still in flight has been delivered
+    def deliver(self):
+        while True:
+            with self.condition:
+                while True:
+                    if self.pending:
+                        wait_time = self.pending[0][0] - time.perf_counter()
+                        if wait_time <= 0:
+                            break
+                        self.condition.wait(wait_time)
+                    elif self.closed:
+                        return
+                    else:
+                        self.condition.wait()
+                delivery_time, order, data = heapq.heappop(self.pending)
+
+            try:
+                self.inner.send(data)
+            except OSError:
+                return # Connection gone, nothing more can be delivered
+
+    def recv(self, timeout=None):
+        return self.inner.recv(timeout)
+
+    # Stop taking messages, wait for the ones still in flight to arrive (like a real network, and a TCP
+    # stream delivers everything sent before it was closed) and then close the real transport
+    def close(self):
+        with self.condition:
+            self.closed = True
+            last_delivery_time = max((message[0] for message in self.pending), default=0)
+            self.condition.notify()
+        self.delivery_thread.join(max(last_delivery_time - time.perf_counter(), 0) + CLOSE_TIMEOUT)
+        self.inner.close()
@@ -0,0 +1,430 @@
+# Aleksander Nowicki and Samuel Young
+# Dartmouth CS60 25F Final Project
+# 11/21/2025
+# Relay Server Program
+#
+# Dedicated server that hosts many 1v1 matches in one process. Players connect with the normal client
+# command (python3 driver.py <relay IP> <relay port>), are paired in the order they connect, and the
+# relay forwards each player's game messages to the other. All matches share one selectors loop over
+# non-blocking sockets, so a match costs a few small objects rather than a process.
+#
+# The relay tells each client its mode, transport and player number ("<mode> <transport> <player>\n",
+# see transport). Over TCP it forwards bytes between the two game connections. Over UDP every player
+# sends to the relay's one UDP socket on the same port, and datagrams are forwarded by source address
+# to the address the other player gave in its handshake.
+#
+# With --authoritative the relay also runs each match itself (headless, through fast_logic) from the
+# inputs it forwards, and checks every state checksum the players send against its own, so it knows
+# the true outcome and which player desynced. Datagrams that don't decode are dropped rather than
+# forwarded, and a TCP stream that doesn't decode ends the match.
+#
+# A match ends once both players have disconnected. Over TCP the relay closes the other player's
+# connection as soon as one leaves, over UDP the other player just stops receiving anything.
+#
+# Usage: python3 relay_server.py <Port> [--mode delay|rollback] [--transport tcp|udp] [--authoritative]
+#                                [--matches <matches to host before exiting>]
+
+import sys
+import time
+import socket
+import selectors
+import game_logic
+import fast_logic
+import wire_protocol
+import transport
+import desync_detector
+import rollback_history
+
+OPTION_DEFAULTS = {
+    "--mode": "rollback",
+    "--transport": "tcp",
+    "--matches": None,
+}
+
+# Options that take no value, True if given
+FLAG_OPTIONS = {
+    "--authoritative",
+}
+
+USAGE = ("Usage: python3 relay_server.py <Port> [--mode delay|rollback] [--transport tcp|udp] [--authoritative]\n"
+         + "  [--matches <matches to host before exiting>]")
+
+# Most bytes read from a TCP connection at once
+RECEIVE_SIZE = 4096
+
+# Most bytes kept for a player that isn't reading what's sent to it before its match is dropped
+MAX_BUFFERED = 65536
+
+# Most datagrams handled in one go before checking the other sockets
+MAX_DATAGRAMS_PER_EVENT = 64
+
+# Furthest past the referee's frame a player's inputs are kept, no player can get further ahead than
+# its rollback history
+MAX_FRAMES_AHEAD = rollback_history.DEFAULT_CAPACITY
+
+# Plays a match from the inputs both players send and checks their checksums against it
+class Referee:
+    def __init__(self):
+        self.state = fast_logic.pack_state(game_logic.GameState(p1_x=100, p2_x=700))
+        self.frame = 0 # Newest frame simulated
+
+        # Inputs received for frames not simulated yet, one dict per player, frame: control bitfield
+        self.inputs = ({}, {})
+
+        # Compares our checksums ("local") against each player's ("remote")
+        self.detectors = (desync_detector.DesyncDetector(), desync_detector.DesyncDetector())
+
+    # Readable string summary of how far the match got and whether the players agreed with it
+    def __str__(self):
+        return (f"referee frame: {self.frame}, checksum: {fast_logic.state_checksum(self.state)}\n"
+              + "\n".join(f"player {player} checks: {detector.checks}, mismatches: {detector.mismatches}, first desync frame: {detector.first_desync_frame}"
+                          for player, detector in enumerate(self.detectors, 1)))
+
+    # Take in a message sent by a player
+    def handle_message(self, player_number, message):
+        if message[0] == wire_protocol.MSG_INPUTS:
+            msg_type, newest_frame, ack_frame, advantage, inputs = message
+            first_frame = newest_frame - len(inputs) + 1
+            for i, bits in enumerate(inputs):
+                self.add_input(player_number, first_frame + i, bits)
+        elif message[0] == wire_protocol.MSG_CONTROL:
+            # Delay mode numbers a frame's controls by the frame they're played on, rollback by the frame they make
+            msg_type, frame_number, bits = message
+            self.add_input(player_number, frame_number + 1, bits)
+        elif message[0] == wire_protocol.MSG_CHECKSUM:
+            msg_type, checksum_frame, checksum = message
+            self.detectors[player_number - 1].add_remote(checksum_frame, checksum)
+            return
+        self.advance()
+
+    def add_input(self, player_number, frame, bits):
+        if self.frame < frame <= self.frame + MAX_FRAMES_AHEAD:
+            self.inputs[player_number - 1].setdefault(frame, bits)
+
+    # Simulate every frame both players' inputs have arrived for
+    def advance(self):
+        p1_inputs, p2_inputs = self.inputs
+        while self.frame + 1 in p1_inputs and self.frame + 1 in p2_inputs:
+            self.frame += 1
+            self.state = fast_logic.step(self.state, p1_inputs.pop(self.frame), p2_inputs.pop(self.frame))
+
+            if self.detectors[0].is_checksum_frame(self.frame):
+                checksum = fast_logic.state_checksum(self.state)
+                for detector in self.detectors:
+                    detector.add_local(self.frame, checksum)
+
+# One connected player
+class Client:
+    def __init__(self, control_socket, address):
+        self.socket = control_socket
+        self.address = address
+        self.match = None # Set once paired
+        self.player_number = None
+        self.udp_address = None # Where to send this player's datagrams, from its handshake (UDP only)
+        self.handshake = b"" # Received part of the handshake reply (UDP only)
+        self.outgoing = bytearray() # Bytes not yet accepted by the socket
+        self.reader = wire_protocol.MessageReader() # Received game messages, for the referee (TCP only)
+        self.closed = False
+
+# Two paired players
+class Match:
+    def __init__(self, number, clients, mode, kind, referee=None):
+        self.number = number
+        self.clients = clients
+        self.mode = mode
+        self.kind = kind
+        self.referee = referee # None unless authoritative
+        self.relayed_bytes = [0, 0] # Bytes forwarded from each player
+        self.dropped = 0 # Datagrams dropped (undecodable or no address to send to yet)
+        self.start_time = time.perf_counter()
+        self.ended = False
+
+    # Readable string summary of the match
+    def __str__(self):
+        summary = (f"match {self.number} ({self.mode} over {self.kind}, {self.clients[0].address[0]} vs {self.clients[1].address[0]}): "
+                   + f"{time.perf_counter() - self.start_time:.1f}s, relayed {self.relayed_bytes[0]}/{self.relayed_bytes[1]} bytes, "
+                   + f"dropped {self.dropped} datagrams")
+        if self.referee is not None:
+            summary += "\n" + str(self.referee)
+        return summary
+
+    # The other player
+    def opponent(self, client):
+        return self.clients[1] if client is self.clients[0] else self.clients[0]
+
+class RelayServer:
+    def __init__(self, port, mode, kind, authoritative=False, max_matches=None):
+        self.mode = mode
+        self.kind = kind
+        self.authoritative = authoritative
+        self.max_matches = max_matches
+
+        self.selector = selectors.DefaultSelector()
+
+        self.listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listen_socket.bind(('', port))
+        self.listen_socket.listen(128)
+        self.listen_socket.setblocking(False)
+        self.selector.register(self.listen_socket, selectors.EVENT_READ)
+
+        # Every player's datagrams come in on this one socket, and go out from it
+        self.udp_socket = None
+        if kind == transport.UDP:
+            self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.udp_socket.bind(('', port))
+            self.udp_socket.setblocking(False)
+            self.selector.register(self.udp_socket, selectors.EVENT_READ)
+
+        self.waiting = [] # Connected players not paired yet, oldest first
+        self.udp_clients = {} # Player by the address its datagrams come from
+        self.matches_started = 0
+        self.matches_ended = 0
+        self.active_matches = 0
+
+    # Handle sockets until max_matches matches have ended (forever if None)
+    def run(self):
+        while self.max_matches is None or self.matches_ended < self.max_matches:
+            for key, events in self.selector.select():
+                if key.fileobj is self.listen_socket:
+                    self.accept()
+                elif key.fileobj is self.udp_socket:
+                    self.receive_datagrams()
+                else:
+                    self.client_event(key.data, events)
+
+    def close(self):
+        self.selector.close()
+        self.listen_socket.close()
+        if self.udp_socket is not None:
+            self.udp_socket.close()
+
+    def accept(self):
+        try:
+            client_socket, address = self.listen_socket.accept()
+        except BlockingIOError:
+            return
+        client_socket.setblocking(False)
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        client = Client(client_socket, address)
+        self.selector.register(client_socket, selectors.EVENT_READ, client)
+        self.waiting.append(client)
+
+        if len(self.waiting) >= 2:
+            self.start_match(self.waiting.pop(0), self.waiting.pop(0))
+
+    def start_match(self, first, second):
+        self.matches_started += 1
+        self.active_matches += 1
+        referee = Referee() if self.authoritative else None
+        match = Match(self.matches_started, [first, second], self.mode, self.kind, referee)
+
+        for player_number, client in enumerate(match.clients, 1):
+            client.match = match
+            client.player_number = player_number
+            self.send(client, f"{self.mode} {self.kind} {player_number}\n".encode())
+        print(f"Match {match.number} started, {self.active_matches} active")
+
+    # Queue bytes for a player and send as much as its socket takes
+    def send(self, client, data):
+        if client.closed:
+            return
+        client.outgoing += data
+        if len(client.outgoing) > MAX_BUFFERED:
+            print(f"Player {client.player_number} of match {client.match.number} isn't reading, dropping match")
+            self.drop_match(client.match)
+            return
+        self.flush(client)
+
+    def flush(self, client):
+        try:
+            sent = client.socket.send(client.outgoing)
+            del client.outgoing[:sent]
+        except BlockingIOError:
+            pass
+        except OSError:
+            self.client_lost(client)
+            return
+
+        # Only watch for room to write while something is left to send
+        events = selectors.EVENT_READ | selectors.EVENT_WRITE if client.outgoing else selectors.EVENT_READ
+        if self.selector.get_key(client.socket).events != events:
+            self.selector.modify(client.socket, events, client)
+
+    def client_event(self, client, events):
+        if events & selectors.EVENT_WRITE:
+            self.flush(client)
+        if client.closed or not events & selectors.EVENT_READ:
+            return
+
+        try:
+            data = client.socket.recv(RECEIVE_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.client_lost(client)
+            return
+
+        match = client.match
+        if match is None:
+            return # Nothing should arrive before the handshake, ignore it
+
+        if match.kind == transport.UDP:
+            self.receive_handshake(client, data)
+            return
+
+        if match.referee is not None:
+            client.reader.feed(data)
+            try:
+                message = client.reader.next_message()
+                while message is not None:
+                    match.referee.handle_message(client.player_number, message)
+                    message = client.reader.next_message()
+            except ValueError as e:
+                print(f"Invalid message from player {client.player_number} of match {match.number}: {e}")
+                self.drop_match(match)
+                return
+
+        match.relayed_bytes[client.player_number - 1] += len(data)
+        self.send(match.opponent(client), data)
+
+    # Take in the UDP port a player answers the handshake with
+    def receive_handshake(self, client, data):
+        if client.udp_address is not None:
+            return # Nothing else comes over the control connection in a UDP match
+        client.handshake += data
+        if b"\n" not in client.handshake:
+            return
+
+        try:
+            udp_port = int(client.handshake.split(b"\n")[0])
+        except ValueError:
+            print(f"Invalid handshake from player {client.player_number} of match {client.match.number}")
+            self.drop_match(client.match)
+            return
+        client.udp_address = (client.address[0], udp_port)
+        self.udp_clients[client.udp_address] = client
+
+    def receive_datagrams(self):
+        for i in range(MAX_DATAGRAMS_PER_EVENT):
+            try:
+                data, address = self.udp_socket.recvfrom(transport.MAX_DATAGRAM_SIZE)
+            except BlockingIOError:
+                return
+            except OSError:
+                continue # A player's socket has closed (connection refused), nothing to do until its control connection does
+
+            client = self.udp_clients.get(address)
+            if client is None:
+                continue # Not a player, or its match is over
+            match = client.match
+            opponent = match.opponent(client)
+            if opponent.udp_address is None:
+                match.dropped += 1
+                continue
+
+            if match.referee is not None:
+                messages = []
+                reader = wire_protocol.MessageReader()
+                reader.feed(data)
+                try:
+                    message = reader.next_message()
+                    while message is not None:
+                        messages.append(message)
+                        message = reader.next_message()
+                except ValueError:
+                    match.dropped += 1
+                    continue
+                for message in messages:
+                    match.referee.handle_message(client.player_number, message)
+
+            match.relayed_bytes[client.player_number - 1] += len(data)
+            try:
+                self.udp_socket.sendto(data, opponent.udp_address)
+            except OSError:
+                match.dropped += 1 # Socket buffer full or opponent gone, lost like any other datagram
+
+    def close_client(self, client):
+        if client.closed:
+            return
+        client.closed = True
+        self.selector.unregister(client.socket)
+        client.socket.close()
+
+    # A player disconnected
+    def client_lost(self, client):
+        match = client.match
+        self.close_client(client)
+        if match is None:
+            self.waiting.remove(client)
+            return
+
+        opponent = match.opponent(client)
+        if match.kind == transport.TCP and not opponent.closed:
+            # Let the opponent know, after anything still queued for it
+            self.flush(opponent)
+            self.close_client(opponent)
+
+        if opponent.closed:
+            self.end_match(match)
+
+    # Disconnect both players of a match that can't go on
+    def drop_match(self, match):
+        for client in match.clients:
+            self.close_client(client)
+        self.end_match(match)
+
+    def end_match(self, match):
+        if match.ended:
+            return
+        match.ended = True
+
+        for client in match.clients:
+            if client.udp_address is not None:
+                del self.udp_clients[client.udp_address]
+        self.active_matches -= 1
+        self.matches_ended += 1
+        print(str(match) + f"\n{self.active_matches} active")
+
+
+if __name__ == "__main__":
+    options = dict(OPTION_DEFAULTS)
+    for flag in FLAG_OPTIONS:
+        options[flag] = False
+    arguments = []
+    remaining = sys.argv[1:]
+    while remaining:
+        if remaining[0] in FLAG_OPTIONS:
+            options[remaining[0]] = True
+            remaining = remaining[1:]
+        elif remaining[0] in options and len(remaining) >= 2:
+            options[remaining[0]] = remaining[1]
+            remaining = remaining[2:]
+        else:
+            arguments.append(remaining[0])
+            remaining = remaining[1:]
+
+    try:
+        port = int(arguments[0]) if len(arguments) == 1 else None
+        max_matches = int(options["--matches"]) if options["--matches"] is not None else None
+    except ValueError:
+        port = None
+    if port is None or not 1 <= port <= 65535 or options["--mode"].lower() not in ("delay", "rollback") \
+            or options["--transport"].upper() not in (transport.TCP, transport.UDP):
+        print(USAGE)
+        sys.exit(1)
+
+    mode = "Rollback" if options["--mode"].lower() == "rollback" else "Delay"
+    # Only rollback can cope with UDP dropping messages
+    kind = options["--transport"].upper() if mode == "Rollback" else transport.TCP
+
+    relay = RelayServer(port, mode, kind, options["--authoritative"], max_matches)
+    print(f"Relaying {mode} matches over {kind} on port {port}" + (", authoritative" if options["--authoritative"] else ""))
+    try:
+        relay.run()
+    except KeyboardInterrupt:
+        pass
+    relay.close()
@@ -0,0 +1,124 @@
+# Aleksander Nowicki and Samuel Young
+# Dartmouth CS60 25F Final Project
+# 11/21/2025
+# Render Loop Module
+#
+# Lets the simulation run on its own thread at a fixed 30 ticks per second while the main thread
+# draws the game and reads the keyboard (pygame wants both of those on the main thread).
+# The two sides only share two things, each replaced with a single assignment so neither side
+# ever waits on the other:
+#   InputLatch     - the local player's current control bitfield, written by the render loop as
+#                    key events come in and read by the simulation once per tick (a bot from
+#                    input_source can stand in for it)
+#   SnapshotBuffer - the two newest game states the simulation has published (immutable fast_logic
+#                    tuples), which the render loop interpolates the players' draw positions between
+# A slow draw therefore never delays input sampling, sending, or rollback resimulation, and the
+# render loop just draws fewer frames when it falls behind.
+#
+# pygame is only imported by the functions that open and draw the window, so headless players
+# never load it.
+
+import time
+import game_logic
+import fast_logic
+import tracing
+import telemetry
+
+# Most frames per second the render loop draws, more than the simulation so motion can be interpolated
+RENDER_FRAME_RATE = 60
+
+# Seconds between simulation ticks
+TICK_PERIOD = 1 / 30
+
+# Local player's keys and the control bit each one sets
+# pygame's key codes for letters are their ASCII codes (pygame.K_a == ord("a"))
+KEY_BITS = {
+    ord("a"): fast_logic.MV_L_BIT, # a moves player left
+    ord("d"): fast_logic.MV_R_BIT, # d moves player right
+    ord("s"): fast_logic.ATK_BIT, # s is player's attack
+}
+
+# Latest local control bitfield
+class InputLatch:
+    def __init__(self):
+        self.bits = fast_logic.NO_CONTROLS
+
+    # Controls to use for a frame, whatever keys are held right now
+    def next_bits(self, frame_number):
+        return self.bits
+
+    # Update the controls from a pygame key event
+    def handle_event(self, event):
+        import pygame
+        if event.type == pygame.KEYDOWN and event.key in KEY_BITS:
+            self.bits = self.bits | KEY_BITS[event.key]
+        elif event.type == pygame.KEYUP and event.key in KEY_BITS:
+            self.bits = self.bits & ~KEY_BITS[event.key]
+
+# Two newest states published by the simulation, and when the newest was published
+class SnapshotBuffer:
+    def __init__(self, tick_period=TICK_PERIOD):
+        self.tick_period = tick_period
+        self.snapshots = None # (previous state, newest state, time newest was published)
+
+    # Called by the simulation once per tick with the state to show
+    def publish(self, state, now):
+        snapshots = self.snapshots
+        if snapshots is None:
+            telemetry.record_first_frame(now)
+        previous = snapshots[1] if snapshots is not None else state
+        self.snapshots = (previous, state, now)
+
+    # (newest state, (p1 x, p2 x) to draw the players at) for the given time, the draw positions moved part
+    # way from the previous state to the newest one by how far we are into the current tick
+    # Only the drawing is interpolated, the state is one the simulation produced. None until the first state is published
+    def interpolated(self, now):
+        snapshots = self.snapshots
+        if snapshots is None:
+            return None
+        previous, newest, published = snapshots
+
+        alpha = min(1.0, (now - published) / self.tick_period)
+        p1_x = round(previous[0] + (newest[0] - previous[0]) * alpha)
+        p2_x = round(previous[3] + (newest[3] - previous[3]) * alpha)
+        return newest, (p1_x, p2_x)
+
+# Read the keyboard and draw the newest snapshot once
+# Closing the window sets stop (a threading.Event) so the simulation knows to finish too
+def render_step(window, local_input, snapshots, stop):
+    import pygame
+    for event in pygame.event.get():
+        if event.type == pygame.QUIT: # Check if player closed game window
+            stop.set()
+        local_input.handle_event(event)
+
+    frame = snapshots.interpolated(time.perf_counter())
+    if frame is not None:
+        state, positions = frame
+        game_logic.render_frame(game_logic.GameState(game_state_list=state), window, positions)
+
+# Draw snapshots and read the keyboard until the window is closed or stop is set
+def run_render_loop(window, local_input, snapshots, stop, frame_rate=RENDER_FRAME_RATE):
+    import pygame
+    clock = pygame.time.Clock()
+
+    while not stop.is_set():
+        with tracing.span("render"):
+            render_step(window, local_input, snapshots, stop)
+        with tracing.span("sleep"):
+            clock.tick(frame_rate)
+
+# Open the game window, must be called on the main thread
+# Only the display and font are started, nothing else in pygame is used
+def open_window():
+    import pygame
+    pygame.display.init()
+    pygame.font.init()
+    window = pygame.display.set_mode((game_logic.WINDOW_WIDTH, game_logic.WINDOW_HEIGHT))
+    pygame.display.set_caption(game_logic.GAME_NAME)
+    return window
+
+# Close the game window
+def close_window():
+    import pygame
+    pygame.quit()
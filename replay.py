@@ -0,0 +1,270 @@
+# Aleksander Nowicki and Samuel Young
+# Dartmouth CS60 25F Final Project
+# 11/21/2025
+# Replay Module
+#
+# Records matches as the confirmed inputs of both players plus a periodic state checksum, and
+# re-runs recorded matches headless (no window, no frame rate cap) through game_logic.update_state
+# as fast as possible to check the checksums still match. Useful to reproduce desync reports and to
+# make sure a change to the game logic doesn't change how any recorded match plays out. Replays are
+# read a chunk at a time (read_records), so verifying one never holds the whole file in memory.
+#
+# Like the rollback history (see rollback_history), a replay keeps the inputs of every frame but the
+# full game state only every so often (a snapshot every SNAPSHOT_INTERVAL frames). The state at any
+# frame is the newest snapshot before it simulated forward (state_at), so a long replay can be
+# started from anywhere and a spectator joining late only simulates from the last snapshot.
+#
+# Replay file layout, everything big endian:
+#   header: "FSRP", version byte, initial game state as 6 signed 32 bit integers
+#   records, in frame order, each starting with a tag byte:
+#     0b00bbbaaa  one frame of input, aaa = player 1 control bitfield, bbb = player 2 control bitfield
+#     0x40        checksum, followed by frame number (u32) and fast_logic.state_checksum (u32)
+#     0x41        snapshot, followed by frame number (u32) and the game state as 6 signed 32 bit integers
+#                 (version 2 on, version 1 files have no snapshots)
+#
+# Frame numbers are implicit: the nth input record is frame n, and frame 0 is the initial state.
+#
+# Usage: python3 replay.py [--fast] [--state-at <frame>] <replay file> [<replay file> ...]
+#   --fast re-runs through fast_logic.step instead of game_logic.update_state (same states, many times faster)
+#   --state-at prints each replay's game state at that frame instead of verifying it
+
+import re
+import sys
+import struct
+import time
+import fast_logic
+import game_logic
+
+MAGIC = b"FSRP"
+REPLAY_VERSION = 2
+
+# Versions load_replay can read
+READABLE_VERSIONS = (1, 2)
+
+HEADER = struct.Struct("!4sB")
+CHECKSUM_RECORD = struct.Struct("!II") # frame number, state checksum
+SNAPSHOT_RECORD = struct.Struct("!I6i") # frame number, game state
+
+# Record tags (anything below CHECKSUM_TAG is an input record)
+CHECKSUM_TAG = 0x40
+SNAPSHOT_TAG = 0x41
+
+# Bytes read from a replay file at a time
+READ_SIZE = 1 << 16
+
+# A run of input records
+INPUT_RUN = re.compile(rb"[\x00-\x3f]+")
+
+# Frames between checksum records
+CHECKSUM_INTERVAL = 30
+
+# Frames between snapshot records, 10 seconds at 30fps (29 bytes each, against 300 bytes of inputs)
+SNAPSHOT_INTERVAL = 300
+
+# Pre-built single byte input records, indexed by player 1 bits | player 2 bits << 3
+INPUT_RECORDS = [bytes((record,)) for record in range(CHECKSUM_TAG)]
+
+# Streams frames of a match to a replay file as they become final
+class ReplayWriter:
+    def __init__(self, path, initial_state=fast_logic.INITIAL_STATE, checksum_interval=CHECKSUM_INTERVAL,
+                 snapshot_interval=SNAPSHOT_INTERVAL):
+        self.file = open(path, "wb")
+        self.checksum_interval = checksum_interval
+        self.snapshot_interval = snapshot_interval
+        self.frame_number = 0 # Last frame written
+
+        self.file.write(HEADER.pack(MAGIC, REPLAY_VERSION) + fast_logic.STATE_STRUCT.pack(*initial_state))
+
+    # Append the next frame's inputs, state is the packed game state they produced
+    def record_frame(self, p1_bits, p2_bits, state):
+        self.frame_number += 1
+        self.file.write(INPUT_RECORDS[p1_bits | (p2_bits << 3)])
+
+        if self.frame_number % self.checksum_interval == 0:
+            self.file.write(bytes((CHECKSUM_TAG,)) + CHECKSUM_RECORD.pack(self.frame_number, fast_logic.state_checksum(state)))
+        if self.frame_number % self.snapshot_interval == 0:
+            self.file.write(bytes((SNAPSHOT_TAG,)) + SNAPSHOT_RECORD.pack(self.frame_number, *state))
+
+    def close(self):
+        self.file.close()
+
+# Open a replay file and read its header, returns (open file positioned at the first record, version, initial state)
+# Raises ValueError if it isn't a replay file this version can read
+def open_replay(path):
+    replay_file = open(path, "rb")
+    header = replay_file.read(HEADER.size + fast_logic.STATE_STRUCT.size)
+    if len(header) < HEADER.size + fast_logic.STATE_STRUCT.size or HEADER.unpack_from(header, 0)[0] != MAGIC:
+        replay_file.close()
+        raise ValueError(f"{path} is not a replay file")
+    version = HEADER.unpack_from(header, 0)[1]
+    if version not in READABLE_VERSIONS:
+        replay_file.close()
+        raise ValueError(f"{path} is a version {version} replay, only versions {' and '.join(str(v) for v in READABLE_VERSIONS)} can be read")
+    return replay_file, version, fast_logic.STATE_STRUCT.unpack_from(header, HEADER.size)
+
+# Every record after the header of an opened replay, read READ_SIZE bytes at a time and yielded in file order as
+#   (INPUT_RUN, bytes of consecutive input records), (CHECKSUM_TAG, frame, checksum) or (SNAPSHOT_TAG, frame, state)
+# A record cut off at the end of the file (game closed mid-write) is ignored, raises ValueError on an unknown tag
+def read_records(replay_file, version, path):
+    buffer = b""
+    while True:
+        data = replay_file.read(READ_SIZE)
+        if not data:
+            return
+        buffer += data
+
+        position = 0
+        while position < len(buffer):
+            tag = buffer[position]
+            if tag < CHECKSUM_TAG:
+                run = INPUT_RUN.match(buffer, position)
+                yield INPUT_RUN, run.group()
+                position = run.end()
+            elif tag == CHECKSUM_TAG:
+                if position + 1 + CHECKSUM_RECORD.size > len(buffer):
+                    break # Rest of the record is in the next read
+                yield (CHECKSUM_TAG,) + CHECKSUM_RECORD.unpack_from(buffer, position + 1)
+                position += 1 + CHECKSUM_RECORD.size
+            elif tag == SNAPSHOT_TAG and version >= 2:
+                if position + 1 + SNAPSHOT_RECORD.size > len(buffer):
+                    break
+                frame, *state = SNAPSHOT_RECORD.unpack_from(buffer, position + 1)
+                yield SNAPSHOT_TAG, frame, tuple(state)
+                position += 1 + SNAPSHOT_RECORD.size
+            else:
+                raise ValueError(f"Unknown record tag {tag} in {path}")
+        buffer = buffer[position:]
+
+# Read a whole replay file into memory, returns (initial state, bytearray of input records in frame order,
+# dict of frame: checksum, dict of frame: snapshot state). verify_replay streams instead
+def load_replay(path):
+    replay_file, version, initial_state = open_replay(path)
+    inputs = bytearray()
+    checksums = {}
+    snapshots = {}
+    with replay_file:
+        for record in read_records(replay_file, version, path):
+            if record[0] is INPUT_RUN:
+                inputs += record[1]
+            elif record[0] == CHECKSUM_TAG:
+                checksums[record[1]] = record[2]
+            else:
+                snapshots[record[1]] = record[2]
+    return initial_state, inputs, checksums, snapshots
+
+# Step one frame through game_logic.update_state instead of the fast path
+def reference_step(state, p1_bits, p2_bits):
+    return fast_logic.pack_state(game_logic.update_state(fast_logic.unpack_state(state),
+                                                         fast_logic.unpack_controls(p1_bits),
+                                                         fast_logic.unpack_controls(p2_bits)))
+
+# Game state at a frame, simulated from the newest snapshot (or the initial state) at or before it
+# Returns (state, frames simulated), raises ValueError if the replay ends before the frame
+def state_at(frame, initial_state, inputs, snapshots, step=fast_logic.step):
+    if frame < 0 or frame > len(inputs):
+        raise ValueError(f"Frame {frame} is outside the replay (frames 0-{len(inputs)})")
+
+    start_frame = max((snapshot_frame for snapshot_frame in snapshots if snapshot_frame <= frame), default=0)
+    state = snapshots[start_frame] if start_frame else initial_state
+    for record in inputs[start_frame:frame]: # Input record n - 1 is frame n
+        state = step(state, record & 0x07, record >> 3)
+    return state, frame - start_frame
+
+# Re-run a replay file through game_logic.update_state (fast_logic.step if fast) and check every recorded
+# checksum and snapshot as it is read, returns a dict summarising the result
+# Raises ValueError (or struct.error) if the file can't be read as a replay
+def verify_replay(path, fast=False):
+    step = fast_logic.step if fast else reference_step
+    state_checksum = fast_logic.state_checksum
+
+    start_time = time.perf_counter()
+
+    replay_file, version, state = open_replay(path)
+    frame = 0
+    checked = 0
+    mismatches = 0
+    first_mismatch_frame = None
+    with replay_file:
+        for record in read_records(replay_file, version, path):
+            if record[0] is INPUT_RUN:
+                for input_record in record[1]:
+                    state = step(state, input_record & 0x07, input_record >> 3)
+                frame += len(record[1])
+                continue
+
+            # Checksums and snapshots follow the input record of their frame
+            checked += 1
+            if record[0] == CHECKSUM_TAG:
+                matches = record[1] == frame and state_checksum(state) == record[2]
+            else:
+                matches = record[1] == frame and state == record[2]
+            if not matches:
+                mismatches += 1
+                if first_mismatch_frame is None:
+                    first_mismatch_frame = record[1]
+
+    return {
+        "path": path,
+        "frames": frame,
+        "checksums_checked": checked,
+        "mismatches": mismatches,
+        "first_mismatch_frame": first_mismatch_frame,
+        "final_state": list(state),
+        "seconds": time.perf_counter() - start_time,
+    }
+
+
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    fast = "--fast" in arguments
+    state_frame = None
+    if "--state-at" in arguments:
+        index = arguments.index("--state-at")
+        if index + 1 >= len(arguments) or not arguments[index + 1].isdigit():
+            print("--state-at needs a frame number!")
+            sys.exit(1)
+        state_frame = int(arguments[index + 1])
+        del arguments[index:index + 2]
+    paths = [arg for arg in arguments if arg != "--fast"]
+
+    if not paths:
+        print("Usage: python3 replay.py [--fast] [--state-at <frame>] <replay file> [<replay file> ...]")
+        sys.exit(1)
+
+    if state_frame is not None:
+        step = fast_logic.step if fast else reference_step
+        failed = 0
+        for path in paths:
+            try:
+                initial_state, inputs, checksums, snapshots = load_replay(path)
+                state, simulated = state_at(state_frame, initial_state, inputs, snapshots, step)
+            except (OSError, ValueError, struct.error) as e:
+                print(f"{path}: {e}")
+                failed += 1
+                continue
+            print(f"{path}: frame {state_frame} state {list(state)} (simulated {simulated} frames from the nearest snapshot)")
+        sys.exit(1 if failed else 0)
+
+    total_frames = 0
+    total_seconds = 0
+    failed = 0
+    for path in paths:
+        try:
+            result = verify_replay(path, fast)
+        except (OSError, ValueError, struct.error) as e:
+            print(f"{path}: UNREADABLE ({e})")
+            failed += 1
+            continue
+        total_frames += result["frames"]
+        total_seconds += result["seconds"]
+
+        if result["mismatches"]:
+            failed += 1
+            print(f"{path}: DESYNC at frame {result['first_mismatch_frame']} ({result['mismatches']} of {result['checksums_checked']} checksums wrong)")
+        else:
+            print(f"{path}: OK, {result['frames']} frames, {result['checksums_checked']} checksums")
+
+    if total_seconds > 0:
+        print(f"{len(paths)} replays, {total_frames} frames in {total_seconds:.3f}s ({total_frames / total_seconds:.0f} frames/s)")
+
+    sys.exit(1 if failed else 0)
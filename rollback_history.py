@@ -0,0 +1,213 @@
+# Aleksander Nowicki and Samuel Young
+# Dartmouth CS60 25F Final Project
+# 11/21/2025
+# Rollback History Module
+#
+# Fixed-capacity ring buffer holding the per-frame inputs and game states used by rollback_netcode.
+# Everything is stored column-wise in preallocated arrays (one column per GameState variable
+# plus the two players' control bitfields from fast_logic), indexed by frame number modulo capacity.
+# Frames older than the last fully confirmed frame are trimmed as remote inputs arrive, so memory
+# use and per-frame cost stay the same no matter how long a match runs.
+#
+# Inputs are kept for every frame, but full game states only every snapshot_interval frames (K),
+# plus the newest state and the last confirmed frame's (the start of any rollback). A state that
+# isn't kept is rebuilt on demand by simulating forward from the nearest one before it, at most K-1
+# frames. K = 1 keeps every state; a bigger K trades memory for simulating a few more frames
+# whenever an old state is needed.
+
+from array import array
+
+# Default number of frames kept, about 4 seconds at 30fps
+DEFAULT_CAPACITY = 128
+
+# Default frames between kept game states, every frame
+DEFAULT_SNAPSHOT_INTERVAL = 1
+
+# step(state, local_bits, remote_bits) returns the packed state after one frame, used to rebuild
+# states that weren't kept (only needed when snapshot_interval is more than 1)
+class RollbackHistory:
+    def __init__(self, capacity=DEFAULT_CAPACITY, snapshot_interval=DEFAULT_SNAPSHOT_INTERVAL, step=None):
+        self.capacity = capacity
+        self.snapshot_interval = snapshot_interval
+        self.step = step
+
+        # Kept states, one column per game state variable (order is the same as GameState.make_list()),
+        # indexed by frame // snapshot_interval modulo the number of slots, and the frame in each slot
+        self.snapshot_slots = capacity // snapshot_interval + 2
+        self.state_columns = [array("i", [0]) * self.snapshot_slots for _ in range(6)]
+        self.snapshot_frames = array("q", [-1]) * self.snapshot_slots
+
+        # Newest state stored, and the state of the oldest frame (the last confirmed one)
+        self.newest_state_frame = -1
+        self.newest_state = None
+        self.base_state = None
+
+        # Control bitfields for each frame, and whether the remote one is confirmed or just a prediction
+        self.local_inputs = array("B", [0]) * capacity
+        self.remote_inputs = array("B", [0]) * capacity
+        self.remote_confirmed = array("B", [0]) * capacity
+
+        self.oldest_frame = 0 # Oldest frame still stored
+        self.end_frame = 0 # One past the newest frame stored (equivalent to len of the old rollback_list)
+        self.first_unconfirmed_frame = 0 # Oldest frame whose remote input has not been confirmed
+
+    # Readable string summary of the window held
+    def __str__(self):
+        return ("frames: " + str(self.oldest_frame) + "-" + str(self.end_frame - 1) + "\n"
+              + "first unconfirmed: " + str(self.first_unconfirmed_frame))
+
+    # True if the given frame is currently stored
+    def contains(self, frame):
+        return self.oldest_frame <= frame < self.end_frame
+
+    # True if no more frames can be appended until older ones are trimmed
+    def is_full(self):
+        return self.end_frame - self.oldest_frame >= self.capacity
+
+    # Add the next frame with the given inputs (remote input is a prediction), returns False if full
+    def append(self, local_bits, remote_bits, state=None):
+        if self.is_full():
+            return False
+
+        slot = self.end_frame % self.capacity
+        self.local_inputs[slot] = local_bits
+        self.remote_inputs[slot] = remote_bits
+        self.remote_confirmed[slot] = 0
+        self.end_frame += 1
+
+        if state is not None:
+            self.set_state(self.end_frame - 1, state)
+        return True
+
+    # Packed fast_logic game state for a frame, rebuilt from an earlier one if it wasn't kept
+    def get_state(self, frame):
+        if frame == self.newest_state_frame:
+            return self.newest_state
+        state = self.stored_state(frame)
+        if state is None:
+            state = self.rebuild_state(frame)
+        return state
+
+    # Packed game state kept for a frame, None if it wasn't kept (see snapshot_interval)
+    def stored_state(self, frame):
+        if frame == self.newest_state_frame:
+            return self.newest_state
+        if frame == self.oldest_frame:
+            return self.base_state
+        if frame % self.snapshot_interval:
+            return None
+
+        slot = (frame // self.snapshot_interval) % self.snapshot_slots
+        if self.snapshot_frames[slot] != frame:
+            return None
+        columns = self.state_columns
+        return (columns[0][slot], columns[1][slot], columns[2][slot],
+                columns[3][slot], columns[4][slot], columns[5][slot])
+
+    # Simulate a frame's state forward from the newest kept state before it
+    def rebuild_state(self, frame):
+        start_frame = frame - frame % self.snapshot_interval
+        state = None
+        while start_frame > self.oldest_frame:
+            state = self.stored_state(start_frame)
+            if state is not None:
+                break
+            start_frame -= self.snapshot_interval
+        if state is None:
+            start_frame, state = self.oldest_frame, self.base_state
+
+        for rebuilt_frame in range(start_frame + 1, frame + 1):
+            slot = rebuilt_frame % self.capacity
+            state = self.step(state, self.local_inputs[slot], self.remote_inputs[slot])
+        return state
+
+    # Store the packed game state for a frame, only kept if it is a snapshot frame, the newest or the oldest
+    def set_state(self, frame, state):
+        if frame >= self.newest_state_frame:
+            self.newest_state_frame = frame
+            self.newest_state = state
+        if frame == self.oldest_frame:
+            self.base_state = state
+        if frame % self.snapshot_interval:
+            return
+
+        slot = (frame // self.snapshot_interval) % self.snapshot_slots
+        self.snapshot_frames[slot] = frame
+        columns = self.state_columns
+        columns[0][slot], columns[1][slot], columns[2][slot], columns[3][slot], columns[4][slot], columns[5][slot] = state
+
+    def local_input(self, frame):
+        return self.local_inputs[frame % self.capacity]
+
+    def set_local_input(self, frame, bits):
+        self.local_inputs[frame % self.capacity] = bits
+
+    def remote_input(self, frame):
+        return self.remote_inputs[frame % self.capacity]
+
+    # Overwrite the prediction of the remote input for a frame
+    def set_remote_input(self, frame, bits):
+        self.remote_inputs[frame % self.capacity] = bits
+
+    def is_remote_confirmed(self, frame):
+        if frame < self.oldest_frame:
+            return True # Only confirmed frames are ever trimmed
+        if frame >= self.end_frame:
+            return False
+        return bool(self.remote_confirmed[frame % self.capacity])
+
+    # Newest remote input confirmed before a frame, as (control bitfield, frames from it to frame)
+    def last_confirmed_remote_input(self, frame):
+        confirmed_frame = frame - 1
+        while confirmed_frame > self.oldest_frame and not self.remote_confirmed[confirmed_frame % self.capacity]:
+            confirmed_frame -= 1
+        return self.remote_inputs[confirmed_frame % self.capacity], frame - confirmed_frame
+
+    # Guess every unconfirmed remote input from first_frame on again, with predict(last_bits, frames_ahead)
+    # from the newest confirmed input before each (see input_prediction)
+    # Returns the first and last frame whose input changed, (None, None) if none did
+    def repredict(self, first_frame, predict):
+        first_changed = last_changed = None
+        last_bits, frames_ahead = self.last_confirmed_remote_input(first_frame)
+        for frame in range(first_frame, self.end_frame):
+            slot = frame % self.capacity
+            if self.remote_confirmed[slot]:
+                last_bits, frames_ahead = self.remote_inputs[slot], 1
+                continue
+
+            bits = predict(last_bits, frames_ahead)
+            if bits != self.remote_inputs[slot]:
+                self.remote_inputs[slot] = bits
+                if first_changed is None:
+                    first_changed = frame
+                last_changed = frame
+            frames_ahead += 1
+        return first_changed, last_changed
+
+    # Store an input actually received from the remote player for a frame
+    # A frame one past the newest is appended first, predicting the local input as unchanged
+    # Returns False (input refused) if the frame is outside the window held
+    def confirm_remote_input(self, frame, bits):
+        if frame == self.end_frame and self.end_frame > self.oldest_frame:
+            if not self.append(self.local_input(frame - 1), bits):
+                return False
+
+        if not self.contains(frame):
+            return False
+
+        slot = frame % self.capacity
+        self.remote_inputs[slot] = bits
+        self.remote_confirmed[slot] = 1
+
+        # Move the confirmed boundary past every frame that is now confirmed
+        while self.first_unconfirmed_frame < self.end_frame and self.remote_confirmed[self.first_unconfirmed_frame % self.capacity]:
+            self.first_unconfirmed_frame += 1
+        return True
+
+    # Drop frames that can no longer be rolled back to. The state of the last confirmed frame is
+    # always kept as the starting point of a rollback, as is every frame from keep_frame onwards
+    def trim(self, keep_frame):
+        new_oldest = min(self.first_unconfirmed_frame - 1, keep_frame)
+        if new_oldest > self.oldest_frame:
+            self.base_state = self.get_state(new_oldest)
+            self.oldest_frame = new_oldest
@@ -4,322 +4,731 @@ The game moves on with solely the local player's input,
 listening on another thread, and if it receives a packet late it will
 simulate the game state to catch up
 
+The listening thread only receives and decodes messages and hands them over through a queue.
+The simulation thread alone reads and writes the history: it takes everything received at the
+start of each tick and does any rollbacks right there, so no lock is needed between the two
 
-TODO: currently getting desync errors where one computer gets ahead of another, need to probably rapidly simulate the game state and send packets in that case I guess
+Remote inputs that haven't arrived are guessed by a predictor (see input_prediction). Late inputs
+are only collected while a tick's messages are applied; then the guesses after them are redone and
+the game is resimulated once, from the earliest frame whose input turned out different, however
+many late inputs arrived together
+
+
+If one computer gets ahead of the other, time_sync has the one ahead run slightly slower
+(or sit out frames) and the one behind slightly faster until they meet again
+
+With local input delay, the input read on a tick is played input_delay frames later, so the
+remote usually has it before it needs it and fewer frames get rolled back. The delay can be fixed
+or follow the measured round trip time and jitter (see time_sync.InputDelayController)
 """
 
 import game_logic
-import socket
+import fast_logic
+import rollback_history
 import threading
-import pygame
-import copy
+import time
+import collections
+import time_sync
+from array import array
+import wire_protocol
+import render_loop
+import replay
+import desync_detector
+import input_prediction
 import json
+from telemetry import metrics
+import tracing
+
+
+
+
+# Globals - just have the history of inputs/game states
+
+# Ring buffer of inputs (fast_logic control bitfields) and game states (fast_logic packed tuples) indexed by frame
+# Replaced with a fresh one for each match, see start_match
+history = rollback_history.RollbackHistory()
+
+# Frames between game states kept in the history, the rest are rebuilt when needed (see rollback_history)
+SNAPSHOT_INTERVAL = rollback_history.DEFAULT_SNAPSHOT_INTERVAL
+
+# Messages decoded by the listening thread waiting for the simulation thread, as (arrival time, message)
+# Only the listener appends and only the simulation thread pops, and deque appends and pops are atomic
+received_messages = collections.deque()
+
+# Set once the connection to the remote is gone (the listener stopped or a send failed), ends the match
+connection_lost = threading.Event()
 
+# Remote inputs for frames we haven't reached yet (or couldn't store yet), frame: control bitfield
+# Used once we reach the frame, so they don't have to be resent
+early_remote_inputs = {}
 
+# Most inputs repeated in one message, a bit under the history capacity so any gap the
+# history can still hold will be refilled (an inputs message holds up to ~240 changes)
+MAX_REDUNDANT_INPUTS = 120
 
+# Guesses the remote inputs that haven't arrived yet, see input_prediction
+predictor = input_prediction.RepeatLastInput()
 
-# Globals - just have the list of inputs/game states
+# Late remote inputs applied since the last resimulation: the earliest one (predictions after it are
+# redone), and the earliest and newest frames whose input turned out different (None if none)
+first_late_frame = None
+first_mispredicted_frame = None
+last_mispredicted_frame = None
 
-# List of dictionaries with keys: local_input, remote_input, game_state_str
-rollback_list = []
+# Replay file writer (None if not recording)
+recorder = None
 
-# lock to make sure there's nothing weird
-lock = threading.Lock()
+# Compares our confirmed state checksums against the remote's, its counters show whether we've desynced
+detector = desync_detector.DesyncDetector()
 
-# Number of frames back to to render
-DELAY = 1
+# Measures round trip time and frame advantage, and sets the frame rate to keep both players level
+synchronizer = time_sync.TimeSync()
+
+# Chooses the local input delay, and the delay in use: inputs read on a tick are sent for frame_number + input_delay
+delay_controller = time_sync.InputDelayController(0, 0)
+input_delay = 0
+
+# Newest frame that can no longer change (recorded and checksummed)
+finalized_frame = 0
+
+# Seconds to wait for the remote player's start message before sending ours again
+START_RESEND_INTERVAL = 0.2
+
+# Seconds to keep resending our last inputs at the end of a match with a frame limit, see finish_match
+FINISH_TIMEOUT = 5
+
+# Ticks per second while waiting on the remote when the tick rate is uncapped
+UNCAPPED_WAIT_RATE = 1000
+
+# Seconds between resends of our newest inputs while sitting out frames, in case the remote is stuck
+# waiting on inputs it dropped (its history was full) and nothing new is being sent
+STALL_RESEND_INTERVAL = 0.05
+
+# Match counters, printed when the game ends
+rollback_count = 0 # Resimulations after mispredicted remote inputs (one per tick at most)
+mispredicted_inputs = 0 # Remote inputs that differed from what was predicted
+max_rollback_depth = 0 # Most frames resimulated by one rollback
+resimulated_frames = 0 # Frames simulated again in total
+stalled_frames = 0 # Frames sat out waiting for the remote
+
+# When our newest inputs were last resent while sitting out frames
+last_resend_time = 0.0
+rollback_depth_counts = [0] * (history.capacity + 1) # Number of rollbacks of each depth, indexed by depth
 
 # Store player num for simulation
 
-# Returns byte message in format FS,frame_number,control_state
-def encode_control_message(frame_number, control_state):
-    try:
-        if player_num == 1:
-            message = "FS1" + "|" + str(frame_number) + "|" + json.dumps(control_state.make_list()) + "|\n"
-        else:
-            message = "FS2" + "|" + str(frame_number) + "|" + json.dumps(control_state.make_list()) + "|\n"
-        return message.encode()
-    except Exception as e:
-        print(f"The following error occured trying to encode the message: {e}")
-        raise Exception("Message Encoding Error")
-
-# Given the input buffer byte string, returns frame_number, control_state, remaining bytes in buffer
-def decode_buffer_first_message(buffer):
-    try:
-        message = buffer.decode()
-        #print(message)
-        split_message = message.split("|") # Can't be typical , because json
-        frame_number = int(split_message[1])
-        control_state_list = json.loads(split_message[2])
-        control_state = game_logic.ControlState(control_state_list=control_state_list)
-
-        remaining_buffer = (message.partition("|\n")[2]).encode()
-
-        return frame_number, control_state, remaining_buffer
-    except Exception as e:
-        print(f"The following error occured trying to decode the received message: {e}")
-        raise Exception("Message Decoding Error")
-
-def listen_thread(remote_socket):
-    # Use the global frame number and sender
-    
-    # Setup receiving buffer
-    buffer = b""
-    
+# Returns the next message in the reader's buffer as a tuple (msg_type, field, ...), see wire_protocol
+# Blocks receiving from the transport until a whole message is buffered, returns None if the connection closed
+def receive_message(remote_transport, reader):
     while True:
-        while True:
-            try:
-                buffer += remote_socket.recv(1024)
-                remote_frame_number, remote_control_state, buffer = decode_buffer_first_message(buffer)
+        with tracing.span("decode"):
+            message = reader.next_message()
+        if message is not None:
+            return message
+
+        with tracing.span("recv"):
+            data = remote_transport.recv()
+        if not data:
+            return None
+        reader.feed(data)
+
+# Returns the packed game state one frame on from state with the given local and remote control bitfields
+def step_frame(state, local_bits, remote_bits):
+    # Player 1 is left, player 2 right
+    if player_num == 1:
+        return fast_logic.step(state, local_bits, remote_bits)
+    return fast_logic.step(state, remote_bits, local_bits)
+
+# Returns the packed game state for frame i, simulated from the stored state of frame i-1
+# and the stored inputs for frame i. Only call from the simulation thread
+def simulate_frame(i):
+    return step_frame(history.get_state(i-1), history.local_input(i), history.remote_input(i))
+
+# Re-simulate frames first_frame up to (not including) last_frame after an input for first_frame changed
+# The resimulation stops early once a state matches the one kept before, but only from converged_frame
+# on (the newest frame whose input changed, first_frame if None), since frames after a changed input
+# can still differ even if an earlier state matched
+# Returns the number of frames simulated. Only call from the simulation thread
+def resimulate(first_frame, last_frame, converged_frame=None):
+    global rollback_count, max_rollback_depth, resimulated_frames
+    start_time = time.perf_counter()
+    simulated = 0
+    if converged_frame is None:
+        converged_frame = first_frame
+    with tracing.span("resimulate", first_frame):
+        sim_game_state = history.get_state(first_frame - 1)
+        for i in range(first_frame, last_frame):
+            sim_game_state = step_frame(sim_game_state, history.local_input(i), history.remote_input(i))
+            simulated += 1
+
+            # Only states the history kept can be compared, see rollback_history
+            if i >= converged_frame and sim_game_state == history.stored_state(i):
+                # end early - new inputs inconsequential from here on
                 break
-            except Exception as e:
-                print(f"Exception when receiving message: {e}")
-                continue
-
-        with lock:
-            if frame_number == remote_frame_number:
-                # Best case scenario - packet received on time
-                # print("Packet received on time")
-                    # check if local already appended its input
-                if len(rollback_list) == frame_number:
-                        # Not yet, append a new dictionary
-                    rollback_list.append({
-                            "local_input": copy.deepcopy(rollback_list[-1]["local_input"]),
-                            "remote_input": remote_control_state.make_list(),
-                            "game_state_list":None
-                        
-                    })
-                elif len(rollback_list) > frame_number:
-                    rollback_list[remote_frame_number]["remote_input"] = remote_control_state.make_list()
-            elif frame_number > remote_frame_number:
-                # print("packet received late")
-
-                if rollback_list[remote_frame_number]["remote_input"] != remote_control_state.make_list():
-                    # Overwrite the previous input and re-simulate game state
-                    rollback_list[remote_frame_number]["remote_input"] = remote_control_state.make_list()
-
-                    # Go up until the previous frame, since that'll be rendered
-                    for i in range(remote_frame_number, frame_number):
-                        if player_num == 1:
-                            sim_game_state = game_logic.update_state(
-                                game_logic.GameState(game_state_list=rollback_list[i-1]["game_state_list"]),
-                                game_logic.ControlState(control_state_list=rollback_list[i]["local_input"]),
-                                game_logic.ControlState(control_state_list=rollback_list[i]["remote_input"])
-
-                            )
-                        else:
-                            sim_game_state = game_logic.update_state(
-                                game_logic.GameState(game_state_list=rollback_list[i-1]["game_state_list"]),
-                                game_logic.ControlState(control_state_list=rollback_list[i]["remote_input"]),
-                                game_logic.ControlState(control_state_list=rollback_list[i]["local_input"])
-                            )
-
-                        if sim_game_state.make_list() == rollback_list[i]["game_state_list"]:
-                            # end early - new input inconsequential
-                            break
-                        rollback_list[i]["game_state_list"] = sim_game_state.make_list()
-
-
-
-
-            elif frame_number < remote_frame_number:
-                # Worst case scenario - computers desynced/ running diff rates
-                # Speed up to catch up to the remote
-                # Send multiple packets of assumed inputs and simulate
-                # game state to catch up
-                # Append to list as needed
-                with lock:
-
-                    print(f"desync - remote computer ahead by {remote_frame_number-frame_number}")
-                    """
-                    # Leaving this off for now - taking out the print statements speeds up the code enough so that there are no desyncs 
-
-                    global frame_number
-                    global sender
-                    while frame_number < remote_frame_number:
-                        last_input = rollback_list[frame_number-1]["local_input"]
-                        sent = sender.send(frame_number, game_logic.ControlState(control_state_list=last_input))
-
-                        if sent:
-                            # Successfully sent the input - add it to the list
-                            # Also simulate the game state
-                            # DO NOT make assumptions for the remote input - idk what to do, if there are gaps in the received input just stop there???
-
-                            # This one should not be called
-                            if len(rollback_list) > frame_number:
-                                rollback_list[frame_number]["local_input"] = copy.deepcopy(last_input)
-
-                                if player_num == 1:
-                                    sim_game_state = game_logic.update_state(
-                                        game_logic.GameState(game_state_list=rollback_list[frame_number-1]["game_state_list"]),
-                                        game_logic.ControlState(control_state_list=rollback_list[frame_number]["local_input"]),
-                                        game_logic.ControlState(control_state_list=rollback_list[frame_number]["remote_input"])
-                                    )
-                                else:
-                                    sim_game_state = game_logic.update_state(
-                                        game_logic.GameState(game_state_list=rollback_list[frame_number-1]["game_state_list"]),
-                                        game_logic.ControlState(control_state_list=rollback_list[frame_number]["remote_input"]),
-                                        game_logic.ControlState(control_state_list=rollback_list[frame_number]["local_input"])
-                                    )
-                                rollback_list[frame_number]["game_state_list"] = sim_game_state.make_list()
-                            # Hopefully this one should be called, where we can use the remote input and add it as well
-                            if len(rollback_list) == frame_number and len(rollback_list) == remote_frame_number:
-
-                            
-                        frame_number = frame_number + 1
-                    """
-                
-
-
-        # now handle the game state updates in the main loop
+            history.set_state(i, sim_game_state)
+
+    rollback_count += 1
+    max_rollback_depth = max(max_rollback_depth, simulated)
+    resimulated_frames += simulated
+    rollback_depth_counts[min(simulated, len(rollback_depth_counts) - 1)] += 1
+    metrics.increment("rollbacks")
+    metrics.observe("rollback_depth_frames", simulated)
+    metrics.observe("resimulation_seconds", time.perf_counter() - start_time)
+    return simulated
+
+# Readable string summary of the match counters
+def match_summary():
+    return ("frames: " + str(frame_number - 1) + "\n"
+          + "rollbacks: " + str(rollback_count) + "\n"
+          + "mispredicted inputs: " + str(mispredicted_inputs) + "\n"
+          + "max rollback depth: " + str(max_rollback_depth) + "\n"
+          + "resimulated frames: " + str(resimulated_frames) + "\n"
+          + "stalled frames: " + str(stalled_frames) + "\n"
+          + str(delay_controller) + "\n"
+          + str(synchronizer) + "\n"
+          + str(detector))
+
+# Match counters and the final confirmed state as a dictionary, written out by --stats-out
+# Only call from the simulation thread
+def match_stats(seconds):
+    frames = frame_number - 1
+    return {
+        "mode": "Rollback",
+        "player": player_num,
+        "frames": frames,
+        "seconds": seconds,
+        "frames_per_sec": frames / seconds if seconds > 0 else 0,
+        "rollbacks": rollback_count,
+        "mispredicted_inputs": mispredicted_inputs,
+        "max_rollback_depth": max_rollback_depth,
+        "rollback_depths": {depth: count for depth, count in enumerate(rollback_depth_counts) if count},
+        "resimulated_frames": resimulated_frames,
+        "stalled_frames": stalled_frames,
+        "refused_inputs": metrics.values["refused_inputs"],
+        "rtt_ms": None if synchronizer.rtt is None else synchronizer.rtt * 1000,
+        "rtt_deviation_ms": synchronizer.rtt_deviation * 1000,
+        "input_delay": input_delay,
+        "checks": detector.checks,
+        "mismatches": detector.mismatches,
+        "first_desync_frame": detector.first_desync_frame,
+        "final_frame": finalized_frame,
+        "final_checksum": fast_logic.state_checksum(history.get_state(finalized_frame)),
+    }
+
+# Handle every frame that can no longer change (remote input confirmed and already simulated)
+# up to frame_limit: write it to the replay file and checksum it for the remote (sent by the sender)
+# Only call from the simulation thread
+def finalize_frames(frame_limit):
+    global finalized_frame
+    last_final_frame = min(history.first_unconfirmed_frame - 1, frame_limit)
+    while finalized_frame < last_final_frame:
+        finalized_frame += 1
+
+        if recorder is not None:
+            # Player 1 is left, player 2 right
+            if player_num == 1:
+                recorder.record_frame(history.local_input(finalized_frame), history.remote_input(finalized_frame), history.get_state(finalized_frame))
+            else:
+                recorder.record_frame(history.remote_input(finalized_frame), history.local_input(finalized_frame), history.get_state(finalized_frame))
+
+        if detector.is_checksum_frame(finalized_frame):
+            checksum = fast_logic.state_checksum(history.get_state(finalized_frame))
+            detector.add_local(finalized_frame, checksum)
+
+# Receives and decodes messages from the remote and queues them for the simulation thread
+# Sets connection_lost when the connection closes, so the simulation stops too
+def listen_thread(remote_transport, reader):
+    while True:
+        try:
+            message = receive_message(remote_transport, reader)
+        except (OSError, ValueError) as e:
+            print(f"Exception when receiving message: {e}")
+            message = None
+
+        if message is None:
+            print("Connection to remote player lost")
+            connection_lost.set()
+            return
+
+        if message[0] in (wire_protocol.MSG_INPUTS, wire_protocol.MSG_CHECKSUM):
+            received_messages.append((time.perf_counter(), message))
+
+# Fill in the remote's input for a frame, rolling back if it differs from what was predicted
+# Only call from the simulation thread
+def apply_remote_input(remote_frame_number, remote_bits):
+    if history.is_remote_confirmed(remote_frame_number):
+        return # Already arrived in an earlier message
+
+    if frame_number == remote_frame_number:
+        # Best case scenario - packet received on time
+        metrics.increment("on_time_inputs")
+        # History appends the frame if local hasn't yet, if it's full keep the input until there's room
+        if not history.confirm_remote_input(remote_frame_number, remote_bits):
+            early_remote_inputs[remote_frame_number] = remote_bits
+    elif frame_number > remote_frame_number:
+        # Packet received late
+
+        if not history.contains(remote_frame_number):
+            # Too old to roll back to (already confirmed and trimmed), refuse it
+            metrics.increment("refused_inputs")
+            return
+
+        metrics.increment("late_inputs")
+        predicted_bits = history.remote_input(remote_frame_number)
+        history.confirm_remote_input(remote_frame_number, remote_bits)
+        note_late_input(remote_frame_number, predicted_bits != remote_bits)
+    else:
+        # Remote is running ahead of us, keep inputs for frames we haven't reached yet until we do
+        # (time sync has the remote slow down to meet us)
+        metrics.increment("early_inputs")
+        early_remote_inputs[remote_frame_number] = remote_bits
+
+# Remember a late remote input for the resimulation at the end of the tick, see resimulate_mispredictions
+def note_late_input(late_frame, mispredicted):
+    global first_late_frame, mispredicted_inputs
+    if first_late_frame is None or late_frame < first_late_frame:
+        first_late_frame = late_frame
+    if mispredicted:
+        mispredicted_inputs += 1
+        metrics.increment("mispredicted_inputs")
+        note_changed_inputs(late_frame, late_frame)
+
+# Widen the range of frames whose input changed since the last resimulation
+def note_changed_inputs(first_frame, last_frame):
+    global first_mispredicted_frame, last_mispredicted_frame
+    if first_mispredicted_frame is None or first_frame < first_mispredicted_frame:
+        first_mispredicted_frame = first_frame
+    if last_mispredicted_frame is None or last_frame > last_mispredicted_frame:
+        last_mispredicted_frame = last_frame
+
+# Once every late input this tick has been applied, redo the predictions after them and resimulate
+# once from the earliest frame whose input changed (up to the previous frame, since that'll be rendered)
+# Only call from the simulation thread
+def resimulate_mispredictions():
+    global first_late_frame, first_mispredicted_frame, last_mispredicted_frame
+    if first_late_frame is None:
+        return
+
+    first_changed, last_changed = history.repredict(first_late_frame + 1, predictor.predict)
+    if first_changed is not None:
+        note_changed_inputs(first_changed, last_changed)
+
+    if first_mispredicted_frame is not None and first_mispredicted_frame < frame_number:
+        resimulate(first_mispredicted_frame, frame_number, last_mispredicted_frame)
+
+    first_late_frame = first_mispredicted_frame = last_mispredicted_frame = None
+
+# Newest frame up to which we have every remote input, counting ones kept for frames we haven't reached
+# Sent as our ack, so the remote stops resending inputs that arrived early
+def remote_ack_frame():
+    frame = history.first_unconfirmed_frame
+    while frame in early_remote_inputs:
+        frame += 1
+    return frame - 1
+
+# Handle every message the listener has queued: compare checksums, take acks and time sync info,
+# and fill in the remote's inputs, rolling back wherever a prediction was wrong
+# Only call from the simulation thread
+def apply_received_messages():
+    # Inputs kept from earlier messages that are due now
+    if early_remote_inputs:
+        for early_frame in sorted(early_frame for early_frame in early_remote_inputs if early_frame <= frame_number):
+            apply_remote_input(early_frame, early_remote_inputs.pop(early_frame))
+
+    now = time.perf_counter()
+    while received_messages:
+        arrival_time, message = received_messages.popleft()
+        metrics.observe("message_queue_seconds", now - arrival_time)
+
+        if message[0] == wire_protocol.MSG_CHECKSUM:
+            msg_type, checksum_frame, checksum = message
+            detector.add_remote(checksum_frame, checksum)
+            continue
+
+        msg_type, newest_frame, ack_frame, remote_advantage, remote_inputs = message
+        first_frame = newest_frame - len(remote_inputs) + 1
+
+        # Remote has every one of our inputs up to ack_frame, no need to resend them
+        sender.acknowledge(ack_frame)
+
+        synchronizer.on_ack(ack_frame, arrival_time)
+        synchronizer.on_remote_frame(newest_frame, remote_advantage, arrival_time)
+
+        # Fill in every input in the message that hasn't already arrived in an earlier one
+        for remote_frame_number in range(first_frame, newest_frame + 1):
+            apply_remote_input(remote_frame_number, remote_inputs[remote_frame_number - first_frame])
+
+    # One rollback for everything that arrived late
+    resimulate_mispredictions()
 
 # controlled sender checks to make sure that a packet hasn't been sent
 # for the frame number
-# Only call its send within a locked block
+# Each message also repeats every earlier input the remote hasn't acknowledged yet (up to
+# MAX_REDUNDANT_INPUTS), so one lost or late message doesn't leave a gap the remote has to predict,
+# and every checksum from detector the remote still needs (see desync_detector)
+# Only call its methods from the simulation thread
 class Controlled_Sender:
-    def __init__(self, remote_socket, start_frame=1):
-        self.remote_socket = remote_socket
+    def __init__(self, remote_transport, detector, start_frame=1):
+        self.remote_transport = remote_transport
+        self.detector = detector
         self.curr_frame = start_frame
+        self.start_frame = start_frame
+
+        # Recently sent control bitfields, indexed by frame modulo MAX_REDUNDANT_INPUTS
+        self.sent_inputs = array("B", [0]) * MAX_REDUNDANT_INPUTS
+
+        # Newest frame up to which the remote has acknowledged every input
+        self.remote_ack = start_frame - 1
+
+    # Record the remote's ack from a received message
+    def acknowledge(self, ack_frame):
+        if ack_frame > self.remote_ack:
+            self.remote_ack = ack_frame
+
+    # Encoded inputs message for every unacknowledged input up to frame, plus any checksums to send
+    def inputs_message(self, frame, ack_frame, advantage):
+        first_frame = max(self.remote_ack + 1, frame - MAX_REDUNDANT_INPUTS + 1, self.start_frame)
+        inputs = [self.sent_inputs[f % MAX_REDUNDANT_INPUTS] for f in range(first_frame, frame + 1)]
+
+        msg_bytes = wire_protocol.encode_inputs(frame, ack_frame, advantage, inputs)
+        for checksum_frame, checksum in self.detector.outgoing_checksums():
+            msg_bytes += wire_protocol.encode_checksum(checksum_frame, checksum)
+        return msg_bytes
+
+    # Send the control bitfield for a frame along with our ack frame and frame advantage
+    # Any frames skipped since the last send (the input delay grew) get the same bitfield
+    # Returns True if sent, False if the frame was already sent (the input delay shrank)
+    def send(self, frame, control_bits, ack_frame, advantage):
+        if frame < self.curr_frame:
+            return False
+
+        for skipped_frame in range(self.curr_frame, frame + 1):
+            self.sent_inputs[skipped_frame % MAX_REDUNDANT_INPUTS] = control_bits
+        self.send_message(self.inputs_message(frame, ack_frame, advantage))
+        self.curr_frame = frame + 1
+        return True
+
+    # Send an encoded message, a failed send means the remote is gone and sets connection_lost
+    def send_message(self, msg_bytes):
+        try:
+            self.remote_transport.send(msg_bytes)
+        except OSError as e:
+            print(f"Exception when sending message: {e}")
+            connection_lost.set()
+
+    # Control bitfield sent for a recent frame
+    def sent_input(self, frame):
+        return self.sent_inputs[frame % MAX_REDUNDANT_INPUTS]
+
+    # Send the newest inputs again (nothing new to send, but the remote may still be missing some)
+    def resend(self, ack_frame, advantage):
+        if self.curr_frame > self.start_frame:
+            self.send_message(self.inputs_message(self.curr_frame - 1, ack_frame, advantage))
+
+# Runs one tick of the game: takes in received messages, then either sits out the frame or sends the
+# local input (from local_input, see input_source) and simulates the next frame
+# Publishes the state to show to snapshots (see render_loop)
+# Returns the frame rate to run the next tick at, 0 for straight away. Only call from the simulation thread
+def simulation_tick(local_input, snapshots, tick_rate=time_sync.FRAME_RATE):
+    global frame_number, stalled_frames, last_resend_time, input_delay
+
+    tick_start = time.perf_counter()
+    with tracing.span("read input"):
+        local_bits = local_input.next_bits(frame_number)
+
+    # The one point each tick where remote inputs arrive, and any rollbacks happen
+    with tracing.span("apply received messages"):
+        apply_received_messages()
+
+    # Drop frames that can't be rolled back to anymore, finalizing them first
+    with tracing.span("finalize"):
+        finalize_frames(frame_number - 1)
+        history.trim(frame_number - 1)
+
+    # Time sync compares the frames of the newest inputs each player has sent
+    input_delay = delay_controller.update(synchronizer.rtt, synchronizer.rtt_deviation)
+    input_frame = frame_number + input_delay
+    metrics.set("input_delay_frames", input_delay)
+
+    # If the remote hasn't confirmed anything for a whole history window, wait for it
+    # rather than running further ahead. Also sit out the frame if we're far ahead of the remote
+    # Uncapped, neither player can fall behind the other by time so only the history limit applies
+    now = time.perf_counter()
+    waiting = history.end_frame == frame_number and history.is_full()
+    if tick_rate:
+        waiting = waiting or synchronizer.should_wait(input_frame, now)
+
+        # Run slightly slower or faster than 30fps to meet the remote
+        frame_rate = synchronizer.target_frame_rate(input_frame, now)
+    else:
+        frame_rate = 0
+
+    advantage = synchronizer.encoded_advantage(input_frame, now)
+    metrics.set("frame_advantage", advantage)
+
+    if waiting:
+        stalled_frames += 1
+        metrics.increment("stalled_frames")
+        if now - last_resend_time >= STALL_RESEND_INTERVAL:
+            sender.resend(remote_ack_frame(), advantage)
+            last_resend_time = now
+        snapshots.publish(history.get_state(frame_number-1), time.perf_counter())
+        end_tick(tick_start, tick_rate)
+        return tick_rate if tick_rate else UNCAPPED_WAIT_RATE
+
+    # Not sent if the input delay just shrank, this frame's input then went out on an earlier tick
+    first_new_frame = sender.curr_frame
+    with tracing.span("send"):
+        sent = sender.send(input_frame, local_bits, remote_ack_frame(), advantage)
+    if sent:
+        sent_time = time.perf_counter()
+        for sent_frame in range(first_new_frame, input_frame + 1):
+            synchronizer.on_send(sent_frame, sent_time)
+
+    # Play the input sent for this frame
+    local_bits = sender.sent_input(frame_number)
+    if history.end_frame > frame_number:
+        history.set_local_input(frame_number, local_bits)
+    elif history.end_frame == frame_number:
+        # Predict the remote input from the newest one received
+        history.append(local_bits, predictor.predict(*history.last_confirmed_remote_input(frame_number)))
+    else:
+        # Error - somehow skipped a frame locally???
+        #
+        print("Error - desync?")
+
+    # Show the last frame, drawn by the render loop whenever it gets to it
+    snapshots.publish(history.get_state(frame_number-1), time.perf_counter())
+
+    # Use the previous game state and the current inputs to calc new game state
+    with tracing.span("simulate"):
+        history.set_state(frame_number, simulate_frame(frame_number))
+    frame_number += 1
+    metrics.increment("frames")
+
+    end_tick(tick_start, tick_rate)
+    return frame_rate
+
+# Record how long a tick's work took, and whether it overran its frame
+def end_tick(tick_start, tick_rate):
+    tick_seconds = time.perf_counter() - tick_start
+    metrics.observe("tick_seconds", tick_seconds)
+    if tick_rate and tick_seconds > 1 / tick_rate:
+        metrics.increment("tick_overruns")
+    if synchronizer.rtt is not None:
+        metrics.set("rtt_seconds", synchronizer.rtt)
+        metrics.set("rtt_deviation_seconds", synchronizer.rtt_deviation)
+
+# True once a match with a frame limit has been played out, and false until then
+def reached_frame_limit(max_frames):
+    return max_frames is not None and frame_number > max_frames
+
+# Runs the game simulation at tick_rate (~30fps, 0 for as fast as possible) until stop is set, max_frames is
+# reached or the connection is lost. Reads local controls from local_input (see input_source) and publishes the state to show to snapshots (see render_loop)
+def simulation_loop(local_input, snapshots, stop, max_frames=None, tick_rate=time_sync.FRAME_RATE):
+    clock = time_sync.FrameClock()
 
-    # Returns True if sent, false if not
-    def send(self, frame, msg_bytes):
-        if frame == self.curr_frame:
-            # Send is valid - send the message and increment curr
-            self.remote_socket.send(msg_bytes)
-            self.curr_frame += 1
+    # Game Loop
+    while not stop.is_set() and not reached_frame_limit(max_frames) and not connection_lost.is_set():
+        with tracing.span("tick", frame_number):
+            frame_rate = simulation_tick(local_input, snapshots, tick_rate)
+
+        # Lock the game at ~30fps, all timings are based on framerate, so this controls run speed
+        with tracing.span("sleep"):
+            clock.tick(frame_rate)
+
+    # Let the render loop know the game is over
+    stop.set()
+
+# One step of finishing a match with a frame limit: take in received messages and resend our last inputs,
+# with the checksums of the last frames once they are final
+# Returns True once we have the remote's inputs up to last_frame and it has acknowledged ours
+def finish_step(last_frame):
+    apply_received_messages()
+    finalize_frames(last_frame)
+    finished = history.first_unconfirmed_frame > last_frame and sender.remote_ack >= last_frame
+
+    # Sent even when finished, so the remote sees our ack for its last frame too
+    sender.resend(remote_ack_frame(), 0)
+    return finished
+
+# At the end of a match with a frame limit, keep resending our last inputs until we have the remote's
+# inputs up to last_frame and it has acknowledged ours, so both players can finalize every frame
+# Gives up after FINISH_TIMEOUT or once the connection is lost, returns True if every frame is confirmed
+# Only call from the simulation thread, or once it has finished
+def finish_match(last_frame):
+    deadline = time.perf_counter() + FINISH_TIMEOUT
+    while not connection_lost.is_set() and time.perf_counter() < deadline:
+        if finish_step(last_frame):
             return True
-        elif frame > self.curr_frame:
-            # Something has gone horribly wrong - message sent without controlled sender
-            print("Error - missed sending packets")
-        return False
+        time.sleep(START_RESEND_INTERVAL)
 
-def run_game(player_number, remote_socket):
-    # First time only setup code
+    apply_received_messages()
+    return history.first_unconfirmed_frame > last_frame
+
+# Set up the globals for a new match, up to frame 0 which both players agree on, resetting everything
+# left from an earlier one
+# See run_game for the arguments
+def start_match(player_number, remote_transport, replay_path=None, tick_rate=time_sync.FRAME_RATE,
+                input_delay_frames=None, max_input_delay_frames=None, snapshot_interval=None, predictor_name="repeat"):
     global player_num
 
     player_num = player_number
 
-    pygame.init()
+    global predictor
+    predictor = input_prediction.make_predictor(predictor_name)
+
+    global history
+    if snapshot_interval is None:
+        snapshot_interval = SNAPSHOT_INTERVAL
+    history = rollback_history.RollbackHistory(snapshot_interval=snapshot_interval, step=step_frame)
+
+    global delay_controller, input_delay
+    if input_delay_frames is None:
+        input_delay_frames = 0 # Rollback covers late inputs, so no delay unless asked for
+    if max_input_delay_frames is None:
+        max_input_delay_frames = input_delay_frames
+    delay_controller = time_sync.InputDelayController(input_delay_frames, max_input_delay_frames, tick_rate)
+    input_delay = delay_controller.delay
+
+    global recorder
+    recorder = replay.ReplayWriter(replay_path) if replay_path else None
+
+    # Uncapped, frame advantage is still estimated at the normal frame rate
+    global synchronizer
+    synchronizer = time_sync.TimeSync(tick_rate or time_sync.FRAME_RATE)
+
+    global detector, finalized_frame
+    detector = desync_detector.DesyncDetector()
+    finalized_frame = 0
 
-    window = pygame.display.set_mode((game_logic.WINDOW_WIDTH, game_logic.WINDOW_HEIGHT))
+    # Nothing left over from an earlier match
+    global received_messages, early_remote_inputs, connection_lost
+    received_messages = collections.deque()
+    early_remote_inputs = {}
+    connection_lost = threading.Event()
 
-    pygame.display.set_caption(game_logic.GAME_NAME)
+    global first_late_frame, first_mispredicted_frame, last_mispredicted_frame
+    first_late_frame = first_mispredicted_frame = last_mispredicted_frame = None
 
-    clock = pygame.time.Clock()
+    global rollback_count, mispredicted_inputs, max_rollback_depth, resimulated_frames, stalled_frames
+    global last_resend_time, rollback_depth_counts
+    rollback_count = mispredicted_inputs = max_rollback_depth = resimulated_frames = stalled_frames = 0
+    last_resend_time = 0.0
+    rollback_depth_counts = [0] * (history.capacity + 1)
 
     game_state = game_logic.GameState(p1_x=100, p2_x=700)
 
     local_control_state = game_logic.ControlState() # Game starts with no controls pressed
     remote_control_state = game_logic.ControlState() # Game starts with no controls pressed
 
-    listener = threading.Thread(target=listen_thread, args=(remote_socket,), daemon=True)
-
     global frame_number # Mark as global to check against elsewhere
     frame_number = 0
 
     global sender
     # First input to be sent on frame 1
-    sender = Controlled_Sender(remote_socket, start_frame=1)
+    sender = Controlled_Sender(remote_transport, detector, start_frame=1)
 
-    # Append frame zero's inputs (nothing) to the list
+    # Append frame zero's inputs (nothing) to the history, both players agree on it
     # prevents index errors hopefully
-    with lock:
-        rollback_list.append({
-                             "local_input": local_control_state.make_list(),
-                             "remote_input": remote_control_state.make_list(),
-                             "game_state_list":game_state.make_list()
-        })
-    running = True
+    history.append(fast_logic.pack_controls(local_control_state), fast_logic.pack_controls(remote_control_state), fast_logic.pack_state(game_state))
+    history.confirm_remote_input(0, fast_logic.pack_controls(remote_control_state))
+
+# Finalize every frame we can, close the replay file and report the match counters
+# seconds is how long the game ran for, and stats_path a file to write match_stats to (None for no file)
+# Only call once the simulation has finished
+def end_match(seconds, stats_path=None):
+    apply_received_messages()
+    finalize_frames(frame_number - 1)
+    if recorder is not None:
+        recorder.close()
+
+    print(match_summary())
+    if stats_path is not None:
+        with open(stats_path, "w") as stats_file:
+            json.dump(match_stats(seconds), stats_file, indent=2)
+
+
+# If replay_path is given, every confirmed frame's inputs are recorded to that file (see replay module)
+# input_source is where the local controls come from (see input_source), the keyboard if None
+# headless runs without a window, max_frames ends the match after that many frames, tick_rate is the
+# frames per second to run at (0 for as fast as possible) and stats_path is a file to write match_stats to
+# input_delay_frames is the local input delay (none if None), or with max_input_delay_frames the least delay to choose
+# automatically (see time_sync.InputDelayController), snapshot_interval the frames between game states the
+# history keeps (SNAPSHOT_INTERVAL if None, see rollback_history) and predictor_name how to guess the remote's
+# inputs (see input_prediction)
+def run_game(player_number, remote_transport, replay_path=None, input_source=None, headless=False,
+             max_frames=None, tick_rate=time_sync.FRAME_RATE, stats_path=None,
+             input_delay_frames=None, max_input_delay_frames=None, snapshot_interval=None, predictor_name="repeat"):
+    # First time only setup code
+    global frame_number
 
-    # This can be the only send without using the controlled sender
-    remote_socket.send(b'starting game')
-    print(remote_socket.recv(1024))
+    start_match(player_number, remote_transport, replay_path, tick_rate, input_delay_frames, max_input_delay_frames,
+                snapshot_interval, predictor_name)
+
+    if not headless:
+        window = render_loop.open_window()
+
+    # Buffer for received messages, shared with the listener once the game starts
+    reader = wire_protocol.MessageReader()
 
-    with lock:
-        frame_number += 1
+    listener = threading.Thread(target=listen_thread, args=(remote_transport, reader), name="listener", daemon=True)
+
+    # This can be the only send without using the controlled sender
+    # Wait for the remote player's start message, anything after it stays buffered in the reader for the listener
+    # The start message is resent until answered in case it was lost (UDP), and an inputs message
+    # also means the remote has started (its start message was lost but ours wasn't)
+    start_message = wire_protocol.encode_start(player_number)
+    remote_transport.send(start_message)
+    message = None
+    while message is None or message[0] not in (wire_protocol.MSG_START, wire_protocol.MSG_INPUTS):
+        message = reader.next_message()
+        if message is None:
+            data = remote_transport.recv(START_RESEND_INTERVAL)
+            if data is None:
+                remote_transport.send(start_message)
+            elif not data:
+                print("Connection to remote player lost before the game started")
+                if not headless:
+                    render_loop.close_window()
+                return 1
+            else:
+                reader.feed(data)
+    print("Remote player ready, starting game")
+
+    frame_number += 1
 
     listener.start()
     #print("started listener")
-    
 
-    # Game Loop
-    while running:
-
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_a: # a moves player left
-                    local_control_state.mv_l = True
-                elif event.key == pygame.K_d: # d moves player right
-                    local_control_state.mv_r = True
-                elif event.key == pygame.K_s: # s is player's attack
-                    local_control_state.atk = True
-
-            if event.type == pygame.KEYUP:
-                if event.key == pygame.K_a: # a moves player left
-                    local_control_state.mv_l = False
-                elif event.key == pygame.K_d: # d moves player right
-                    local_control_state.mv_r = False
-                elif event.key == pygame.K_s: # s is players's attack
-                    local_control_state.atk = False
-
-        # remote_socket.send(encode_control_message(frame_number, local_control_state))
-        #print("sent packet")
-
-        with lock:
-            #remote_socket.send(encode_control_message(frame_number, local_control_state))
-            sent = sender.send(frame_number, encode_control_message(frame_number,local_control_state))
-
-            if sent:
-                if len(rollback_list) > frame_number:
-                    rollback_list[frame_number]["local_input"] = local_control_state.make_list()
-                elif len(rollback_list) == frame_number:
-                    rollback_list.append({
-                            "local_input":local_control_state.make_list(),
-                            "remote_input": copy.deepcopy(rollback_list[-1]["remote_input"])
-                    })
-                else:
-                    # Error - somehow skipped a frame locally???
-                    #
-                    print("Error - desync?")
-
-        with lock:
-            game_logic.render_frame(game_logic.GameState(game_state_list=rollback_list[frame_number-1]["game_state_list"]), window)
-
-        if player_number == 1:
-            # Use the previous game states and the current inputs to calc new game state
-            with lock:
-                game_state = game_logic.update_state(
-                        game_logic.GameState(game_state_list=rollback_list[frame_number-1]["game_state_list"]),
-                        game_logic.ControlState(control_state_list=rollback_list[frame_number]["local_input"]),
-                        game_logic.ControlState(control_state_list=rollback_list[frame_number]["remote_input"])
-                                                )
-            #game_state = game_logic.update_state(game_state, local_control_state, remote_control_state)
-        elif player_number == 2:
-            #game_state = game_logic.update_state(game_state, remote_control_state, local_control_state)
-            with lock:
-                game_state = game_logic.update_state(
-                        game_logic.GameState(game_state_list=rollback_list[frame_number-1]["game_state_list"]),
-                        game_logic.ControlState(control_state_list=rollback_list[frame_number]["remote_input"]),
-                        game_logic.ControlState(control_state_list=rollback_list[frame_number]["local_input"])
-                                                )
-            
-
-        with lock:
-            rollback_list[frame_number]["game_state_list"] = game_state.make_list()
-            #print(rollback_list[frame_number])
-
-
-        with lock:
-            frame_number += 1
-
-        clock.tick(30) # Lock the game at 30fps, all timings are based on framerate, so this controls run speed
-    
-    # Quit Pygame
-    pygame.quit()
+    # Shared between the simulation thread and the render loop on this thread
+    local_input = input_source if input_source is not None else render_loop.InputLatch() # Game starts with no controls pressed
+    snapshots = render_loop.SnapshotBuffer()
+    stop = threading.Event()
+    start_time = time.perf_counter()
+
+    if headless:
+        # Nothing to draw, just simulate here
+        simulation_loop(local_input, snapshots, stop, max_frames, tick_rate)
+    else:
+        simulation = threading.Thread(target=simulation_loop, args=(local_input, snapshots, stop, max_frames, tick_rate), name="simulation", daemon=True)
+        simulation.start()
+
+        # Draw and read the keyboard until the window closes
+        render_loop.run_render_loop(window, local_input, snapshots, stop)
+        simulation.join()
+
+    seconds = time.perf_counter() - start_time
+
+    if reached_frame_limit(max_frames):
+        if not finish_match(max_frames):
+            print(f"Remote inputs not confirmed up to frame {max_frames}")
+
+    # The simulation thread has finished, so this thread owns the history now
+    end_match(seconds, stats_path)
+
+    if not headless:
+        render_loop.close_window()
 
     # Finished successfully
     return 0
-
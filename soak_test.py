@@ -0,0 +1,310 @@
+# Aleksander Nowicki and Samuel Young
+# Dartmouth CS60 25F Final Project
+# 11/21/2025
+# Soak Test Program
+#
+# Load tests the netcode by playing bot matches between two headless driver.py processes over
+# loopback, optionally through the network emulator, for as many matches or hours as asked.
+# Each player is driven by a random bot (see input_source) with its own seed, so every match plays
+# differently but can be repeated exactly by passing the same --seed.
+#
+# For every match it reports throughput (frames/s), rollback depths, stalled frames, how much each
+# process's memory grew while it played, and whether both players finished on the same state.
+# Memory is read from /proc, so the growth numbers are only available on Linux.
+#
+# Usage: python3 soak_test.py [--mode rollback|delay] [--transport udp|tcp] [--frames <frames per match>]
+#                             [--tick-rate <fps, 0 for uncapped>] [--impair <settings>] [--matches <count>]
+#                             [--hours <hours>] [--seed <seed>] [--port <port>] [--output <summary.json>]
+#                             [--runtime threads|asyncio] [--input-delay <frames|auto|min-max>] [--timeout <seconds>]
+#
+# A match counts as hung once it runs MATCH_TIMEOUT_MARGIN seconds past how long it should take, worked
+# out from the tick rate, the emulated round trip and the input delay (see expected_frame_seconds),
+# or after --timeout seconds if given.
+#
+# Exits with status 1 if any match crashed, timed out, desynced or finished on different states.
+
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import subprocess
+import network_emulator
+import rollback_history
+
+DRIVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "driver.py")
+
+# Seconds between memory samples, and seconds into a match before the first sample counts as the
+# starting size (leaving time for imports and the first allocations)
+SAMPLE_INTERVAL = 1
+WARMUP_SECONDS = 2
+
+# Seconds allowed on top of how long a match should take before it counts as hung
+MATCH_TIMEOUT_MARGIN = 30
+
+# Frames per second assumed when working out the timeout of an uncapped match (slowest expected)
+MIN_UNCAPPED_FRAME_RATE = 200
+
+# Frames a rollback player can run ahead of the remote's confirmed inputs, one history window
+ROLLBACK_FRAMES_AHEAD = rollback_history.DEFAULT_CAPACITY
+
+# Seconds to wait for the server to start listening
+SERVER_START_TIMEOUT = 10
+
+OPTION_DEFAULTS = {
+    "--mode": "rollback",
+    "--transport": "udp",
+    "--frames": "9000",
+    "--tick-rate": "0",
+    "--impair": None,
+    "--matches": "1",
+    "--hours": None,
+    "--seed": "0",
+    "--port": "47000",
+    "--output": None,
+    "--runtime": "threads",
+    "--input-delay": None,
+    "--timeout": None,
+}
+
+USAGE = ("Usage: python3 soak_test.py [--mode rollback|delay] [--transport udp|tcp] [--frames <frames per match>]\n"
+         + "  [--tick-rate <fps, 0 for uncapped>] [--impair <settings>] [--matches <count>] [--hours <hours>]\n"
+         + "  [--seed <seed>] [--port <port>] [--output <summary.json>] [--runtime threads|asyncio]\n"
+         + "  [--input-delay <frames|auto|min-max>] [--timeout <seconds per match>]")
+
+# Resident memory of a process in kB, None if it can't be read (not Linux, or process gone)
+def resident_memory(pid):
+    try:
+        with open(f"/proc/{pid}/status") as status_file:
+            for line in status_file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+# Memory samples of one player process
+class MemoryTracker:
+    def __init__(self, pid):
+        self.pid = pid
+        self.start_kb = None # First sample after the warmup
+        self.last_kb = None
+        self.peak_kb = None
+
+    def sample(self, elapsed):
+        kb = resident_memory(self.pid)
+        if kb is None:
+            return
+        self.last_kb = kb
+        self.peak_kb = kb if self.peak_kb is None else max(self.peak_kb, kb)
+        if self.start_kb is None and elapsed >= WARMUP_SECONDS:
+            self.start_kb = kb
+
+    # kB grown from the first sample after warmup to the last, None if the match was too short to tell
+    def growth(self):
+        if self.start_kb is None or self.last_kb is None:
+            return None
+        return self.last_kb - self.start_kb
+
+# Wait until nothing is listening on port (the server only listens until its client connects)
+def port_is_free(port):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as test_socket:
+        try:
+            test_socket.bind(("", port))
+        except OSError:
+            return False
+    return True
+
+# Play one match, returns a dict describing how it went
+# Slowest expected seconds per frame of a match: the tick rate (MIN_UNCAPPED_FRAME_RATE uncapped), unless the
+# emulated network is slower. Every round trip, delay mode plays the frames its input delay covers plus one and
+# rollback a history window. A range or auto input delay counts as its least (just a longer timeout)
+def expected_frame_seconds(options):
+    tick_rate = int(options["--tick-rate"])
+    frame_seconds = 1 / (tick_rate if tick_rate else MIN_UNCAPPED_FRAME_RATE)
+    if options["--impair"] is None:
+        return frame_seconds
+
+    # Both players impair what they send with the same settings, and over TCP a loss waits for a retransmission
+    settings = network_emulator.parse_impairment(options["--impair"])
+    one_way_seconds = (settings.delay + settings.jitter) / 1000
+    if options["--transport"].upper() == "TCP":
+        one_way_seconds += settings.loss * max(network_emulator.MIN_RETRANSMIT_DELAY, 2 * settings.delay / 1000)
+
+    if options["--mode"] == "delay":
+        low = (options["--input-delay"] or "0").partition("-")[0]
+        frames_per_round_trip = (int(low) if low.isdigit() else 0) + 1
+    else:
+        frames_per_round_trip = ROLLBACK_FRAMES_AHEAD
+    return max(frame_seconds, 2 * one_way_seconds / frames_per_round_trip)
+
+def run_match(match_number, options, work_directory):
+    port = int(options["--port"]) + match_number % 1000
+    seed = int(options["--seed"]) + match_number * 2
+    frames = int(options["--frames"])
+    tick_rate = int(options["--tick-rate"])
+
+    common_arguments = ["--headless", "--frames", str(frames), "--tick-rate", str(tick_rate), "--runtime", options["--runtime"]]
+    if options["--input-delay"] is not None:
+        common_arguments += ["--input-delay", options["--input-delay"]]
+    if options["--impair"] is not None:
+        common_arguments += ["--impair", options["--impair"]]
+
+    stats_paths = [os.path.join(work_directory, f"match{match_number}_player{player}.json") for player in (1, 2)]
+    log_paths = [os.path.join(work_directory, f"match{match_number}_player{player}.log") for player in (1, 2)]
+    for stats_path in stats_paths:
+        if os.path.exists(stats_path):
+            os.remove(stats_path)
+
+    server_command = [sys.executable, DRIVER_PATH, str(port), "--mode", options["--mode"], "--transport", options["--transport"],
+                      "--input", f"random:{seed}", "--stats-out", stats_paths[0]] + common_arguments
+    client_command = [sys.executable, DRIVER_PATH, "127.0.0.1", str(port),
+                      "--input", f"random:{seed + 1}", "--stats-out", stats_paths[1]] + common_arguments
+
+    if options["--timeout"] is not None:
+        timeout = float(options["--timeout"])
+    else:
+        timeout = frames * expected_frame_seconds(options) + MATCH_TIMEOUT_MARGIN
+
+    result = {"match": match_number, "seed": seed, "problems": []}
+
+    while not port_is_free(port):
+        time.sleep(0.1)
+
+    log_files = [open(log_path, "w") for log_path in log_paths]
+    server = subprocess.Popen(server_command, stdout=log_files[0], stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
+
+    # Wait for the server to listen by watching its log rather than connecting to it (it would take us as its client)
+    deadline = time.perf_counter() + SERVER_START_TIMEOUT
+    while time.perf_counter() < deadline and server.poll() is None:
+        with open(log_paths[0]) as server_log:
+            if "Waiting for client" in server_log.read():
+                break
+        time.sleep(0.05)
+
+    client = subprocess.Popen(client_command, stdout=log_files[1], stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL)
+    processes = [server, client]
+    trackers = [MemoryTracker(server.pid), MemoryTracker(client.pid)]
+
+    start_time = time.perf_counter()
+    while any(process.poll() is None for process in processes):
+        elapsed = time.perf_counter() - start_time
+        if elapsed > timeout:
+            result["problems"].append(f"timed out after {elapsed:.0f}s")
+            for process in processes:
+                process.kill()
+            break
+        for tracker in trackers:
+            tracker.sample(elapsed)
+        time.sleep(min(SAMPLE_INTERVAL, max(0.05, elapsed / 10)))
+
+    for process in processes:
+        process.wait()
+    for log_file in log_files:
+        log_file.close()
+
+    result["seconds"] = time.perf_counter() - start_time
+    result["memory_growth_kb"] = [tracker.growth() for tracker in trackers]
+    result["peak_memory_kb"] = [tracker.peak_kb for tracker in trackers]
+
+    player_stats = []
+    for player, process in enumerate(processes, 1):
+        if process.returncode != 0:
+            result["problems"].append(f"player {player} exited with status {process.returncode}")
+        with open(log_paths[player - 1]) as player_log:
+            if "Traceback" in player_log.read():
+                result["problems"].append(f"player {player} raised an exception")
+        try:
+            with open(stats_paths[player - 1]) as stats_file:
+                player_stats.append(json.load(stats_file))
+        except (OSError, ValueError):
+            result["problems"].append(f"player {player} wrote no stats")
+    result["players"] = player_stats
+
+    if len(player_stats) == 2:
+        for player, stats in enumerate(player_stats, 1):
+            if stats["mismatches"]:
+                result["problems"].append(f"player {player} detected a desync at frame {stats['first_desync_frame']}")
+            if stats["final_frame"] != frames:
+                result["problems"].append(f"player {player} only confirmed up to frame {stats['final_frame']}")
+        if (player_stats[0]["final_frame"], player_stats[0]["final_checksum"]) != (player_stats[1]["final_frame"], player_stats[1]["final_checksum"]):
+            result["problems"].append("players finished on different states")
+
+    return result
+
+# Rollback depth counts grouped into power of two buckets, "1", "2-3", "4-7", ...
+def depth_buckets(depth_counts):
+    buckets = {}
+    for depth, count in depth_counts.items():
+        low = 1
+        while low * 2 <= depth:
+            low *= 2
+        name = str(low) if low == 1 else f"{low}-{low * 2 - 1}"
+        buckets[(low, name)] = buckets.get((low, name), 0) + count
+    return {name: count for (low, name), count in sorted(buckets.items())}
+
+# One line summary of a match
+def describe_match(result):
+    status = "OK" if not result["problems"] else "FAILED (" + "; ".join(result["problems"]) + ")"
+    line = f"match {result['match']} (seed {result['seed']}): {status}"
+    if len(result["players"]) == 2:
+        first, second = result["players"]
+        line += f", {first['frames']} frames at {min(first['frames_per_sec'], second['frames_per_sec']):.0f} frames/s"
+        if "rollbacks" in first:
+            line += f", rollbacks {first['rollbacks']}/{second['rollbacks']} (max depth {max(first['max_rollback_depth'], second['max_rollback_depth'])})"
+        line += f", stalled frames {first['stalled_frames']}/{second['stalled_frames']}"
+    growth = ["?" if kb is None else f"{kb:+d}kB" for kb in result["memory_growth_kb"]]
+    line += f", memory growth {growth[0]}/{growth[1]}"
+    return line
+
+
+if __name__ == "__main__":
+    options = dict(OPTION_DEFAULTS)
+    arguments = sys.argv[1:]
+    while arguments:
+        if arguments[0] not in options or len(arguments) < 2:
+            print(USAGE)
+            sys.exit(1)
+        options[arguments[0]] = arguments[1]
+        arguments = arguments[2:]
+
+    matches = int(options["--matches"])
+    end_time = time.perf_counter() + float(options["--hours"]) * 3600 if options["--hours"] is not None else None
+
+    results = []
+    depth_counts = {}
+    start_time = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="soak_") as work_directory:
+        match_number = 0
+        while (match_number < matches) if end_time is None else (time.perf_counter() < end_time):
+            result = run_match(match_number, options, work_directory)
+            print(describe_match(result))
+            if result["problems"]:
+                # Logs are deleted with the work directory, show the end of them now
+                for player in (1, 2):
+                    log_path = os.path.join(work_directory, f"match{match_number}_player{player}.log")
+                    with open(log_path) as player_log:
+                        print(f"--- player {player} log (last lines)")
+                        print("".join(player_log.readlines()[-10:]), end="")
+            for stats in result["players"]:
+                for depth, count in stats.get("rollback_depths", {}).items():
+                    depth_counts[int(depth)] = depth_counts.get(int(depth), 0) + count
+            results.append(result)
+            match_number += 1
+
+    failed = [result for result in results if result["problems"]]
+    total_frames = sum(result["players"][0]["frames"] for result in results if result["players"])
+    growths = [kb for result in results for kb in result["memory_growth_kb"] if kb is not None]
+
+    print(f"{len(results)} matches, {len(failed)} failed, {total_frames} frames in {time.perf_counter() - start_time:.1f}s")
+    if depth_counts:
+        print("Rollback depths: " + ", ".join(f"{name}: {count}" for name, count in depth_buckets(depth_counts).items()))
+    if growths:
+        print(f"Memory growth per player per match: max {max(growths):+d}kB, mean {sum(growths) / len(growths):+.0f}kB")
+
+    if options["--output"]:
+        with open(options["--output"], "w") as output_file:
+            json.dump({"options": options, "rollback_depths": depth_counts, "matches": results}, output_file, indent=2)
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,190 @@
+# Aleksander Nowicki and Samuel Young
+# Dartmouth CS60 25F Final Project
+# 11/21/2025
+# Telemetry Module
+#
+# Counters, gauges and histograms the netcode updates while it plays, in place of debug prints.
+# Every metric is created up front (see METRICS), so updating one on the hot path is a dict lookup
+# and an addition, and a histogram observation is one bisect into fixed bucket bounds and an increment
+# of a preallocated array slot. Nothing is formatted or written by the thread playing the game.
+#
+# Metrics can be exported while the game runs, both optional:
+#   JsonLinesExporter  - appends a JSON snapshot of every metric to a file every interval seconds
+#   PrometheusExporter - serves every metric in the Prometheus text format at http://localhost:<port>/metrics
+#
+# The module keeps one set of metrics, the game's (this process only ever plays one match).
+
+import json
+import time
+import bisect
+import threading
+from array import array
+
+# Bucket upper bounds for histograms of durations in seconds, and of frame counts
+SECONDS_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+FRAME_BOUNDS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+# Seconds between JSON lines snapshots
+DEFAULT_INTERVAL = 1.0
+
+# Every metric with its kind, help text and (for histograms) bucket bounds
+METRICS = {
+    "frames": ("counter", "Frames simulated"),
+    "stalled_frames": ("counter", "Frames that waited on the remote player"),
+    "rollbacks": ("counter", "Resimulations after mispredicted remote inputs, at most one per tick"),
+    "mispredicted_inputs": ("counter", "Remote inputs that differed from their prediction"),
+    "rollback_depth_frames": ("histogram", "Frames resimulated by each rollback", FRAME_BOUNDS),
+    "resimulation_seconds": ("histogram", "Wall time of each rollback resimulation", SECONDS_BOUNDS),
+    "on_time_inputs": ("counter", "Remote inputs received for the frame being played"),
+    "late_inputs": ("counter", "Remote inputs received after their frame was predicted"),
+    "early_inputs": ("counter", "Remote inputs received before their frame was reached"),
+    "refused_inputs": ("counter", "Late remote inputs too old to roll back to"),
+    "message_queue_seconds": ("histogram", "Time received messages waited for the simulation thread", SECONDS_BOUNDS),
+    "remote_wait_seconds": ("histogram", "Time a frame waited for the remote player's inputs (delay mode)", SECONDS_BOUNDS),
+    "tick_seconds": ("histogram", "Wall time of each simulation tick's work", SECONDS_BOUNDS),
+    "tick_overruns": ("counter", "Ticks whose work took longer than a frame"),
+    "rtt_seconds": ("gauge", "Smoothed round trip time"),
+    "rtt_deviation_seconds": ("gauge", "Smoothed round trip time deviation (jitter)"),
+    "frame_advantage": ("gauge", "Frames we are ahead of the remote player"),
+    "input_delay_frames": ("gauge", "Local input delay in use"),
+    "connect_seconds": ("gauge", "Seconds from starting until connected to the remote player"),
+    "first_frame_seconds": ("gauge", "Seconds from starting until the first frame was ready to show"),
+}
+
+# When this module was first imported, close enough to when the program started for startup times
+start_time = time.perf_counter()
+
+# Counts of values at or below each bound, plus one slot for values above every bound
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = array("Q", [0]) * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    # Dictionary of the histogram for JSON
+    def snapshot(self):
+        return {"buckets": dict(zip([str(bound) for bound in self.bounds] + ["+Inf"], self.counts)),
+                "count": self.count, "sum": self.total}
+
+class Metrics:
+    def __init__(self, definitions=METRICS):
+        self.definitions = definitions
+        self.values = {} # Counter and gauge values by name
+        self.histograms = {} # Histograms by name
+        for name, definition in definitions.items():
+            if definition[0] == "histogram":
+                self.histograms[name] = Histogram(definition[2])
+            else:
+                self.values[name] = 0
+
+    # Add to a counter
+    def increment(self, name, amount=1):
+        self.values[name] += amount
+
+    # Set a gauge
+    def set(self, name, value):
+        self.values[name] = value
+
+    # Add a value to a histogram
+    def observe(self, name, value):
+        self.histograms[name].observe(value)
+
+    # Dictionary of every metric for JSON
+    def snapshot(self):
+        snapshot = dict(self.values)
+        for name, histogram in self.histograms.items():
+            snapshot[name] = histogram.snapshot()
+        return snapshot
+
+    # Every metric in the Prometheus text format
+    def prometheus_text(self):
+        lines = []
+        for name, definition in self.definitions.items():
+            kind, help_text = definition[0], definition[1]
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind != "histogram":
+                lines.append(f"{name} {self.values[name]}")
+                continue
+
+            histogram = self.histograms[name]
+            cumulative = 0
+            for bound, count in zip(list(histogram.bounds) + ["+Inf"], histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f"{name}_sum {histogram.total}")
+            lines.append(f"{name}_count {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+# The game's metrics
+metrics = Metrics()
+
+# Record the time from starting to being connected to the remote player, returns it in seconds
+def record_connected(now):
+    metrics.set("connect_seconds", now - start_time)
+    return now - start_time
+
+# Record the time from starting to the first frame being ready to show
+def record_first_frame(now):
+    metrics.set("first_frame_seconds", now - start_time)
+
+# Appends a snapshot of the metrics to a JSON lines file every interval seconds, and a last one when closed
+class JsonLinesExporter:
+    def __init__(self, path, interval=DEFAULT_INTERVAL, source=metrics):
+        self.file = open(path, "a")
+        self.interval = interval
+        self.source = source
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write_snapshot(self):
+        snapshot = self.source.snapshot()
+        snapshot["time"] = time.time()
+        self.file.write(json.dumps(snapshot) + "\n")
+        self.file.flush()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write_snapshot()
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self.write_snapshot()
+        self.file.close()
+
+# Serves the metrics to Prometheus (or curl) at http://localhost:<port>/metrics
+class PrometheusExporter:
+    def __init__(self, port, source=metrics):
+        import http.server # Slow to import, and only needed when serving metrics
+        source_metrics = source
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = source_metrics.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass # Don't print every scrape
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,185 @@
+# Aleksander Nowicki and Samuel Young
+# Dartmouth CS60 25F Final Project
+# 11/21/2025
+# Time Sync Module
+#
+# Keeps the two players' frame counters running together. Each player estimates its frame
+# advantage, how many frames it is ahead of where the remote player is right now:
+#
+#   local advantage = local frame - (newest remote frame received + frames the remote has advanced since sending it)
+#
+# where the second term comes from half the measured round trip time. Players send their own
+# estimate along with their inputs, and each one steers by half the difference of the two, which
+# cancels out any error shared by both estimates (such as an uneven route). A player that is ahead
+# runs its frames a little slower than 30fps and one that is behind a little faster, and a player
+# far ahead also sits out whole frames, so both converge to around zero advantage. This keeps
+# rollbacks short and stops one machine drifting seconds ahead of the other.
+#
+# With local input delay (see InputDelayController) each player sends its inputs a few frames ahead
+# of the frame it is simulating, and the frame numbers compared here are those of the newest inputs
+# sent, so players using the same delay line up on the same simulated frame.
+
+import time
+from array import array
+
+# Normal game speed, all timings are based on this
+FRAME_RATE = 30
+
+# Frame rate change per frame of advantage, and the most it may change by (fraction of FRAME_RATE)
+ADJUST_PER_FRAME = 0.02
+MAX_ADJUST = 0.1
+
+# Advantage (frames) below which no adjustment is made, and above which whole frames are skipped
+DEAD_ZONE = 1
+WAIT_THRESHOLD = 6
+
+# Weight of each new round trip time sample in the running average, and in the running average of
+# how far samples are from it (the jitter)
+RTT_SMOOTHING = 0.125
+RTT_DEVIATION_SMOOTHING = 0.25
+
+# Most local input delay frames chosen automatically
+MAX_INPUT_DELAY = 3
+
+# Round trip time deviations added to the one way delay when choosing the input delay, covering most jitter
+JITTER_MARGIN = 2
+
+# Frames the input delay must be off target before it is moved one frame towards it, so it doesn't flap
+DELAY_ADJUST_FRAMES = 30
+
+# Number of recent send times remembered for round trip measurements
+SEND_TIME_SLOTS = 256
+
+class TimeSync:
+    def __init__(self, frame_rate=FRAME_RATE):
+        self.frame_rate = frame_rate
+
+        # Time each recent local frame was sent, indexed by frame modulo SEND_TIME_SLOTS
+        self.send_times = array("d", [0.0]) * SEND_TIME_SLOTS
+        self.newest_sent_frame = 0
+        self.newest_ack = 0
+
+        self.rtt = None # Smoothed round trip time in seconds, None until measured
+        self.rtt_deviation = 0.0 # Smoothed distance of samples from rtt in seconds (jitter)
+
+        self.remote_frame = 0 # Newest frame the remote has sent inputs for
+        self.remote_frame_time = 0.0 # When that frame's message arrived
+        self.remote_advantage = 0 # Remote's own estimate of its advantage
+
+    # Readable string summary of the sync state
+    def __str__(self):
+        rtt_ms = "unknown" if self.rtt is None else f"{self.rtt * 1000:.1f}ms (+/- {self.rtt_deviation * 1000:.1f}ms)"
+        return ("rtt: " + rtt_ms + "\n"
+              + "remote frame: " + str(self.remote_frame) + "\n"
+              + "remote advantage: " + str(self.remote_advantage))
+
+    # Note the time a local frame's inputs were sent
+    def on_send(self, frame, now):
+        self.send_times[frame % SEND_TIME_SLOTS] = now
+        self.newest_sent_frame = frame
+
+    # An ack for a frame we sent arrived, take a round trip time sample the first time each frame is acked
+    def on_ack(self, ack_frame, now):
+        if ack_frame <= self.newest_ack or ack_frame > self.newest_sent_frame or self.newest_sent_frame - ack_frame >= SEND_TIME_SLOTS:
+            return
+        self.newest_ack = ack_frame
+
+        sample = now - self.send_times[ack_frame % SEND_TIME_SLOTS]
+        if self.rtt is None:
+            self.rtt = sample
+            self.rtt_deviation = sample / 2
+        else:
+            self.rtt_deviation += RTT_DEVIATION_SMOOTHING * (abs(sample - self.rtt) - self.rtt_deviation)
+            self.rtt += RTT_SMOOTHING * (sample - self.rtt)
+
+    # A message with the remote's newest frame and its own advantage estimate arrived
+    def on_remote_frame(self, remote_frame, remote_advantage, now):
+        if remote_frame >= self.remote_frame:
+            self.remote_frame = remote_frame
+            self.remote_frame_time = now
+            self.remote_advantage = remote_advantage
+
+    # Estimate of how many frames we are ahead of the remote right now
+    def local_advantage(self, local_frame, now):
+        if self.remote_frame_time == 0.0:
+            return 0 # Nothing heard from the remote yet
+        one_way_delay = (self.rtt or 0.0) / 2
+        remote_frame_now = self.remote_frame + (one_way_delay + now - self.remote_frame_time) * self.frame_rate
+        return local_frame - remote_frame_now
+
+    # Local advantage rounded to fit in a signed byte for sending
+    def encoded_advantage(self, local_frame, now):
+        return max(-128, min(127, round(self.local_advantage(local_frame, now))))
+
+    # Frames we should give up to meet the remote halfway, negative if we should catch up
+    def advantage_difference(self, local_frame, now):
+        return (self.local_advantage(local_frame, now) - self.remote_advantage) / 2
+
+    # Frame rate to run the next frame at
+    def target_frame_rate(self, local_frame, now):
+        difference = self.advantage_difference(local_frame, now)
+        if abs(difference) <= DEAD_ZONE:
+            return self.frame_rate
+
+        adjust = min(MAX_ADJUST, (abs(difference) - DEAD_ZONE) * ADJUST_PER_FRAME)
+        if difference > 0:
+            return self.frame_rate * (1 - adjust) # Ahead, slow down
+        return self.frame_rate * (1 + adjust) # Behind, speed up
+
+    # True if we are so far ahead we should sit out this frame entirely
+    def should_wait(self, local_frame, now):
+        return self.advantage_difference(local_frame, now) > WAIT_THRESHOLD
+
+# Chooses how many frames ahead local inputs are sent (local input delay), between min_delay and max_delay
+# Each frame of delay gives the remote's copy of an input one more frame to arrive before it is needed,
+# so the delay covers the one way trip plus jitter, up to max_delay, and rollback covers the rest
+# With min_delay equal to max_delay the delay is fixed
+class InputDelayController:
+    def __init__(self, min_delay=0, max_delay=MAX_INPUT_DELAY, frame_rate=FRAME_RATE):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.frame_rate = frame_rate
+        self.delay = min_delay
+        self.frames_off_target = 0 # Frames in a row the target has differed from delay
+
+    # Readable string summary of the delay
+    def __str__(self):
+        limits = "fixed" if self.min_delay == self.max_delay else f"{self.min_delay}-{self.max_delay}"
+        return "input delay: " + str(self.delay) + " frames (" + limits + ")"
+
+    # Delay that would cover the one way trip plus jitter, None until the round trip time is measured
+    def target_delay(self, rtt, rtt_deviation):
+        if rtt is None or not self.frame_rate:
+            return None
+        frames = round((rtt / 2 + JITTER_MARGIN * rtt_deviation) * self.frame_rate)
+        return max(self.min_delay, min(self.max_delay, frames))
+
+    # Call once per frame with the newest measurements, returns the delay to use for this frame
+    def update(self, rtt, rtt_deviation):
+        target = self.target_delay(rtt, rtt_deviation)
+        if target is None or target == self.delay:
+            self.frames_off_target = 0
+            return self.delay
+
+        self.frames_off_target += 1
+        if self.frames_off_target >= DELAY_ADJUST_FRAMES:
+            self.delay += 1 if target > self.delay else -1
+            self.frames_off_target = 0
+        return self.delay
+
+# Paces a loop to a frame rate like pygame.time.Clock, without needing pygame (headless players never load it)
+class FrameClock:
+    def __init__(self):
+        self.last_tick = time.perf_counter()
+
+    # Sleep until 1/frame_rate seconds after the last tick (not at all for a frame rate of 0)
+    # Returns the seconds since the last tick
+    def tick(self, frame_rate=0):
+        if frame_rate:
+            delay = 1 / frame_rate - (time.perf_counter() - self.last_tick)
+            if delay > 0:
+                time.sleep(delay)
+        now = time.perf_counter()
+        elapsed = now - self.last_tick
+        self.last_tick = now
+        return elapsed
@@ -0,0 +1,101 @@
+# Aleksander Nowicki and Samuel Young
+# Dartmouth CS60 25F Final Project
+# 11/21/2025
+# Tracing Module
+#
+# Opt-in per frame profiling. Code marks each phase of a tick with
+#   with tracing.span("simulate", frame_number):
+# and while tracing is on, every span's start and end are timestamped with perf_counter_ns along with
+# the thread it ran on. stop_tracing writes them out as Chrome trace event JSON, which Perfetto
+# (https://ui.perfetto.dev) or chrome://tracing show as a timeline per thread, so it is easy to see
+# where a frame's 33ms went when a player falls behind.
+#
+# With tracing off (the default) span returns one shared do-nothing span, so a traced phase only costs
+# a function call and an empty with block.
+
+import json
+import time
+import threading
+import collections
+
+# Most spans kept, the oldest are dropped past this so long matches don't use unbounded memory
+MAX_EVENTS = 1_000_000
+
+# Records finished spans
+class Tracer:
+    def __init__(self, max_events=MAX_EVENTS):
+        self.start_ns = time.perf_counter_ns()
+        # (name, thread id, start ns, end ns, frame), deque appends are atomic so every thread can record
+        self.events = collections.deque(maxlen=max_events)
+        self.thread_names = {} # Thread id: name, for every thread that recorded a span
+
+    def record(self, name, start_ns, end_ns, frame):
+        thread_id = threading.get_ident()
+        if thread_id not in self.thread_names:
+            self.thread_names[thread_id] = threading.current_thread().name
+        self.events.append((name, thread_id, start_ns, end_ns, frame))
+
+    # Dictionary of the recorded spans in the Chrome trace event format (times in microseconds)
+    def trace(self):
+        trace_events = [{"name": "thread_name", "ph": "M", "pid": 1, "tid": thread_id, "args": {"name": thread_name}}
+                        for thread_id, thread_name in self.thread_names.items()]
+        for name, thread_id, start_ns, end_ns, frame in list(self.events):
+            event = {"name": name, "ph": "X", "pid": 1, "tid": thread_id,
+                     "ts": (start_ns - self.start_ns) / 1000, "dur": (end_ns - start_ns) / 1000}
+            if frame is not None:
+                event["args"] = {"frame": frame}
+            trace_events.append(event)
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+# One timed phase, records itself to the tracer when its with block ends
+class Span:
+    __slots__ = ("tracer", "name", "frame", "start_ns")
+
+    def __init__(self, tracer, name, frame):
+        self.tracer = tracer
+        self.name = name
+        self.frame = frame
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer.record(self.name, self.start_ns, time.perf_counter_ns(), self.frame)
+        return False
+
+# Span used while tracing is off
+class NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+NULL_SPAN = NullSpan()
+
+# Recording tracer, None while tracing is off
+tracer = None
+
+# Span timing a phase named name, frame is the frame number it belongs to (None if none)
+def span(name, frame=None):
+    if tracer is None:
+        return NULL_SPAN
+    return Span(tracer, name, frame)
+
+# Start recording spans
+def start_tracing(max_events=MAX_EVENTS):
+    global tracer
+    tracer = Tracer(max_events)
+
+# Stop recording spans and write every recorded one to path as Chrome trace event JSON
+def stop_tracing(path):
+    global tracer
+    stopped_tracer = tracer
+    tracer = None
+    if stopped_tracer is None:
+        return
+    with open(path, "w") as trace_file:
+        json.dump(stopped_tracer.trace(), trace_file)
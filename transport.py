@@ -0,0 +1,112 @@
+# Aleksander Nowicki and Samuel Young
+# Dartmouth CS60 25F Final Project
+# 11/21/2025
+# Transport Module
+#
+# Transports used by the netcode modules to exchange game messages with the remote player.
+# Each transport has the same three methods, so the netcode doesn't care which one it was given:
+#   send(data)          - send bytes holding one or more whole wire_protocol messages
+#   recv(timeout=None)  - bytes received, b"" if the connection closed, None if nothing arrived before
+#                         timeout seconds (None blocks, 0 just polls)
+#   close()
+#
+# TCP delivers everything in order, but one dropped segment holds up every input behind it until it
+# is retransmitted. UDP delivers each message on its own as soon as it arrives, and rollback_netcode
+# already repeats unacknowledged inputs in every message, so a lost datagram costs nothing extra.
+#
+# The game is always negotiated over a TCP connection. The server sends "<mode> <transport>\n"
+# in place of the old bare mode string, and for UDP the client answers with "<udp port>\n" so each
+# side knows where to send datagrams. The server's UDP socket uses the same port number as its TCP one.
+# A relay server (see relay_server) adds the player number the client plays as, "<mode> <transport> <player>\n",
+# a client of a normal server is always player 2.
+
+import socket
+import select
+
+# Transport options
+TCP = "TCP"
+UDP = "UDP"
+
+# Largest datagram we expect, a wire_protocol message is never more than a few hundred bytes
+MAX_DATAGRAM_SIZE = 2048
+
+class TcpTransport:
+    def __init__(self, tcp_socket):
+        self.socket = tcp_socket
+        self.kind = TCP
+        # Game messages are tiny and time critical, don't let Nagle hold them back
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def send(self, data):
+        self.socket.sendall(data)
+
+    def recv(self, timeout=None):
+        if timeout is not None and not select.select([self.socket], [], [], timeout)[0]:
+            return None
+        return self.socket.recv(4096)
+
+    def close(self):
+        self.socket.close()
+
+class UdpTransport:
+    def __init__(self, udp_socket):
+        self.socket = udp_socket # Must already be connected to the remote player's address
+        self.kind = UDP
+
+    def send(self, data):
+        try:
+            self.socket.send(data)
+        except ConnectionRefusedError:
+            pass # Remote not listening (yet), the message is lost like any other datagram
+
+    def recv(self, timeout=None):
+        if timeout is not None and not select.select([self.socket], [], [], timeout)[0]:
+            return None
+        try:
+            return self.socket.recv(MAX_DATAGRAM_SIZE)
+        except ConnectionRefusedError:
+            return b"" # Remote socket has closed
+
+    def close(self):
+        self.socket.close()
+
+# Read one newline terminated line from the control socket, a byte at a time so nothing after it is consumed
+def receive_line(control_socket):
+    line = b""
+    while not line.endswith(b"\n"):
+        byte = control_socket.recv(1)
+        if not byte:
+            raise ConnectionError("Connection closed during handshake")
+        line += byte
+    return line.decode().strip()
+
+# Server side of the handshake, tells the client the mode and transport and returns the transport to play over
+def server_handshake(control_socket, mode, kind, port):
+    if kind == UDP:
+        # Bind before telling the client, so its first datagram has somewhere to go
+        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp_socket.bind(('', port))
+
+    control_socket.send(f"{mode} {kind}\n".encode())
+
+    if kind == UDP:
+        client_udp_port = int(receive_line(control_socket))
+        udp_socket.connect((control_socket.getpeername()[0], client_udp_port))
+        return UdpTransport(udp_socket)
+    return TcpTransport(control_socket)
+
+# Client side of the handshake, returns the mode chosen by the server, the player number to play as
+# and the transport to play over
+def client_handshake(control_socket, ip_address, port):
+    handshake = receive_line(control_socket).split()
+    mode = handshake[0]
+    kind = handshake[1] if len(handshake) > 1 else TCP
+    player_number = int(handshake[2]) if len(handshake) > 2 else 2
+
+    if kind == UDP:
+        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp_socket.bind(('', 0))
+        udp_socket.connect((ip_address, port))
+        control_socket.send(f"{udp_socket.getsockname()[1]}\n".encode())
+        return mode, player_number, UdpTransport(udp_socket)
+    return mode, player_number, TcpTransport(control_socket)
@@ -0,0 +1,145 @@
+# Aleksander Nowicki and Samuel Young
+# Dartmouth CS60 25F Final Project
+# 11/21/2025
+# Archive Verification Program
+#
+# Re-verifies a whole archive of recorded matches (see replay) across every core, e.g. after a change
+# to the game logic. Replay files are found by their header, so directories can be given as well as
+# files, and are handed out to a pool of worker processes in chunks. Only paths go to the workers: each
+# one streams its replays' records from disk with replay.verify_replay and checks every recorded checksum
+# as it is read, so no replay is ever held in memory whole. The results are collected into one report:
+# which replays desynced (and where), which couldn't be read, and overall frames/s.
+#
+# Replays are independent, so throughput grows with the number of worker processes up to the number
+# of cores.
+#
+# Usage: python3 verify_archive.py [--fast] [--jobs <worker processes>] [--output <report.json>]
+#                                  <replay file or directory> [...]
+#   --fast re-runs through fast_logic.step instead of game_logic.update_state
+#
+# Exits with status 1 if any replay desynced or couldn't be read.
+
+import os
+import sys
+import json
+import struct
+import time
+import concurrent.futures
+import replay
+
+OPTION_DEFAULTS = {
+    "--jobs": None, # Defaults to the number of cores
+    "--output": None,
+}
+
+# Options that take no value, True if given
+FLAG_OPTIONS = {
+    "--fast",
+}
+
+USAGE = ("Usage: python3 verify_archive.py [--fast] [--jobs <worker processes>] [--output <report.json>]\n"
+         + "  <replay file or directory> [...]")
+
+# Chunks handed to each worker, more evens out the load when replay lengths vary, fewer costs less overhead
+CHUNKS_PER_WORKER = 4
+
+# True if the file at path starts like a replay file
+def is_replay_file(path):
+    try:
+        with open(path, "rb") as replay_file:
+            return replay_file.read(len(replay.MAGIC)) == replay.MAGIC
+    except OSError:
+        return False
+
+# Every replay file in paths, directories searched recursively, in a stable order
+def find_replays(paths):
+    replay_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, subdirectories, file_names in os.walk(path):
+                subdirectories.sort()
+                for file_name in sorted(file_names):
+                    file_path = os.path.join(directory, file_name)
+                    if is_replay_file(file_path):
+                        replay_paths.append(file_path)
+        else:
+            replay_paths.append(path) # Named on purpose, report it if it isn't a replay
+    return replay_paths
+
+# Verify one replay, in a worker process. Unreadable files are reported rather than raised
+def verify_file(path, fast=False):
+    try:
+        return replay.verify_replay(path, fast)
+    except (OSError, ValueError, struct.error) as e:
+        return {"path": path, "error": str(e)}
+
+# Verify every replay in replay_paths with jobs worker processes, yields each result in path order
+def verify_all(replay_paths, jobs, fast=False):
+    chunk_size = max(1, len(replay_paths) // (jobs * CHUNKS_PER_WORKER))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        yield from executor.map(verify_file, replay_paths, [fast] * len(replay_paths), chunksize=chunk_size)
+
+
+if __name__ == "__main__":
+    options = dict(OPTION_DEFAULTS)
+    for flag in FLAG_OPTIONS:
+        options[flag] = False
+    paths = []
+    arguments = sys.argv[1:]
+    while arguments:
+        if arguments[0] in FLAG_OPTIONS:
+            options[arguments[0]] = True
+            arguments = arguments[1:]
+        elif arguments[0] in options and len(arguments) >= 2:
+            options[arguments[0]] = arguments[1]
+            arguments = arguments[2:]
+        elif arguments[0].startswith("--"):
+            print(USAGE)
+            sys.exit(1)
+        else:
+            paths.append(arguments[0])
+            arguments = arguments[1:]
+
+    if not paths or (options["--jobs"] is not None and not options["--jobs"].isdigit()):
+        print(USAGE)
+        sys.exit(1)
+    jobs = max(1, int(options["--jobs"])) if options["--jobs"] is not None else os.cpu_count() or 1
+
+    replay_paths = find_replays(paths)
+    print(f"Verifying {len(replay_paths)} replays with {jobs} worker processes")
+
+    start_time = time.perf_counter()
+    results = []
+    desynced = 0
+    unreadable = 0
+    total_frames = 0
+    for result in verify_all(replay_paths, jobs, options["--fast"]):
+        results.append(result)
+        if "error" in result:
+            unreadable += 1
+            print(f"{result['path']}: UNREADABLE ({result['error']})")
+            continue
+        total_frames += result["frames"]
+        if result["mismatches"]:
+            desynced += 1
+            print(f"{result['path']}: DESYNC at frame {result['first_mismatch_frame']} ({result['mismatches']} of {result['checksums_checked']} checksums wrong)")
+    seconds = time.perf_counter() - start_time
+
+    print(f"{len(results)} replays, {desynced} desynced, {unreadable} unreadable, {total_frames} frames in {seconds:.1f}s"
+          + (f" ({total_frames / seconds:.0f} frames/s)" if seconds > 0 else ""))
+
+    if options["--output"]:
+        report = {
+            "replays": len(results),
+            "desynced": desynced,
+            "unreadable": unreadable,
+            "frames": total_frames,
+            "seconds": seconds,
+            "jobs": jobs,
+            "fast": options["--fast"],
+            "results": results,
+        }
+        with open(options["--output"], "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+    sys.exit(1 if desynced or unreadable else 0)
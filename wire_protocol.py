@@ -0,0 +1,150 @@
+# Aleksander Nowicki and Samuel Young
+# Dartmouth CS60 25F Final Project
+# 11/21/2025
+# Wire Protocol Module
+#
+# Compact binary framing for the messages both netcode modules send during a game.
+# Every message starts with a 2 byte header:
+#
+# +-------+-------+---------------+
+# |version| type  |payload length |
+# +-------+-------+---------------+
+#   4 bits  4 bits     8 bits
+#
+# followed by a payload whose layout depends on the type. A control message payload is the
+# frame number as an unsigned 32 bit integer followed by one byte holding the fast_logic
+# control bitfield, 7 bytes in total against ~30 for the old "FS1|frame|[true, false, true]|" text.
+#
+# An inputs message carries a run of one player's most recent inputs rather than a single frame,
+# so a lost or late message is covered by the next one. Its payload is the newest frame number,
+# the sender's ack (newest frame up to which it has every remote input), the sender's frame
+# advantage (signed byte, see time_sync), the number of runs, and the inputs oldest first, run
+# length encoded one byte per run:
+#
+# +------+----+
+# |length|bits|
+# +------+----+
+#  5 bits 3 bits
+#
+# Inputs rarely change between frames, so a whole unacknowledged window usually fits in a few bytes.
+#
+# MessageReader parses messages in place out of a single bytearray receive buffer, so several
+# messages arriving in one recv cost one pass over the bytes rather than a decode/re-encode each.
+
+import struct
+
+PROTOCOL_VERSION = 2
+
+# Message types
+MSG_START = 1 # Sent once by each player when ready to start the game, payload is the player number
+MSG_CONTROL = 2 # One player's controls for one frame
+MSG_INPUTS = 3 # One player's controls for a run of recent frames, plus an ack
+MSG_CHECKSUM = 4 # Checksum of one player's confirmed game state for a frame, see desync_detector
+
+HEADER = struct.Struct("!BB") # version << 4 | type, payload length
+
+# Payload layouts for each fixed size message type
+PAYLOADS = {
+    MSG_START: struct.Struct("!B"), # player number
+    MSG_CONTROL: struct.Struct("!IB"), # frame number, control bitfield
+    MSG_CHECKSUM: struct.Struct("!II"), # frame number, fast_logic.state_checksum
+}
+
+# Fixed part of an inputs message payload: newest frame number, ack frame number, frame advantage, number of runs
+INPUTS_PAYLOAD = struct.Struct("!IibB")
+
+# Longest run a single run length byte can hold
+MAX_RUN_LENGTH = 31
+
+# Build a full message of the given type from its payload fields
+def encode_message(msg_type, *fields):
+    payload = PAYLOADS[msg_type]
+    return HEADER.pack((PROTOCOL_VERSION << 4) | msg_type, payload.size) + payload.pack(*fields)
+
+# Returns byte message announcing this player is ready to start
+def encode_start(player_number):
+    return encode_message(MSG_START, player_number)
+
+# Returns byte message holding one frame's control bitfield
+def encode_control(frame_number, control_bits):
+    return encode_message(MSG_CONTROL, frame_number, control_bits)
+
+# Returns byte message holding the state checksum for a frame
+def encode_checksum(frame_number, checksum):
+    return encode_message(MSG_CHECKSUM, frame_number, checksum)
+
+# Returns byte message holding the control bitfields for the frames ending at newest_frame (oldest first)
+# along with the sender's ack frame and frame advantage
+def encode_inputs(newest_frame, ack_frame, advantage, inputs):
+    runs = bytearray()
+    run_bits = None
+    run_length = 0
+    for bits in inputs:
+        if bits == run_bits and run_length < MAX_RUN_LENGTH:
+            run_length += 1
+        else:
+            if run_length:
+                runs.append((run_length << 3) | run_bits)
+            run_bits = bits
+            run_length = 1
+    if run_length:
+        runs.append((run_length << 3) | run_bits)
+
+    payload_length = INPUTS_PAYLOAD.size + len(runs)
+    return (HEADER.pack((PROTOCOL_VERSION << 4) | MSG_INPUTS, payload_length)
+          + INPUTS_PAYLOAD.pack(newest_frame, ack_frame, advantage, len(runs)) + runs)
+
+# Decode an inputs message payload into (newest frame, ack frame, frame advantage, tuple of control bitfields oldest first)
+def decode_inputs(buffer, start, length):
+    newest_frame, ack_frame, advantage, run_count = INPUTS_PAYLOAD.unpack_from(buffer, start)
+    if INPUTS_PAYLOAD.size + run_count != length:
+        raise ValueError("Inputs message length does not match its run count")
+
+    inputs = []
+    run_start = start + INPUTS_PAYLOAD.size
+    for run in buffer[run_start:run_start + run_count]:
+        inputs.extend([run & 0x07] * (run >> 3))
+    return newest_frame, ack_frame, advantage, tuple(inputs)
+
+
+# Accumulates received bytes and hands back one decoded message at a time
+class MessageReader:
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offset = 0 # Start of the first message not yet decoded
+
+    # Add newly received bytes to the buffer
+    def feed(self, data):
+        # Drop already decoded messages first, at most once per recv
+        if self.offset:
+            del self.buffer[:self.offset]
+            self.offset = 0
+        self.buffer += data
+
+    # Returns (msg_type, field, ...) for the next complete message, or None if one hasn't fully arrived yet
+    # Raises ValueError if the stream doesn't hold a valid message, the connection can't be recovered from that
+    def next_message(self):
+        buffer = self.buffer
+        offset = self.offset
+
+        if len(buffer) - offset < HEADER.size:
+            return None
+
+        version_type, length = HEADER.unpack_from(buffer, offset)
+        end = offset + HEADER.size + length
+        if len(buffer) < end:
+            return None
+
+        if version_type >> 4 != PROTOCOL_VERSION:
+            raise ValueError(f"Unsupported protocol version {version_type >> 4}")
+
+        msg_type = version_type & 0x0F
+        self.offset = end
+
+        if msg_type == MSG_INPUTS:
+            return (msg_type,) + decode_inputs(buffer, offset + HEADER.size, length)
+
+        payload = PAYLOADS.get(msg_type)
+        if payload is None or payload.size != length:
+            raise ValueError(f"Invalid message type {msg_type} with length {length}")
+        return (msg_type,) + payload.unpack_from(buffer, offset + HEADER.size)